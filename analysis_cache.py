@@ -0,0 +1,177 @@
+"""
+Disk cache of arrays derived from event files (histograms, per-pixel counts, binned time series, ROI subsets).
+
+An entry is keyed by the fingerprint of the source file, by the version of the product and by the normalized
+parameters of the computation, and is stored as a .npz file in the cache directory ($EVENT_CACHE_DIR,
+~/.cache/event_analysis by default). Entries of a file are ignored as soon as the file changes, entries of a product
+as soon as its version is bumped (which is done whenever the code computing it changes its results), and the least
+recently used entries are removed when the cache grows over its size limit ($EVENT_CACHE_MAX_BYTES, 2 GB by default).
+"""
+
+import os
+import json
+import glob
+import hashlib
+import numpy as np
+
+CACHE_DIR_ENV = 'EVENT_CACHE_DIR'
+MAX_BYTES_ENV = 'EVENT_CACHE_MAX_BYTES'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'event_analysis')
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+# bytes hashed at the beginning and at the end of a file
+SAMPLE_BYTES = 2**20
+
+
+def source_fingerprint(path):
+    """
+    Returns a fingerprint of an event file (or of the files of a pixel store directory).
+
+    The fingerprint combines the size and modification time of the file with a hash of its first and last
+    megabyte, so that it changes when the file is rewritten without reading the whole file.
+    """
+    if os.path.isdir(path):
+        return hashlib.sha1(''.join(source_fingerprint(os.path.join(path, name))
+                                    for name in sorted(os.listdir(path))).encode()).hexdigest()
+    stat = os.stat(path)
+    sha = hashlib.sha1('{}:{}'.format(stat.st_size, stat.st_mtime_ns).encode())
+    with open(path, 'rb') as f:
+        sha.update(f.read(SAMPLE_BYTES))
+        if stat.st_size > SAMPLE_BYTES:
+            f.seek(max(SAMPLE_BYTES, stat.st_size - SAMPLE_BYTES), os.SEEK_SET)
+            sha.update(f.read(SAMPLE_BYTES))
+    return sha.hexdigest()
+
+
+def _normalize(value):
+    """Turns parameters into JSON values, so that e.g. 10, np.int64(10) and 10.0 give the same key."""
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return int(value) if float(value).is_integer() else float(value)
+    return value
+
+
+def cache_key(name, path, version=1, **params):
+    """Returns the key of the version `version` of the product `name` of the file `path` computed with `params`."""
+    description = {'name': name, 'version': _normalize(version), 'source': source_fingerprint(path),
+                   'params': _normalize(params)}
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+class AnalysisCache(object):
+    """
+    Size-bounded LRU cache of dictionaries of numpy arrays, stored as .npz files.
+
+    Args:
+        cache_dir (str): Cache directory ($EVENT_CACHE_DIR or ~/.cache/event_analysis if None).
+        max_bytes (int): Maximum size of the cache ($EVENT_CACHE_MAX_BYTES or 2 GB if None).
+
+    Examples:
+        >>> cache = AnalysisCache()
+        >>> arrays = cache.cached("counts", "recording.csv", lambda: {'counts': compute_counts()}, version=2,
+        >>>                       tmax=1000000)
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(os.environ.get(MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+        self.max_bytes = int(max_bytes)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'AnalysisCache: path {} \n'.format(self.cache_dir)
+        wrd += 'entries : {}, size {} / {} bytes\n'.format(len(self._entries()), self.size(), self.max_bytes)
+        return wrd
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def _entries(self):
+        return glob.glob(os.path.join(self.cache_dir, '*.npz'))
+
+    def size(self):
+        """Returns the total size of the entries in bytes."""
+        return sum(os.path.getsize(path) for path in self._entries())
+
+    def get(self, key):
+        """Returns the arrays stored under `key`, or None."""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+        # the modification time orders entries for eviction
+        os.utime(path)
+        return arrays
+
+    def put(self, key, arrays):
+        """Stores a dictionary of arrays under `key`, then evicts entries if the cache is too large."""
+        path = self._path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for path in self._entries():
+            os.remove(path)
+
+    def cached(self, name, path, compute, version=1, **params):
+        """
+        Returns the product `name` of the file `path`, computing and storing it if it is not in the cache.
+
+        Args:
+            name (str): Name of the derived product.
+            path (str): Path to the source event file.
+            compute (function): Function without arguments returning the product as a dictionary of arrays.
+            version (int or str): Version of the product, to bump whenever `compute` changes its results so
+                that the entries computed by the previous code are not reused.
+            **params: Parameters the product depends on.
+
+        Returns:
+            dictionary of numpy arrays (scalars are returned as 0-d arrays, whether they come from the cache
+            or not)
+        """
+        key = cache_key(name, path, version=version, **params)
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = {k: np.asarray(v) for k, v in compute().items()}
+            self.put(key, arrays)
+        return arrays
+
+
+def cached(name, path, compute, use_cache=True, version=1, **params):
+    """Shortcut for `AnalysisCache().cached(...)`, calling `compute` directly if `use_cache` is False."""
+    if not use_cache:
+        return {k: np.asarray(v) for k, v in compute().items()}
+    return AnalysisCache().cached(name, path, compute, version=version, **params)
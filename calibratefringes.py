@@ -0,0 +1,55 @@
+import matplotlib.pyplot as plt
+import argparse
+import numpy as np
+from fringe_calibration import calibrate_fringes
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the fringe phase tables of every column, or block of columns, of the sensor and save them to a calibration file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
+    parser.add_argument('-o', '--output', required=True, help='Path to the .npz calibration file.')
+    parser.add_argument('--tmin', type=int, required=True, help='Start of the calibration time range.')
+    parser.add_argument('--tmax', type=int, required=True, help='End of the calibration time range.')
+    parser.add_argument('--xmin', type=int, required=False, default=None, help='Minimum X coordinate.')
+    parser.add_argument('--xmax', type=int, required=False, default=None, help='Maximum X coordinate.')
+    parser.add_argument('--ymin', type=int, required=False, default=None, help='Minimum Y coordinate.')
+    parser.add_argument('--ymax', type=int, required=False, default=None, help='Maximum Y coordinate.')
+    parser.add_argument('--block-width', type=int, required=False, default=1, help='Number of columns sharing a phase table.')
+    parser.add_argument('--window-us', type=int, required=False, default=50, help='Duration of each calibration window (us).')
+    parser.add_argument('--num-windows', type=int, required=False, default=32, help='Number of calibration windows spread over the time range.')
+    parser.add_argument('--distance', type=int, required=False, default=10, help='Minimum distance between two fringe boundaries (events).')
+    parser.add_argument('--prominence', type=float, required=False, default=2, help='Minimum prominence of a fringe boundary (rows).')
+    parser.add_argument('--min-period', type=float, required=False, default=4, help='Minimum fringe period (rows).')
+    parser.add_argument('--max-period', type=float, required=False, default=None, help='Maximum fringe period (rows), half the rows if not set.')
+    parser.add_argument('--workers', type=int, required=False, default=None, help='Number of worker processes.')
+    parser.add_argument('--no-plot', action='store_true', help='Do not plot the tables.')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # Build the phase table of each block of columns
+    calibration = calibrate_fringes(args.input_csv, args.tmin, args.tmax, args.xmin, args.xmax, args.ymin, args.ymax,
+                                    block_width=args.block_width, window_us=args.window_us, num_windows=args.num_windows,
+                                    distance=args.distance, prominence=args.prominence, min_period=args.min_period,
+                                    max_period=args.max_period, workers=args.workers)
+    print(calibration)
+    calibration.save(args.output)
+    if args.no_plot or not len(calibration):
+        return
+
+    # Plot the fringe period and the phase tables of all the blocks
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
+    ax1.plot((calibration.xmin + calibration.xmax) / 2, calibration.period, 'o-')
+    ax1.set_xlabel('Column (x)')
+    ax1.set_ylabel('Fringe period (rows)')
+    ax1.grid(True)
+    for y0, phiroi in zip(calibration.y0, calibration.tables):
+        ax2.plot(np.arange(y0, y0 + len(phiroi)), phiroi, linewidth=0.5)
+    ax2.set_xlabel('Row (y)')
+    ax2.set_ylabel('Phase (rad)')
+    ax2.grid(True)
+    plt.tight_layout()
+    plt.show()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Batched fits of A cos(2pi f x + phi) + offset to many lines of samples at once, e.g. the polarity (-1 or 1) of
+the events of every column of pixels, or of every (column, time window) pair, as a function of their row.
+
+The samples of all the lines are given as flat arrays with the line (group) of each sample, and every sum over
+the samples of a line is computed for all the lines with np.bincount:
+    -> frequency guess: peak of the FFT of each line binned onto a regular grid, all lines in one rfft
+    -> amplitude and phase: linear least squares in (cos, sin, 1) for fixed frequencies, a 3x3 system per line
+       solved by a batched np.linalg.solve
+    -> optional refinement of the frequency: damped Gauss-Newton (Levenberg-Marquardt) iterations on
+       (cos, sin, 1, frequency), run on all the lines together
+
+Examples:
+    >>> fit = fit_event_lines(df['x'].values, df['y'].values, df['p'].values, df['t'].values, window_us=10000)
+    >>> plt.scatter(fit['line'], fit['frequency'])
+"""
+
+import numpy as np
+
+
+def _group_sum(group, weights, num_groups):
+    return np.bincount(group, weights=weights, minlength=num_groups)
+
+
+def _flatten(x, values, group, num_groups):
+    """Returns flat (x, values, group, num_groups) from flat arrays with groups or from (lines, n) arrays."""
+    values = np.asarray(values, dtype=np.float64)
+    if group is None:
+        values = np.atleast_2d(values)
+        x = np.broadcast_to(np.asarray(x, dtype=np.float64), values.shape)
+        group = np.repeat(np.arange(values.shape[0]), values.shape[1])
+        return x.ravel(), values.ravel(), group, values.shape[0]
+    group = np.asarray(group, dtype=np.int64)
+    num_groups = int(group.max()) + 1 if num_groups is None else num_groups
+    return np.asarray(x, dtype=np.float64), values, group, num_groups
+
+
+def fft_peak_frequency(x, values, group=None, num_groups=None, dx=1, fmin=None, fmax=None, oversampling=4):
+    """
+    Frequency of the highest FFT peak of each line, in cycles per unit of x.
+
+    The samples of each line are summed onto a grid of step dx starting at the first sample of the line, and the
+    grids of all the lines, zero-padded to oversampling times the longest line, are transformed by one rfft.
+
+    Args:
+        x, values (numpy array): Positions and values of the samples, flat with `group`, or (lines, n) arrays.
+        group (numpy array): Line of each sample.
+        num_groups (int): Number of lines (max(group) + 1 if None).
+        dx (float): Step of the grid (1 for rows of pixels).
+        fmin, fmax (float): Frequency range of the peak (1 / span of the line and 1 / (2 dx) if None).
+
+    Returns:
+        (num_groups,) frequencies, NaN for the lines without samples
+    """
+    x, values, group, num_groups = _flatten(x, values, group, num_groups)
+    start = np.full(num_groups, np.inf)
+    np.minimum.at(start, group, x)
+    index = np.rint((x - start[group]) / dx).astype(np.int64)
+    length = int(index.max()) + 1 if len(index) else 1
+    counts = np.bincount(group, minlength=num_groups)
+    means = _group_sum(group, values, num_groups) / np.maximum(counts, 1)
+    grid = np.bincount(group * length + index, weights=values - means[group], minlength=num_groups * length)
+    n_fft = oversampling * length
+    power = np.abs(np.fft.rfft(grid.reshape(num_groups, length), n=n_fft, axis=1)) ** 2
+    freqs = np.fft.rfftfreq(n_fft, d=dx)
+    band = freqs >= (fmin if fmin is not None else 1 / (length * dx))
+    band &= freqs <= (fmax if fmax is not None else 0.5 / dx)
+    if not band.any():
+        return np.full(num_groups, np.nan)
+    peak = freqs[band][np.argmax(power[:, band], axis=1)]
+    return np.where(counts > 0, peak, np.nan)
+
+
+def _design_sums(x, values, group, num_groups, omega):
+    """Normal equations of the linear fit values ~ a cos(omega x) + b sin(omega x) + c of every line."""
+    c, s = np.cos(omega[group] * x), np.sin(omega[group] * x)
+    columns = (c, s, np.ones(len(x)))
+    normal = np.empty((num_groups, 3, 3))
+    rhs = np.empty((num_groups, 3))
+    for i in range(3):
+        rhs[:, i] = _group_sum(group, columns[i] * values, num_groups)
+        for j in range(i, 3):
+            normal[:, i, j] = normal[:, j, i] = _group_sum(group, columns[i] * columns[j], num_groups)
+    return normal, rhs
+
+
+def _solve(normal, rhs):
+    """Batched solution of the systems, NaN for the singular ones."""
+    solution = np.full(rhs.shape, np.nan)
+    # unit diagonal, so that the determinant measures the conditioning whatever the scale of the columns
+    scale = np.sqrt(np.einsum('gii->gi', normal))
+    ok = np.flatnonzero((scale > 0).all(axis=1))
+    scaled = normal[ok] / (scale[ok, :, None] * scale[ok, None, :])
+    regular = np.abs(np.linalg.det(scaled)) > 1e-12
+    ok, scaled = ok[regular], scaled[regular]
+    if len(ok):
+        solution[ok] = np.linalg.solve(scaled, (rhs[ok] / scale[ok])[..., None])[..., 0] / scale[ok]
+    return solution
+
+
+def _cost(x, values, group, num_groups, params):
+    model = (params[group, 0] * np.cos(params[group, 3] * x) + params[group, 1] * np.sin(params[group, 3] * x)
+             + params[group, 2])
+    return _group_sum(group, (values - model) ** 2, num_groups)
+
+
+def fit_cosines(x, values, group=None, num_groups=None, frequency=None, refine=True, iterations=20, dx=1, fmin=None,
+                fmax=None, tol=1e-6):
+    """
+    Fits values = amplitude * cos(2pi frequency x + phase) + offset to every line.
+
+    Args:
+        x, values (numpy array): Positions and values of the samples, flat with `group`, or (lines, n) arrays.
+        group (numpy array): Line of each sample.
+        num_groups (int): Number of lines (max(group) + 1 if None).
+        frequency (float or numpy array): Frequency of every line, in cycles per unit of x (FFT peak if None).
+        refine (bool): Whether to refine the frequencies by Gauss-Newton iterations.
+        iterations (int): Maximum number of iterations.
+        dx, fmin, fmax: Parameters of the FFT guess, see `fft_peak_frequency`.
+        tol (float): Relative decrease of the total cost under which the iterations stop.
+
+    Returns:
+        dictionary of (num_groups,) arrays: frequency, phase (in (-pi, pi]), amplitude, offset, rms (residual)
+        and count (number of samples); NaN for the lines with too few samples
+    """
+    x, values, group, num_groups = _flatten(x, values, group, num_groups)
+    counts = np.bincount(group, minlength=num_groups)
+    if frequency is None:
+        frequency = fft_peak_frequency(x, values, group, num_groups, dx=dx, fmin=fmin, fmax=fmax)
+    omega = 2 * np.pi * np.broadcast_to(np.asarray(frequency, dtype=np.float64), (num_groups,))
+    # positions relative to the center of each line, for the conditioning of the systems
+    center = _group_sum(group, x, num_groups) / np.maximum(counts, 1)
+    xc = x - center[group]
+    omega = np.nan_to_num(omega)
+
+    # linear least squares for the fixed frequencies
+    params = np.empty((num_groups, 4))
+    params[:, :3] = _solve(*_design_sums(xc, values, group, num_groups, omega))
+    params[:, 3] = omega
+    params[counts < 3] = np.nan
+
+    if refine:
+        valid = np.flatnonzero(np.isfinite(params).all(axis=1) & (counts >= 4))
+        # samples of the lines refined, with their lines renumbered
+        keep = np.isin(group, valid)
+        renumber = np.full(num_groups, -1)
+        renumber[valid] = np.arange(len(valid))
+        rx, rv, rg, m = xc[keep], values[keep], renumber[group[keep]], len(valid)
+        p = params[valid]
+        # cos, sin and residual of the samples for the current parameters, updated with the accepted steps
+        c, s = np.cos(p[rg, 3] * rx), np.sin(p[rg, 3] * rx)
+        residual = rv - (p[rg, 0] * c + p[rg, 1] * s + p[rg, 2])
+        cost = _group_sum(rg, residual ** 2, m)
+        damping = np.full(m, 1e-3)
+        for _ in range(iterations):
+            if not m:
+                break
+            columns = (c, s, np.ones(len(rx)), rx * (p[rg, 1] * c - p[rg, 0] * s))
+            normal = np.empty((m, 4, 4))
+            rhs = np.empty((m, 4))
+            for i in range(4):
+                rhs[:, i] = _group_sum(rg, columns[i] * residual, m)
+                for j in range(i, 4):
+                    normal[:, i, j] = normal[:, j, i] = _group_sum(rg, columns[i] * columns[j], m)
+            diagonal = np.einsum('gii->gi', normal)
+            normal[:, np.arange(4), np.arange(4)] += damping[:, None] * diagonal
+            step = np.nan_to_num(_solve(normal, rhs))
+            trial = p + step
+            trial_c, trial_s = np.cos(trial[rg, 3] * rx), np.sin(trial[rg, 3] * rx)
+            trial_residual = rv - (trial[rg, 0] * trial_c + trial[rg, 1] * trial_s + trial[rg, 2])
+            trial_cost = _group_sum(rg, trial_residual ** 2, m)
+            better = trial_cost < cost
+            accepted = better[rg]
+            c = np.where(accepted, trial_c, c)
+            s = np.where(accepted, trial_s, s)
+            residual = np.where(accepted, trial_residual, residual)
+            p[better] = trial[better]
+            decrease = (cost[better] - trial_cost[better]).sum()
+            cost[better] = trial_cost[better]
+            damping = np.where(better, damping / 10, damping * 10)
+            if decrease <= tol * max(cost.sum(), 1e-300) and better.any():
+                break
+        params[valid] = p
+
+    amplitude = np.hypot(params[:, 0], params[:, 1])
+    omega = params[:, 3]
+    # a cos(w (x - m)) + b sin(w (x - m)) = amplitude cos(w x - w m - atan2(b, a))
+    phase = np.angle(np.exp(1j * (-np.arctan2(params[:, 1], params[:, 0]) - omega * center)))
+    sign = np.sign(omega)
+    residual = _cost(xc, values, group, num_groups, np.nan_to_num(params))
+    return {'frequency': np.abs(omega) / (2 * np.pi), 'phase': np.where(sign < 0, -phase, phase),
+            'amplitude': amplitude, 'offset': params[:, 2], 'rms': np.sqrt(residual / np.maximum(counts, 1)),
+            'count': counts}
+
+
+def fit_event_lines(x, y, p, t, window_us=None, axis='y', refine=True, frequency=None, fmin=None, fmax=None):
+    """
+    Fits the polarity (-1 for OFF, 1 for ON events) of every column (axis 'y') or row (axis 'x') of pixels, and
+    every time window, as a cosine of the position along the line.
+
+    Args:
+        x, y, p, t (numpy array): Coordinates, polarities and timestamps of the events.
+        window_us (int): Duration of the time windows (a single window if None).
+        axis (str): Coordinate along the lines, 'y' (lines are columns) or 'x' (lines are rows).
+        refine, frequency, fmin, fmax: see `fit_cosines`.
+
+    Returns:
+        dictionary of the fits of `fit_cosines`, of the lines with events, with their 'line' coordinate (x for
+        columns, y for rows) and the 't' start of their window
+    """
+    x, y = np.asarray(x, dtype=np.int64), np.asarray(y, dtype=np.int64)
+    t = np.asarray(t, dtype=np.int64)
+    position, line = (y, x) if axis == 'y' else (x, y)
+    line0, t0 = line.min(), t.min()
+    window = np.zeros(len(t), dtype=np.int64) if window_us is None else (t - t0) // window_us
+    num_windows = int(window.max()) + 1
+    keys, group = np.unique((line - line0) * num_windows + window, return_inverse=True)
+    values = np.where(np.asarray(p) == 1, 1., -1.)
+    fit = fit_cosines(position, values, group.ravel(), len(keys), frequency=frequency, refine=refine, fmin=fmin,
+                      fmax=fmax)
+    fit['line'] = line0 + keys // num_windows
+    fit['t'] = t0 + (keys % num_windows) * (window_us or 0)
+    return fit
@@ -0,0 +1,29 @@
+"""
+Builds the time index of existing CSV event files, so that loading a time range only reads the matching part
+of the file. Files written by CSVWriter already come with their index.
+"""
+
+from csv_tools import build_time_index, DEFAULT_BUCKET_US
+
+
+def parse_args():
+    import argparse
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Build the time index of CSV event files.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('input_csv', nargs='+', help="Path to CSV files with rows x,y,p,t sorted by time")
+    parser.add_argument('--bucket-us', type=int, default=DEFAULT_BUCKET_US, help="Time resolution of the index in us.")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    for input_csv in args.input_csv:
+        index = build_time_index(input_csv, bucket_us=args.bucket_us)
+        print(f"{input_csv}: {len(index)} non-empty buckets of {index.bucket_us} us")
+
+
+if __name__ == "__main__":
+    main()
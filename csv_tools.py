@@ -0,0 +1,524 @@
+"""
+Defines tools to handle CSV event files, mimicking dat_tools.py.
+In particular :
+    -> defines a vectorized encoder formatting whole event slices as CSV text in a preallocated byte buffer
+    -> defines a writer class formatting slices in a thread pool and writing them with one call per slice
+    -> defines a loader parsing CSV files by chunks in a thread pool, with narrow dtypes, and keeping only
+       the events inside the requested x/y/t/polarity ranges
+    -> defines a sidecar time index giving the byte offset of the first row of each time bucket, so that the
+       loader only reads the part of a time-sorted file covering the requested time range
+
+Rows are written as "x,y,p,t". A "%geometry:<width>,<height>" header line can be emitted, as parsed by
+metavision_csv_viewer.py.
+"""
+
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+COLUMNS = ('x', 'y', 'p', 't')
+
+CSV_DTYPES = {'x': np.uint16, 'y': np.uint16, 'p': np.uint8, 't': np.int64}
+
+# the time index of "events.csv" is stored in "events.csv.tidx.npz"
+TIME_INDEX_SUFFIX = '.tidx.npz'
+DEFAULT_BUCKET_US = 1000
+
+_POWERS_OF_TEN = 10 ** np.arange(1, 19, dtype=np.int64)
+
+
+def _num_digits(values):
+    """Returns the number of decimal digits of non-negative int64 values."""
+    return np.searchsorted(_POWERS_OF_TEN, values, side='right') + 1
+
+
+def _write_digits(buf, pos, values, ndigits):
+    """Writes the decimal representation of `values` in `buf`, starting at positions `pos`."""
+    end = pos + ndigits - 1
+    values = values.copy()
+    dmin = int(ndigits.min())
+    for k in range(int(ndigits.max())):
+        if k < dmin:
+            # every value still has a digit to write
+            values, digit = np.divmod(values, 10)
+            buf[end - k] = digit + 48
+        else:
+            idx = np.flatnonzero(ndigits > k)
+            values[idx], digit = np.divmod(values[idx], 10)
+            buf[end[idx] - k] = digit + 48
+
+
+def format_events(events, columns=COLUMNS):
+    """
+    Formats events as CSV rows with vectorized integer to ASCII conversion.
+
+    Args :
+        events (numpy array): structured array (or dictionary of arrays) with integer fields
+        columns (tuple): names of the fields to write, in order
+
+    Returns :
+        numpy uint8 array holding the encoded rows, ready to be written to a binary file
+    """
+    return _format_rows(events, columns)[0]
+
+
+def _format_rows(events, columns=COLUMNS):
+    """Same as `format_events`, also returning the int64 end position of each row in the buffer."""
+    n = len(events[columns[0]])
+    if n == 0:
+        return np.empty((0,), dtype=np.uint8), np.empty((0,), dtype=np.int64)
+    values = []
+    negatives = []
+    ndigits = []
+    width = np.full(n, len(columns), dtype=np.int64)  # separators and end of line
+    for name in columns:
+        v = np.asarray(events[name]).astype(np.int64)
+        neg = v < 0
+        if neg.any():
+            v = np.abs(v)
+            width += neg
+        else:
+            neg = None
+        nd = _num_digits(v)
+        width += nd
+        if nd.max() < 10:
+            # divisions are much cheaper on 32 bits
+            v = v.astype(np.int32)
+        values.append(v)
+        negatives.append(neg)
+        ndigits.append(nd)
+
+    ends = np.cumsum(width)
+    pos = ends - width
+    buf = np.empty(int(ends[-1]), dtype=np.uint8)
+    for i, (v, neg, nd) in enumerate(zip(values, negatives, ndigits)):
+        if neg is not None:
+            buf[pos[neg]] = ord('-')
+            pos += neg
+        _write_digits(buf, pos, v, nd)
+        pos += nd
+        buf[pos] = ord(',') if i < len(columns) - 1 else ord('\n')
+        pos += 1
+    return buf, ends
+
+
+def geometry_header(width, height):
+    """Returns the header line giving the sensor size, as parsed by metavision_csv_viewer.py."""
+    return "%geometry:{},{}\n".format(width, height)
+
+
+class CSVWriter(object):
+    """Convenience class used to write events to a CSV file at high throughput.
+
+    Each slice passed to `write` is split into chunks formatted in parallel in a thread pool (numpy releases
+    the GIL on these operations), then written to the file in a single call. Formatting of a slice overlaps
+    with the writing of the previous one.
+
+    Since the length of every row is known when formatting, the time index of the file (see `TimeIndex`) is
+    built along the way and saved next to it on `close`, unless the events were not written in chronological
+    order.
+
+    Args:
+        filename (string): Path to the destination file
+        height (int): Imager height in pixels, written in the "%geometry" header if given with width
+        width (int): Imager width in pixels, written in the "%geometry" header if given with height
+        workers (int): Number of formatting threads (as many as CPUs if None)
+        chunk_size (int): Number of events formatted by one task
+        index_bucket_us (int): Time resolution of the index in us (no index is written if None)
+
+    Examples:
+        >>> with CSVWriter("my_file.csv", height=720, width=1280) as writer:
+        >>>     for evs in EventsIterator("my_file.raw"):
+        >>>         writer.write(evs)
+    """
+
+    def __init__(self, filename, height=None, width=None, workers=None, chunk_size=2**18,
+                 index_bucket_us=DEFAULT_BUCKET_US):
+        self._path = filename
+        self.height = height
+        self.width = width
+        self.chunk_size = int(chunk_size)
+        self.file = open(filename, 'wb')
+        if height is not None and width is not None:
+            self.file.write(geometry_header(width, height).encode('ascii'))
+        self._offset = self.file.tell()
+        self._index = _TimeIndexBuilder(index_bucket_us) if index_bucket_us else None
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self._pending = []
+        self._pending_t = None
+        self.ev_count = 0
+        self._closed = False
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'CSVWriter: path {} \n'.format(self._path)
+        wrd += 'Width {}, Height  {}\n'.format(self.width, self.height)
+        wrd += 'events written : {}\n'.format(self.ev_count)
+        return wrd
+
+    def write(self, events):
+        """
+        Writes events of fields x,y,p,t into the file.
+
+        Args:
+            events (numpy array): Events to write
+        """
+        if not len(events):
+            return
+        futures = [self._pool.submit(_format_rows, events[start:start + self.chunk_size])
+                   for start in range(0, len(events), self.chunk_size)]
+        self._drain()
+        self._pending = futures
+        self._pending_t = events['t']
+        self.ev_count += len(events)
+
+    def _drain(self):
+        """Writes the previously formatted slice."""
+        if not self._pending:
+            return
+        results = [f.result() for f in self._pending]
+        self._pending = []
+        chunks = [buf for buf, _ in results]
+        if self._index is not None:
+            # start of each row = end of the previous one
+            ends, shift = [], self._offset
+            for buf, row_ends in results:
+                ends.append(row_ends + shift)
+                shift += len(buf)
+            ends = np.concatenate(ends)
+            starts = np.concatenate(([self._offset], ends[:-1]))
+            self._index.add(np.asarray(self._pending_t), starts)
+        self._pending_t = None
+        data = chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+        self.file.write(data)
+        self._offset += len(data)
+
+    def close(self):
+        if self._closed:
+            return
+        self._drain()
+        self._pool.shutdown()
+        self.file.close()
+        if self._index is not None:
+            self._index.save(self._path, self._offset)
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_closed"):
+            self.close()
+
+
+def parse_header(f):
+    """
+    Skips the header lines (starting with '%' or '#') of a CSV event file.
+
+    Args:
+        f (file): File handle to a CSV file opened in binary mode.
+
+    Returns:
+        int position of the first data row
+        size (height, width) tuple of int or None, parsed from a "%geometry:<width>,<height>" line
+    """
+    f.seek(0, os.SEEK_SET)
+    size = [None, None]
+    while True:
+        bod = f.tell()
+        line = f.readline()
+        if not line.startswith((b'%', b'#')):
+            break
+        if line.startswith(b'%geometry:'):
+            dimensions = [int(v) for v in line[10:].split(b',')]
+            if len(dimensions) == 2:
+                size = [dimensions[1], dimensions[0]]
+    f.seek(bod, os.SEEK_SET)
+    return bod, size
+
+
+def range_mask(x, y, p, t, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None, polarity=None):
+    """Builds a single boolean mask for all the given ranges (bounds included)."""
+    mask = np.ones(len(t), dtype=bool)
+    for values, bound, lower in ((x, xmin, True), (x, xmax, False), (y, ymin, True), (y, ymax, False),
+                                 (t, tmin, True), (t, tmax, False)):
+        if bound is not None:
+            if lower:
+                mask &= values >= bound
+            else:
+                mask &= values <= bound
+    if polarity is not None:
+        mask &= p == polarity
+    return mask
+
+
+def _parse_chunk(buf, ranges):
+    """Parses a block of complete CSV rows and returns the columns of the rows matching `ranges`."""
+    df = pd.read_csv(io.BytesIO(buf), header=None, names=COLUMNS, dtype=CSV_DTYPES, comment='#', engine='c')
+    columns = [df[name].to_numpy() for name in COLUMNS]
+    if ranges:
+        mask = range_mask(*columns, **ranges)
+        if not mask.all():
+            columns = [c[mask] for c in columns]
+    return columns
+
+
+def _iter_blocks(f, start, stop, chunk_bytes):
+    """Yields (offset, block) pairs of complete rows read from `start` to `stop` (end of file if None)."""
+    f.seek(start, os.SEEK_SET)
+    pos = start
+    offset = start
+    remainder = b''
+    while stop is None or pos < stop:
+        size = chunk_bytes if stop is None else min(chunk_bytes, stop - pos)
+        data = f.read(size)
+        if not data:
+            break
+        pos += len(data)
+        data = remainder + data
+        cut = data.rfind(b'\n') + 1
+        if cut == 0:
+            remainder = data
+            continue
+        remainder = data[cut:]
+        yield offset, data[:cut]
+        offset += cut
+    if remainder.strip():
+        yield offset, remainder
+
+
+class TimeIndex(object):
+    """
+    Byte offsets of the time buckets of a CSV file sorted by time.
+
+    Only the buckets holding rows are stored: `offsets[i]` is the position of the first row of the bucket
+    `buckets[i]`, i.e. the first row with t >= t0 + buckets[i] * bucket_us, and the last offset is the end of the
+    data. The size of the index therefore depends on the number of rows, not on the time span of the file (a
+    single outlier timestamp does not add empty buckets). The size and modification time of the CSV file are
+    saved with the offsets, so that an index is ignored as soon as the file it describes changes.
+
+    Attributes:
+        bucket_us (int): time resolution of the index in us
+        t0 (int): start time of the first bucket in us
+        buckets (numpy array): sorted int64 numbers of the buckets holding rows
+        offsets (numpy array): int64 byte offsets, one per bucket plus the end of the data
+
+    Examples:
+        >>> index = TimeIndex.load("my_file.csv") or build_time_index("my_file.csv")
+        >>> start, stop = index.byte_range(tmin, tmax)
+    """
+
+    def __init__(self, bucket_us, t0, offsets, buckets=None):
+        self.bucket_us = int(bucket_us)
+        self.t0 = int(t0)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        # indexes written before the sparse format have one offset per bucket
+        self.buckets = np.arange(len(self.offsets) - 1) if buckets is None else np.asarray(buckets, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def __repr__(self):
+        wrd = 'TimeIndex: {} buckets of {} us\n'.format(len(self), self.bucket_us)
+        wrd += 'Start time: {} us\n'.format(self.t0)
+        return wrd
+
+    @staticmethod
+    def path(input_csv):
+        return input_csv + TIME_INDEX_SUFFIX
+
+    @classmethod
+    def load(cls, input_csv):
+        """Returns the index of `input_csv`, or None if there is none or if it is out of date."""
+        try:
+            with np.load(cls.path(input_csv)) as data:
+                stat = os.stat(input_csv)
+                if int(data['source_size']) != stat.st_size or int(data['source_mtime_ns']) != stat.st_mtime_ns:
+                    return None
+                return cls(data['bucket_us'], data['t0'], data['offsets'],
+                           data['buckets'] if 'buckets' in data else None)
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, input_csv):
+        stat = os.stat(input_csv)
+        with open(self.path(input_csv), 'wb') as f:
+            np.savez(f, bucket_us=self.bucket_us, t0=self.t0, offsets=self.offsets, buckets=self.buckets,
+                     source_size=stat.st_size, source_mtime_ns=stat.st_mtime_ns)
+
+    def byte_range(self, tmin=None, tmax=None):
+        """Returns the (start, stop) byte offsets of the rows that can be in [tmin, tmax].
+
+        The range is aligned on buckets, so rows must still be filtered on their timestamps. `stop` is None
+        when `tmax` is None.
+        """
+        # the rows of bucket k start at the first stored bucket >= k (or at the end of the data)
+        start = int(self.offsets[0])
+        if tmin is not None:
+            k = (int(tmin) - self.t0) // self.bucket_us
+            start = int(self.offsets[np.searchsorted(self.buckets, k, side='left')])
+        stop = None
+        if tmax is not None:
+            k = (int(tmax) - self.t0) // self.bucket_us + 1
+            stop = int(self.offsets[np.searchsorted(self.buckets, k, side='left')])
+        return start, stop
+
+
+class _TimeIndexBuilder(object):
+    """Collects the offsets of the buckets of rows appended in chronological order."""
+
+    def __init__(self, bucket_us):
+        self.bucket_us = int(bucket_us)
+        self.t0 = None
+        self.last_t = None
+        self.last_bucket = -1
+        self.buckets = []
+        self.offsets = []
+        self.sorted = True
+
+    def add(self, t, row_starts):
+        """Adds rows given by their timestamps and the byte offsets of their first character."""
+        if not len(t) or not self.sorted:
+            return
+        if self.t0 is None:
+            self.t0 = int(t[0]) // self.bucket_us * self.bucket_us
+        if (self.last_t is not None and t[0] < self.last_t) or (np.diff(t) < 0).any():
+            self.sorted = False
+            return
+        self.last_t = int(t[-1])
+        buckets = (t - self.t0) // self.bucket_us
+        # the first row of each bucket not seen yet
+        first = np.concatenate(([buckets[0] > self.last_bucket], buckets[1:] != buckets[:-1]))
+        self.buckets.append(buckets[first])
+        self.offsets.append(np.asarray(row_starts)[first])
+        self.last_bucket = int(buckets[-1])
+
+    def finalize(self, end_offset):
+        """Returns the TimeIndex, or None if the rows were not sorted."""
+        if not self.sorted or self.t0 is None:
+            return None
+        return TimeIndex(self.bucket_us, self.t0, np.concatenate(self.offsets + [[end_offset]]),
+                         np.concatenate(self.buckets))
+
+    def save(self, input_csv, end_offset):
+        index = self.finalize(end_offset)
+        if index is not None:
+            index.save(input_csv)
+        elif os.path.exists(TimeIndex.path(input_csv)):
+            os.remove(TimeIndex.path(input_csv))
+
+
+def build_time_index(input_csv, bucket_us=DEFAULT_BUCKET_US, chunk_bytes=2**25, save=True):
+    """
+    Builds the time index of an existing CSV file in one pass, only parsing the timestamps.
+
+    Args:
+        input_csv (str): Path to the CSV file, with rows "x,y,p,t" sorted by time.
+        bucket_us (int): Time resolution of the index in us.
+        chunk_bytes (int): Size of the blocks of text parsed at once.
+        save (bool): Whether to save the index next to the file.
+
+    Returns:
+        a TimeIndex
+    """
+    builder = _TimeIndexBuilder(bucket_us)
+    with open(input_csv, 'rb') as f:
+        start, _ = parse_header(f)
+        end = start
+        for offset, block in _iter_blocks(f, start, None, chunk_bytes):
+            t = pd.read_csv(io.BytesIO(block), header=None, usecols=[3], dtype=np.int64, engine='c')[3].to_numpy()
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            starts = offset + np.concatenate(([0], newlines + 1))[:len(t)]
+            if len(starts) != len(t):
+                raise ValueError("build_time_index(): unexpected empty or comment lines in {}".format(input_csv))
+            builder.add(t, starts)
+            if not builder.sorted:
+                raise ValueError("build_time_index(): {} is not sorted by time".format(input_csv))
+            end = offset + len(block)
+    index = builder.finalize(end)
+    if index is None:
+        index = TimeIndex(bucket_us, 0, [end])
+    if save:
+        index.save(input_csv)
+    return index
+
+
+def iter_events_csv(input_csv, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None, polarity=None,
+                    workers=None, chunk_bytes=2**25):
+    """
+    Iterates over a CSV event file by chunks, keeping only the events inside the given ranges (bounds included).
+
+    Chunks of about `chunk_bytes` bytes are parsed in a thread pool with explicit narrow dtypes, and at most two
+    chunks per thread are in flight, so that memory stays bounded whatever the size of the file.
+
+    When a time range is given and an up to date time index exists next to the file (see `TimeIndex`), only
+    the bytes covering this range are read.
+
+    Args:
+        input_csv (str): Path to the CSV file, with rows "x,y,p,t".
+        xmin, xmax, ymin, ymax (int): Pixel ranges.
+        tmin, tmax (int): Time range in us.
+        polarity (int): Keeps only the events of this polarity.
+        workers (int): Number of parsing threads (as many as CPUs if None).
+        chunk_bytes (int): Size of the blocks of text parsed by one task.
+
+    Yields:
+        pandas DataFrame with columns x (uint16), y (uint16), p (uint8), t (int64)
+    """
+    ranges = {k: v for k, v in dict(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, tmin=tmin, tmax=tmax,
+                                    polarity=polarity).items() if v is not None}
+    workers = workers or os.cpu_count()
+    with open(input_csv, 'rb') as f, ThreadPoolExecutor(max_workers=workers) as pool:
+        start, _ = parse_header(f)
+        stop = None
+        if tmin is not None or tmax is not None:
+            index = TimeIndex.load(input_csv)
+            if index is not None:
+                first, stop = index.byte_range(tmin, tmax)
+                start = max(start, first)
+        pending = deque()
+        for _, block in _iter_blocks(f, start, stop, chunk_bytes):
+            pending.append(pool.submit(_parse_chunk, block, ranges))
+            if len(pending) >= 2 * workers:
+                yield _to_dataframe(pending.popleft().result())
+        while pending:
+            yield _to_dataframe(pending.popleft().result())
+
+
+def _to_dataframe(columns):
+    return pd.DataFrame(dict(zip(COLUMNS, columns)), copy=False)
+
+
+def load_events_csv(input_csv, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None, polarity=None,
+                    workers=None, chunk_bytes=2**25):
+    """
+    Loads the events of a CSV file inside the given ranges (bounds included).
+
+    This replaces `pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])` followed by DataFrame
+    filters: the file is parsed by chunks with narrow dtypes and the ranges are applied while streaming, so
+    that only the matching rows are ever kept in memory.
+
+    Args:
+        input_csv (str): Path to the CSV file, with rows "x,y,p,t".
+        xmin, xmax, ymin, ymax (int): Pixel ranges.
+        tmin, tmax (int): Time range in us.
+        polarity (int): Keeps only the events of this polarity.
+        workers (int): Number of parsing threads (as many as CPUs if None).
+        chunk_bytes (int): Size of the blocks of text parsed by one task.
+
+    Returns:
+        pandas DataFrame with columns x (uint16), y (uint16), p (uint8), t (int64)
+    """
+    chunks = list(iter_events_csv(input_csv, xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, tmin=tmin, tmax=tmax,
+                                  polarity=polarity, workers=workers, chunk_bytes=chunk_bytes))
+    if not chunks:
+        return _to_dataframe([np.empty((0,), dtype=CSV_DTYPES[name]) for name in COLUMNS])
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
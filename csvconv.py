@@ -4,6 +4,7 @@ import time
 import argparse
 from tqdm import tqdm
 from metavision_core.event_io import EventsIterator
+from csv_tools import CSVWriter
 
 def parse_args():
     """Parse command line arguments."""
@@ -13,11 +14,11 @@ def parse_args():
 
 def convert_raw_to_csv(event_file_path, output_file, start_ts=0, max_duration=1e6*60, delta_t=1000000):
     mv_iterator = EventsIterator(input_path=event_file_path, delta_t=delta_t, start_ts=start_ts, max_duration=max_duration)
+    height, width = mv_iterator.get_size()
 
-    with open(output_file, 'w') as csv_file:
+    with CSVWriter(output_file, height=height, width=width) as csv_writer:
         for evs in tqdm(mv_iterator, total=max_duration // delta_t):
-            for (x, y, p, t) in evs:
-                csv_file.write("%d,%d,%d,%d\n" % (x, y, p, t))
+            csv_writer.write(evs)
 
     print(f"Conversion completed: {output_file}")
 
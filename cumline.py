@@ -1,50 +1,45 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
-from sklearn.linear_model import LinearRegression
 import numpy as np
 import scipy
+from event_query import query_events
+from event_render import render_events
+from cumulative_polarity import cumulative_polarity, detect_segments
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Plot the cumulative polarity of a horizontal line of pixels over time and optionally find slopes.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('--xmin', type=int, required=True, help='Minimum X coordinate of the horizontal line of pixels.')
     parser.add_argument('--xmax', type=int, required=True, help='Maximum X coordinate of the horizontal line of pixels.')
     parser.add_argument('-y', '--y-coordinate', type=int, required=True, help='Y coordinate of the horizontal line of pixels.')
+    parser.add_argument('--ymax', type=int, required=False, default=None, help='Last Y coordinate, to compute one cumulative polarity per row from y to ymax.')
     parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
     parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
     parser.add_argument('-s', '--slope', action='store_true', help='Flag to indicate if slope calculation is needed.')
+    parser.add_argument('--auto-segments', type=int, required=False, default=0, help='Detect up to this number of constant slope segments in each row, instead of using the predefined segments.')
     return parser.parse_args()
 
-def plot_cumulative_polarity_and_find_slopes(input_csv, xmin, xmax, y, tmin=None, tmax=None, calculate_slope=False):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
+def plot_cumulative_polarity_and_find_slopes(input_csv, xmin, xmax, y, tmin=None, tmax=None, calculate_slope=False, ymax=None, auto_segments=0):
+    ymax = y if ymax is None else ymax
+    # Read the events of the specified horizontal lines of pixels inside the time range
+    line_df = query_events(input_csv, x=(xmin, xmax), y=(y, ymax), t=(tmin, tmax), as_dataframe=True)
 
-    # Filter the DataFrame for the specified horizontal line of pixels
-    line_df = df[(df['y'] == y) & (df['x'] >= xmin) & (df['x'] <= xmax)]
-
-    # Apply time filtering if specified
-    if tmin is not None:
-        line_df = line_df[line_df['t'] >= tmin]
-    if tmax is not None:
-        line_df = line_df[line_df['t'] <= tmax]
-
-    # Calculate the cumulative sum of polarity (1 for positive, -1 for negative)
-    line_df['cumulative_p'] = line_df['p'].apply(lambda p: 1 if p == 1 else -1).cumsum()
+    # Calculate the cumulative sum of polarity (1 for positive, -1 for negative) of every row in one pass
+    cumulative = cumulative_polarity(line_df['y'].values, line_df['t'].values, line_df['p'].values)
 
     # Plot the cumulative sum over time
     # plt.figure(figsize=(10, 6))
 
     fig, ax = plt.subplots(2, 1, sharex=True)
-    plt.sca(ax[0])
-    colors = ["C0", "C1"]
-    colors_vec = [colors[p] for p in line_df['p']]
-    plt.scatter(line_df['t'], line_df['y'], s=0.5, c=colors_vec)
+    render_events(line_df['t'].values, line_df['y'].values, line_df['p'].values, ax=ax[0])
 
     plt.sca(ax[1])
-    plt.plot(line_df['t'], line_df['cumulative_p'], label=f'Cumulative Polarity for Y = {y}', drawstyle='steps-post')
-    detrend = scipy.signal.detrend( line_df['cumulative_p'])
-    plt.plot(line_df['t'], detrend)
+    for i, row in enumerate(cumulative.lines):
+        t, cum = cumulative.line(i)
+        plt.plot(t, cum, label=f'Cumulative Polarity for Y = {row}', drawstyle='steps-post')
+        if len(cumulative) == 1:
+            detrend = scipy.signal.detrend(cum)
+            plt.plot(t, detrend)
 
     if calculate_slope:
         # Define the segments for regression manually
@@ -57,32 +52,33 @@ def plot_cumulative_polarity_and_find_slopes(input_csv, xmin, xmax, y, tmin=None
             # Add more segments here as needed
         ]
 
-        slopes = []
-        for i, (start, end) in enumerate(regression_segments):
-            segment = line_df[(line_df['t'] >= start) & (line_df['t'] < end)]
-            if len(segment) > 1:
-                X = segment['t'].values.reshape(-1, 1)
-                y = segment['cumulative_p'].values
-                model = LinearRegression().fit(X, y)
-                slope = model.coef_[0]
-                slopes.append(slope)
-                #plt.plot(segment['t'], model.predict(X), label=f'Segment {i+1} Slope: {slope:.2f}')
-            else:
-                slopes.append(None)
-                print(f"Not enough data points for segment {i+1} ({start}-{end})")
+        # Fit all the rows at once on the predefined segments
+        all_slopes = cumulative.fit_segments(regression_segments)[0]
 
-        print(f"Slopes of the segments: {slopes}")
+        for i, row in enumerate(cumulative.lines):
+            segments, slopes = regression_segments, all_slopes[i]
+            if auto_segments:
+                # Detect the segments of constant slope of this row and fit them instead
+                line = cumulative.select(i)
+                segments = detect_segments(*line.line(0), max_segments=auto_segments)
+                slopes = line.fit_segments(segments)[0][0]
+                print(f"Segments for Y = {row}: {segments}")
+            for k, (start, end) in enumerate(segments):
+                if np.isnan(slopes[k]):
+                    print(f"Not enough data points for segment {k+1} ({start}-{end}) of Y = {row}")
+            print(f"Slopes of the segments for Y = {row}: {[None if np.isnan(s) else float(s) for s in slopes]}")
 
     plt.xlabel('Time (t)')
     plt.ylabel('Cumulative Polarity')
-    plt.title(f'Cumulative Polarity of Pixels from ({xmin}, {y}) to ({xmax}, {y}) Over Time')
-    plt.legend()
+    plt.title(f'Cumulative Polarity of Pixels from ({xmin}, {y}) to ({xmax}, {ymax}) Over Time')
+    if len(cumulative) <= 10:
+        plt.legend()
     plt.grid(True)
     plt.show()
 
 def main():
     args = parse_args()
-    plot_cumulative_polarity_and_find_slopes(args.input_csv, args.xmin, args.xmax, args.y_coordinate, args.tmin, args.tmax, args.slope)
+    plot_cumulative_polarity_and_find_slopes(args.input_csv, args.xmin, args.xmax, args.y_coordinate, args.tmin, args.tmax, args.slope, args.ymax, args.auto_segments)
 
 if __name__ == "__main__":
     main()
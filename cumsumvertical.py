@@ -1,46 +1,49 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
 import numpy as np
+from event_query import query_events
+from analysis_cache import cached
+from time_binning import bin_events
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Plot the polarity of a vertical line of pixels over time with time bins of 10 us.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('-x', '--x-coordinate', type=int, required=True, help='X coordinate of the vertical line of pixels.')
     parser.add_argument('--ymin', type=int, required=True, help='Minimum Y coordinate of the vertical line of pixels.')
     parser.add_argument('--ymax', type=int, required=True, help='Maximum Y coordinate of the vertical line of pixels.')
     parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
     parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='Recompute the results instead of reusing the cached ones.')
     return parser.parse_args()
 
-def plot_polarity_with_time_bins(input_csv, x, ymin, ymax, tmin=None, tmax=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
+def compute_time_bins(input_csv, x, ymin, ymax, tmin=None, tmax=None):
+    # Read the events of the specified x-coordinate and y-coordinate range inside the time range
+    events = query_events(input_csv, x=x, y=(ymin, ymax), t=(tmin, tmax))
 
-    # Filter the DataFrame for the specified x-coordinate and y-coordinate range
-    line_df = df[(df['x'] == x) & (df['y'] >= ymin) & (df['y'] <= ymax)]
+    # Check if the filtered events are empty
+    if not len(events):
+        return {'count': 0, 'time': np.empty((0,)), 'p': np.empty((0,), dtype=np.int64)}
 
-    # Apply time filtering if specified
-    if tmin is not None:
-        line_df = line_df[line_df['t'] >= tmin]
-    if tmax is not None:
-        line_df = line_df[line_df['t'] <= tmax]
+    # Aggregate polarity data within time bins of 10 microseconds
+    bins = bin_events(events, 10, reducers=('count', 'on'))
+    non_empty = bins['count'][0] > 0
+    return {'count': len(events), 't_range': [events.t.min(), events.t.max()],
+            'time': bins['t'][non_empty] + 5,  # Middle of each 10 us bin
+            'p': bins['on'][0][non_empty]}
 
-    # Check if the filtered DataFrame is empty
-    if line_df.empty:
+def plot_polarity_with_time_bins(input_csv, x, ymin, ymax, tmin=None, tmax=None, use_cache=True):
+    # Bin the events, or reuse the bins if they were already computed with the same parameters
+    bin_aggregated_polarity = cached('cumsumvertical', input_csv,
+                                     lambda: compute_time_bins(input_csv, x, ymin, ymax, tmin, tmax),
+                                     use_cache=use_cache, version=1, x=x, y=(ymin, ymax), t=(tmin, tmax), bin_us=10)
+
+    # Check if there was no event inside the ranges
+    if bin_aggregated_polarity['count'] == 0:
         print("No data points found for the given filters.")
         return
 
-    print(f"Number of data points: {len(line_df)}")
-    print(f"Time range: {line_df['t'].min()} to {line_df['t'].max()}")
-
-    # Create time bins of 10 microseconds
-    time_bins = np.arange(line_df['t'].min(), line_df['t'].max() + 10, 10)
-    line_df['time_bin'] = np.digitize(line_df['t'], bins=time_bins) - 1
-
-    # Aggregate polarity data within each time bin
-    bin_aggregated_polarity = line_df.groupby('time_bin')['p'].sum().reset_index()
-    bin_aggregated_polarity['time'] = time_bins[bin_aggregated_polarity['time_bin']] + 5  # Middle of each 10 us bin
+    print(f"Number of data points: {bin_aggregated_polarity['count']}")
+    print(f"Time range: {bin_aggregated_polarity['t_range'][0]} to {bin_aggregated_polarity['t_range'][1]}")
 
     # Plot the aggregated polarity within each time bin
     plt.figure(figsize=(12, 6))
@@ -55,7 +58,7 @@ def plot_polarity_with_time_bins(input_csv, x, ymin, ymax, tmin=None, tmax=None)
 
 def main():
     args = parse_args()
-    plot_polarity_with_time_bins(args.input_csv, args.x_coordinate, args.ymin, args.ymax, args.tmin, args.tmax)
+    plot_polarity_with_time_bins(args.input_csv, args.x_coordinate, args.ymin, args.ymax, args.tmin, args.tmax, args.use_cache)
 
 if __name__ == "__main__":
     main()
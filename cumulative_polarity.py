@@ -0,0 +1,196 @@
+"""
+Signed cumulative polarity of many lines of pixels, with vectorized segment regression.
+
+The events of all the lines (rows or columns) are sorted once by line and time, and the cumulative sum of the
+signed polarities (+1 for ON, -1 for OFF) is restarted at the first event of each line (segmented cumsum).
+Slopes of the cumulative polarity over time segments are fitted with closed-form least squares, the sums of
+all the (line, segment) pairs being accumulated at once with np.bincount. Segments can also be detected
+automatically, as the change points of the local slope.
+"""
+
+import numpy as np
+
+
+class CumulativePolarity(object):
+    """
+    Cumulative polarity of several lines, stored line after line.
+
+    Attributes:
+        lines (numpy array): identifiers (e.g. y coordinates) of the lines, sorted
+        offsets (numpy array): the events of line i are in [offsets[i], offsets[i + 1])
+        t (numpy array): int64 timestamps in us, sorted inside each line
+        cum (numpy array): int64 cumulative polarity of each line
+
+    Examples:
+        >>> cumulative = cumulative_polarity(df['y'].values, df['t'].values, df['p'].values)
+        >>> slopes, intercepts = cumulative.fit_segments([(1000000, 1560000), (1560000, 1720000)])
+    """
+
+    def __init__(self, lines, offsets, t, cum):
+        self.lines = lines
+        self.offsets = offsets
+        self.t = t
+        self.cum = cum
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'CumulativePolarity: {} lines, {} events\n'.format(len(self), len(self.t))
+        return wrd
+
+    def line(self, i):
+        """Returns the (t, cum) arrays of the i-th line."""
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.t[start:stop], self.cum[start:stop]
+
+    def select(self, i):
+        """Returns the i-th line as a single-line CumulativePolarity."""
+        t, cum = self.line(i)
+        return CumulativePolarity(self.lines[i:i + 1], np.array([0, len(t)]), t, cum)
+
+    def fit_segments(self, segments):
+        """
+        Fits a line cum = slope * t + intercept on each time segment of each line, by closed-form least squares.
+
+        Args:
+            segments (list): (start, end) time segments in us, start included and end excluded, sorted and not
+                overlapping.
+
+        Returns:
+            slopes (numpy array): (num_lines, num_segments) slopes in polarity units per us, nan when a segment
+                has less than two events
+            intercepts (numpy array): (num_lines, num_segments) values of the fit at the start of the segments
+        """
+        segments = np.asarray(segments, dtype=np.int64).reshape(-1, 2)
+        num_segments = len(segments)
+        num_groups = len(self) * num_segments
+        if not num_segments or not len(self.t):
+            return np.full((len(self), num_segments), np.nan), np.full((len(self), num_segments), np.nan)
+        starts, ends = segments[:, 0], segments[:, 1]
+        segment = np.searchsorted(starts, self.t, side='right') - 1
+        valid = segment >= 0
+        valid[valid] = self.t[valid] < ends[segment[valid]]
+        line = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        group = (line * num_segments + segment)[valid]
+        # times relative to the start of their segment keep the sums accurate
+        t = (self.t[valid] - starts[segment[valid]]).astype(np.float64)
+        c = self.cum[valid].astype(np.float64)
+
+        n = np.bincount(group, minlength=num_groups)
+        st = np.bincount(group, weights=t, minlength=num_groups)
+        sc = np.bincount(group, weights=c, minlength=num_groups)
+        stt = np.bincount(group, weights=t * t, minlength=num_groups)
+        stc = np.bincount(group, weights=t * c, minlength=num_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            den = n * stt - st * st
+            slopes = np.where((n > 1) & (den > 0), (n * stc - st * sc) / den, np.nan)
+            intercepts = np.where(n > 1, (sc - slopes * st) / n, np.nan)
+        shape = (len(self), num_segments)
+        return slopes.reshape(shape), intercepts.reshape(shape)
+
+
+def cumulative_polarity(line, t, p):
+    """
+    Computes the cumulative polarity of every line in one pass.
+
+    Args:
+        line (numpy array): line of each event (e.g. its y coordinate for rows, its x coordinate for columns).
+        t (numpy array): timestamps in us.
+        p (numpy array): polarities, 1 counting +1 and anything else -1.
+
+    Returns:
+        a CumulativePolarity
+    """
+    line = np.asarray(line)
+    t = np.asarray(t, dtype=np.int64)
+    if len(t) > 1 and (np.diff(t) < 0).any():
+        order = np.lexsort((t, line))
+    else:
+        # already sorted by time: a stable sort by line keeps each line sorted
+        order = np.argsort(line, kind='stable')
+    line = line[order]
+    t = t[order]
+    signed = np.where(np.asarray(p)[order] == 1, 1, -1).astype(np.int64)
+    cum = np.cumsum(signed)
+
+    starts = np.flatnonzero(np.concatenate(([True], line[1:] != line[:-1]))) if len(line) else \
+        np.empty((0,), dtype=np.int64)
+    offsets = np.append(starts, len(line))
+    # restart the sum at the first event of each line
+    if len(starts):
+        cum -= np.repeat(cum[starts] - signed[starts], np.diff(offsets))
+    return CumulativePolarity(line[starts], offsets, t, cum)
+
+
+def _split_gains(s1, s2, a, b, min_bins):
+    """Returns the candidate split points of [a, b) and the decrease of the squared error for each of them."""
+    k = np.arange(a + min_bins, b - min_bins + 1)
+    if not len(k):
+        return k, np.empty((0,))
+
+    def cost(lo, hi):
+        n = hi - lo
+        total = s1[hi] - s1[lo]
+        return (s2[hi] - s2[lo]) - total * total / n
+
+    return k, cost(a, b) - cost(a, k) - cost(k, b)
+
+
+def detect_segments(t, cum, bin_us=1000, max_segments=10, min_bins=5, penalty=None):
+    """
+    Detects the time segments over which the cumulative polarity has a constant slope.
+
+    The local slope is measured on bins of `bin_us`, and split by binary segmentation: the split decreasing
+    the most the squared error of a piecewise constant slope is applied first, as long as the decrease is
+    larger than `penalty`.
+
+    Args:
+        t (numpy array): sorted timestamps in us.
+        cum (numpy array): cumulative polarity at each timestamp.
+        bin_us (int): duration of the bins used to measure the slope.
+        max_segments (int): maximum number of segments.
+        min_bins (int): minimum length of a segment, in bins.
+        penalty (float): minimum decrease of the squared error to split a segment (estimated from the noise
+            of the slope if None).
+
+    Returns:
+        list of (start, end) time segments in us, as expected by `CumulativePolarity.fit_segments`
+    """
+    t = np.asarray(t, dtype=np.int64)
+    cum = np.asarray(cum)
+    if len(t) < 2:
+        return [(int(t[0]), int(t[0]) + 1)] if len(t) else []
+    edges = np.arange(t[0], t[-1] + bin_us, bin_us, dtype=np.int64)
+    if len(edges) < 2:
+        edges = np.array([t[0], t[0] + bin_us])
+    # value of the cumulative polarity at each edge, then slope inside each bin
+    at_edge = np.searchsorted(t, edges, side='right') - 1
+    values = np.where(at_edge >= 0, cum[np.maximum(at_edge, 0)], 0).astype(np.float64)
+    slopes = np.diff(values) / bin_us
+    num_bins = len(slopes)
+    s1 = np.concatenate(([0.], np.cumsum(slopes)))
+    s2 = np.concatenate(([0.], np.cumsum(slopes * slopes)))
+    if penalty is None:
+        d = np.diff(slopes)
+        sigma = 1.4826 * np.median(np.abs(d - np.median(d))) / np.sqrt(2) if len(d) else 0.
+        penalty = 2 * np.log(max(num_bins, 2)) * max(sigma * sigma, np.finfo(float).tiny)
+
+    bounds = [0, num_bins]
+    while len(bounds) - 1 < max_segments:
+        best = None
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            k, gains = _split_gains(s1, s2, a, b, min_bins)
+            if len(k):
+                i = int(np.argmax(gains))
+                if best is None or gains[i] > best[0]:
+                    best = (gains[i], int(k[i]))
+        if best is None or best[0] <= penalty:
+            break
+        bounds = sorted(bounds + [best[1]])
+
+    # the last segment includes the last event
+    times = edges[bounds]
+    times[-1] = t[-1] + 1
+    return [(int(start), int(end)) for start, end in zip(times[:-1], times[1:])]
@@ -109,6 +109,24 @@ def _dat_transfer(dat, decoded_dtype, xyp=None):
     return new_dat
 
 
+def decode_columns(dat):
+    """
+    Untangles x, y and p from the '_' field of raw DAT records into separate contiguous arrays.
+
+    Args :
+        dat (numpy array): records as directly read from file with the dtype EV_TYPES[0] or EV_TYPES[12]
+
+    Returns :
+        x (uint16), y (uint16), p (uint8) and t (uint32) numpy arrays
+    """
+    xyp = dat["_"]
+    x = np.bitwise_and(xyp, X_MASK).astype(np.uint16)
+    y = np.right_shift(np.bitwise_and(xyp, Y_MASK), 14).astype(np.uint16)
+    p = np.right_shift(np.bitwise_and(xyp, P_MASK), 28).astype(np.uint8)
+    t = np.ascontiguousarray(dat["t"])
+    return x, y, p, t
+
+
 def stream_events(file_handle, buffer, dtype, ev_count=-1):
     """
     Streams data from opened file_handle.
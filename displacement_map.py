@@ -0,0 +1,269 @@
+"""
+Full-field fringe displacement: displacement time series of a grid of cells, in one pass over the events.
+
+Each ON event is routed to its cell, and given the phase of its pixel, by indexing two images computed once
+(cell label and phase of every pixel of the bounding box of the cells). The phasors of every (cell, time bin)
+pair of a slice are summed with np.bincount, and the completed bins are converted to a displacement with one
+PhaseUnwrapper per group of cells. As in time_binning.py, only the last, possibly incomplete, bin is kept
+between slices. The groups of cells hold independent states, and are processed in threads.
+
+Examples:
+    >>> rois = grid_rois(600, 900, 118, 530, cell_width=6, cell_height=None)
+    >>> result = compute_displacement_map("recording.csv", rois, 100, calibration=FringeCalibration.load("cal.npz"))
+    >>> plt.imshow(result['z'].std(axis=1).reshape(...))
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from event_batch import iter_file_batches
+from fringe_displacement import lookup_phase, PhaseUnwrapper, DEFAULT_WAVELENGTH
+
+
+def grid_rois(xmin, xmax, ymin, ymax, cell_width, cell_height=None):
+    """
+    Returns the (num_cells, 4) array of the (xmin, xmax, ymin, ymax) cells of a grid, bounds included.
+
+    The cells are ordered row by row. The last column and row of cells may be smaller, and cell_height None gives
+    a single row of cells (strips of cell_width columns).
+    """
+    cell_height = cell_height or (ymax - ymin + 1)
+    x0 = np.arange(xmin, xmax + 1, cell_width)
+    y0 = np.arange(ymin, ymax + 1, cell_height)
+    xx, yy = np.meshgrid(x0, y0)
+    xx, yy = xx.ravel(), yy.ravel()
+    return np.stack((xx, np.minimum(xx + cell_width - 1, xmax), yy, np.minimum(yy + cell_height - 1, ymax)), axis=1)
+
+
+class DisplacementMap(object):
+    """
+    Displacement time series of several cells, from chronologically ordered event slices.
+
+    The phase of the pixels is given either by a FringeCalibration (a table per column) or by a single phase
+    table (y0, phiroi) shared by all the columns. The pixels without a phase are ignored.
+
+    Args:
+        rois (numpy array): (xmin, xmax, ymin, ymax) cells, bounds included, not overlapping (see `grid_rois`).
+        bin_us (int): Width of the time bins in us, shared by all the cells.
+        calibration (FringeCalibration): Phase tables of the columns.
+        y0 (int), phiroi (numpy array): Phase table of all the columns, if no calibration is given.
+        t0 (int): Start of the first bin in us (timestamp of the first event if None). Earlier events are ignored.
+        wavelength (float): Wavelength of the laser in m.
+        max_jump (float): Rejection threshold of the phase unwrapping in rad, see PhaseUnwrapper.
+        group_size (int): Number of cells of a group processed by a thread.
+        workers (int): Number of threads (as many as CPUs if None).
+
+    Examples:
+        >>> displacement = DisplacementMap(grid_rois(600, 900, 118, 530, 6), 100, y0=y0, phiroi=phiroi)
+        >>> for evs in EventsIterator("recording.raw"):
+        >>>     displacement.update(evs)
+        >>> result = displacement.result()
+        >>> plt.plot(result['t'], result['z'].T / 1e-6)
+    """
+
+    def __init__(self, rois, bin_us, calibration=None, y0=None, phiroi=None, t0=None, wavelength=DEFAULT_WAVELENGTH,
+                 max_jump=None, group_size=256, workers=None):
+        if calibration is None and phiroi is None:
+            raise ValueError("DisplacementMap: a calibration or a phase table (y0, phiroi) is required")
+        self.rois = np.asarray(rois, dtype=np.int64).reshape(-1, 4)
+        self.bin_us = int(bin_us)
+        self.t0 = None if t0 is None else int(t0)
+        self.wavelength = wavelength
+        self.num_cells = len(self.rois)
+        self.group_size = int(group_size)
+        self.workers = workers or os.cpu_count()
+        self._labels, self._phases, self._x0, self._y0 = self._lookup_images(calibration, y0, phiroi)
+
+        # state of each group of cells: pending bin (phasor sums and counts), last phase and unwrapper
+        starts = np.arange(0, self.num_cells, self.group_size)
+        self._groups = [(start, min(start + self.group_size, self.num_cells)) for start in starts]
+        self._pending = [(np.zeros((stop - start, 0), dtype=np.complex128), np.zeros((stop - start, 0), dtype=np.int64))
+                         for start, stop in self._groups]
+        self._last_phase = [np.zeros(stop - start) for start, stop in self._groups]
+        self._unwrappers = [PhaseUnwrapper(max_jump=max_jump) for _ in self._groups]
+        self._completed = [[] for _ in self._groups]
+        # bins before _base have been completed, bin _base is pending
+        self._base = 0
+        self._completed_start = 0
+        self.ev_count = 0
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'DisplacementMap: {} cells, bins of {} us\n'.format(self.num_cells, self.bin_us)
+        wrd += 'events : {}, bins : {}\n'.format(self.ev_count, self._base + self._pending[0][1].shape[1])
+        return wrd
+
+    def _lookup_images(self, calibration, y0, phiroi):
+        """Returns the cell label and phase images of the bounding box of the cells, and its origin."""
+        x0, y0_box = self.rois[:, 0].min(), self.rois[:, 2].min()
+        width = self.rois[:, 1].max() - x0 + 1
+        height = self.rois[:, 3].max() - y0_box + 1
+        labels = np.full((height, width), -1, dtype=np.int64)
+        for i, (xmin, xmax, ymin, ymax) in enumerate(self.rois):
+            area = labels[ymin - y0_box:ymax - y0_box + 1, xmin - x0:xmax - x0 + 1]
+            if (area >= 0).any():
+                raise ValueError("DisplacementMap: cell {} overlaps another cell".format(i))
+            area[:] = i
+        yy, xx = np.mgrid[y0_box:y0_box + height, x0:x0 + width]
+        if calibration is not None:
+            phase, inside = calibration.lookup(xx.ravel(), yy.ravel())
+        else:
+            phase, inside = lookup_phase(yy.ravel(), y0, np.asarray(phiroi))
+        phases = np.zeros(height * width)
+        phases[inside] = phase
+        labels.ravel()[~inside] = -1
+        return labels, phases.reshape(height, width), x0, y0_box
+
+    def _update_group(self, g, cell, bins, phase, num_bins):
+        """Sums the phasors of the events of a group of cells, and converts its completed bins."""
+        start, stop = self._groups[g]
+        key = (cell - start) * num_bins + bins
+        size = (stop - start) * num_bins
+        counts = np.bincount(key, minlength=size).reshape(stop - start, num_bins)
+        resultant = (np.bincount(key, weights=np.cos(phase), minlength=size)
+                     + 1j * np.bincount(key, weights=np.sin(phase), minlength=size)).reshape(stop - start, num_bins)
+        pending_sum, pending_count = self._pending[g]
+        resultant[:, :pending_sum.shape[1]] += pending_sum
+        counts[:, :pending_count.shape[1]] += pending_count
+        if num_bins > 1:
+            self._emit(g, resultant[:, :-1], counts[:, :-1])
+        self._pending[g] = (resultant[:, -1:].copy(), counts[:, -1:].copy())
+
+    def _emit(self, g, resultant, counts):
+        """Unwraps the circular means of completed bins, the empty bins keeping the phase of the previous one."""
+        phase = np.angle(resultant)
+        filled = np.where(counts > 0, np.arange(1, phase.shape[1] + 1), 0)
+        filled = np.maximum.accumulate(filled, axis=1)
+        phase = np.take_along_axis(np.concatenate((self._last_phase[g][:, None], phase), axis=1), filled, axis=1)
+        self._last_phase[g] = np.array(phase[:, -1])
+        z = self._unwrappers[g].unwrap(phase) / (2 * np.pi) * self.wavelength / 2
+        self._completed[g].append((phase, z, counts))
+
+    def update(self, events):
+        """
+        Adds a slice of events, later than the ones already added.
+
+        Args:
+            events: structured array, EventBatch or dictionary of arrays with fields x, y, p and t
+        """
+        t = np.asarray(events['t'], dtype=np.int64)
+        if not len(t):
+            return
+        if self.t0 is None:
+            self.t0 = int(t[0])
+        bins = (t - self.t0) // self.bin_us
+        if (bins[:-1] > bins[1:]).any():
+            raise ValueError("DisplacementMap: events are not sorted by time")
+        keep = bins >= 0
+        if not keep[-1]:
+            return
+        if bins[np.argmax(keep)] < self._base:
+            raise ValueError("DisplacementMap: events are earlier than the ones already added")
+        last_bin = int(bins[-1])
+        num_bins = last_bin - self._base + 1
+
+        # cell and phase of the ON events from the lookup images
+        index = np.flatnonzero(keep & (np.asarray(events['p']) == 1))
+        lx = np.asarray(events['x'], dtype=np.int64)[index] - self._x0
+        ly = np.asarray(events['y'], dtype=np.int64)[index] - self._y0
+        inside = (lx >= 0) & (lx < self._labels.shape[1]) & (ly >= 0) & (ly < self._labels.shape[0])
+        index, lx, ly = index[inside], lx[inside], ly[inside]
+        cell = self._labels[ly, lx]
+        inside = cell >= 0
+        cell, phase = cell[inside], self._phases[ly[inside], lx[inside]]
+        bins = bins[index[inside]] - self._base
+        self.ev_count += len(cell)
+
+        if len(self._groups) == 1:
+            self._update_group(0, cell, bins, phase, num_bins)
+        else:
+            # groups hold disjoint cells, so their states are updated independently
+            group = cell // self.group_size
+            order = np.argsort(group, kind='stable')
+            bounds = np.searchsorted(group[order], np.arange(len(self._groups) + 1))
+            parts = [order[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+            update = lambda g: self._update_group(g, cell[parts[g]], bins[parts[g]], phase[parts[g]], num_bins)
+            if self.workers == 1:
+                for g in range(len(self._groups)):
+                    update(g)
+            else:
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    list(pool.map(update, range(len(self._groups))))
+        self._base = last_bin
+
+    def pop(self):
+        """
+        Returns the bins completed since the last call, and forgets them.
+
+        Returns:
+            dictionary of arrays:
+                t: (num_bins,) start of the bins in us
+                phase: (num_cells, num_bins) circular mean of the phases (the one of the previous bin if empty)
+                z: (num_cells, num_bins) displacement in m
+                count: (num_cells, num_bins) number of events averaged
+        """
+        fields = {'phase': [], 'z': [], 'count': []}
+        for g, (start, stop) in enumerate(self._groups):
+            completed = self._completed[g]
+            for i, name in enumerate(('phase', 'z', 'count')):
+                if completed:
+                    fields[name].append(np.concatenate([c[i] for c in completed], axis=1))
+                else:
+                    fields[name].append(np.zeros((stop - start, 0), dtype=np.int64 if name == 'count' else np.float64))
+            self._completed[g] = []
+        series = {name: np.concatenate(arrays, axis=0) for name, arrays in fields.items()}
+        num_bins = series['z'].shape[1]
+        series['t'] = self.t0 + (self._completed_start + np.arange(num_bins, dtype=np.int64)) * self.bin_us \
+            if self.t0 is not None else np.empty((0,), dtype=np.int64)
+        self._completed_start += num_bins
+        return series
+
+    def result(self):
+        """
+        Returns the bins not returned by `pop` yet, including the last one, see `pop`.
+
+        The last bin is then complete, so later events can not be added any more.
+        """
+        num_pending = self._pending[0][1].shape[1]
+        for g, (pending_sum, pending_count) in enumerate(self._pending):
+            if num_pending:
+                self._emit(g, pending_sum, pending_count)
+            self._pending[g] = (pending_sum[:, :0], pending_count[:, :0])
+        self._base += num_pending
+        return self.pop()
+
+
+def compute_displacement_map(input_path, rois, bin_us, calibration=None, y0=None, phiroi=None, tmin=None, tmax=None,
+                             t0=None, wavelength=DEFAULT_WAVELENGTH, max_jump=None, callback=None, delta_t=1000000,
+                             workers=None):
+    """
+    Computes the displacement time series of the cells of a recording in one streaming pass.
+
+    Only the ON events of the bounding box of the cells and of the time range are read (see `iter_file_batches`).
+
+    Args:
+        input_path (str): Path to a CSV, EVZ, NPY, Parquet or Arrow IPC file, to a pixel store directory, or to a
+            file supported by EventsIterator (RAW, DAT, HDF5).
+        rois, bin_us, calibration, y0, phiroi, wavelength, max_jump: see `DisplacementMap`.
+        tmin, tmax (int): Time range in us.
+        t0 (int): Start of the first bin in us (tmin, or timestamp of the first event if None).
+        callback (function): Called with the bins completed by each slice (see `DisplacementMap.pop`), so that the
+            time series are not held in memory. The remaining bins are still returned at the end.
+        delta_t (int): Duration of the slices read by EventsIterator in us.
+        workers (int): Number of threads (as many as CPUs if None).
+
+    Returns:
+        dictionary of the time series, see `DisplacementMap.pop`
+    """
+    displacement = DisplacementMap(rois, bin_us, calibration=calibration, y0=y0, phiroi=phiroi,
+                                   t0=tmin if t0 is None else t0, wavelength=wavelength, max_jump=max_jump,
+                                   workers=workers)
+    rois = displacement.rois
+    for batch in iter_file_batches(input_path, delta_t=delta_t, xmin=int(rois[:, 0].min()), xmax=int(rois[:, 1].max()),
+                                   ymin=int(rois[:, 2].min()), ymax=int(rois[:, 3].max()), tmin=tmin, tmax=tmax,
+                                   polarity=1):
+        displacement.update(batch)
+        if callback is not None:
+            callback(displacement.pop())
+    return displacement.result()
@@ -0,0 +1,80 @@
+import matplotlib.pyplot as plt
+import argparse
+import pandas as pd
+from event_query import query_events
+from fringe_displacement import calibrate_phase_table, fringe_displacement, save_phase_table, DEFAULT_WAVELENGTH
+from fringe_calibration import FringeCalibration
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compute the displacement of a surface from the motion of the interference fringes seen by a column of pixels.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
+    parser.add_argument('--xmin', type=int, required=True, help='Minimum X coordinate of the column of pixels.')
+    parser.add_argument('--xmax', type=int, required=True, help='Maximum X coordinate of the column of pixels.')
+    parser.add_argument('--ymin', type=int, required=True, help='Minimum Y coordinate of the column of pixels.')
+    parser.add_argument('--ymax', type=int, required=True, help='Maximum Y coordinate of the column of pixels.')
+    parser.add_argument('--cal-tmin', type=int, required=False, default=None, help='Start of the time window used to calibrate the phase of each row.')
+    parser.add_argument('--cal-tmax', type=int, required=False, default=None, help='End of the time window used to calibrate the phase of each row.')
+    parser.add_argument('--table', required=False, default=None, help='Path to a saved phase table or calibration file (see calibratefringes.py), instead of calibrating.')
+    parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
+    parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
+    parser.add_argument('--bin-us', type=int, required=False, default=None, help='Average the phases over time bins of this width (us) instead of over each timestamp.')
+    parser.add_argument('--wavelength', type=float, required=False, default=DEFAULT_WAVELENGTH, help='Wavelength of the laser (m).')
+    parser.add_argument('--distance', type=int, required=False, default=10, help='Minimum distance between two fringe boundaries during calibration (events).')
+    parser.add_argument('--prominence', type=float, required=False, default=2, help='Minimum prominence of a fringe boundary during calibration (rows).')
+    parser.add_argument('--save-table', required=False, default=None, help='Path to a .npz file to save the phase table to, e.g. for live displacement monitoring.')
+    parser.add_argument('-o', '--output-csv', required=False, default=None, help='Path to a CSV file to write the displacement samples to.')
+    args = parser.parse_args()
+    if args.table is None and (args.cal_tmin is None or args.cal_tmax is None):
+        parser.error('--cal-tmin and --cal-tmax are required without --table')
+    return args
+
+def compute_displacement(input_csv, xmin, xmax, ymin, ymax, cal_tmin, cal_tmax, tmin=None, tmax=None, bin_us=None,
+                         wavelength=DEFAULT_WAVELENGTH, distance=10, prominence=2, save_table=None, table=None):
+    if table is not None:
+        # Phase tables of the columns of pixels from a calibration file, each event uses the table of its column
+        calibration = FringeCalibration.load(table).select(xmin, xmax)
+        if not len(calibration):
+            raise ValueError(f"No phase table for columns {xmin} to {xmax} in {table}")
+        first, last = calibration.rows()
+        print(f"Phase tables of {len(calibration)} blocks of columns, rows {first} to {last}")
+        if save_table is not None:
+            calibration.save(save_table)
+    else:
+        # Calibrate the phase of each row from the events of a short time window
+        cal = query_events(input_csv, x=(xmin, xmax), y=(ymin, ymax), t=(cal_tmin, cal_tmax))
+        y0, phiroi = calibrate_phase_table(cal.y, cal.p, distance=distance, prominence=prominence)
+        calibration = None
+        first, last = y0, y0 + len(phiroi) - 1
+        print(f"Phase table of rows {first} to {last}")
+        if save_table is not None:
+            save_phase_table(save_table, y0, phiroi)
+
+    # Read the ON events of the rows of the tables over the whole time range
+    events = query_events(input_csv, x=(xmin, xmax), y=(first, last), t=(tmin, tmax), p=1)
+    print(f"Number of events: {len(events)}")
+
+    # Average the phases of each timestamp on the unit circle, then unwrap them into a displacement
+    if calibration is not None:
+        return fringe_displacement(events.t, events.y, events.p, bin_us=bin_us, wavelength=wavelength, x=events.x,
+                                   calibration=calibration)
+    return fringe_displacement(events.t, events.y, events.p, y0, phiroi, bin_us=bin_us, wavelength=wavelength)
+
+def main():
+    args = parse_args()
+    result = compute_displacement(args.input_csv, args.xmin, args.xmax, args.ymin, args.ymax, args.cal_tmin, args.cal_tmax,
+                                  args.tmin, args.tmax, args.bin_us, args.wavelength, args.distance, args.prominence,
+                                  args.save_table, args.table)
+    if args.output_csv is not None:
+        pd.DataFrame(result).to_csv(args.output_csv, index=False)
+
+    # Plot the displacement over time
+    plt.figure(figsize=(12, 6))
+    plt.plot(result['t'], result['z'] / 1e-6)
+    plt.xlabel('Time (t) us')
+    plt.ylabel('Displacement (um)')
+    plt.title(f'Displacement from the fringes of pixels ({args.xmin}, {args.ymin}) to ({args.xmax}, {args.ymax})')
+    plt.grid(True)
+    plt.show()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import matplotlib.pyplot as plt
+import argparse
+import numpy as np
+from displacement_map import grid_rois, compute_displacement_map
+from fringe_calibration import FringeCalibration
+from fringe_displacement import load_phase_table, DEFAULT_WAVELENGTH
+from spectral import GoertzelBank
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compute the displacement of every cell of a grid from the motion of the interference fringes, and map its amplitude.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
+    parser.add_argument('-t', '--table', required=True, help='Path to a calibration file (see calibratefringes.py) or to the phase table shared by all the columns.')
+    parser.add_argument('--xmin', type=int, required=True, help='Minimum X coordinate of the grid.')
+    parser.add_argument('--xmax', type=int, required=True, help='Maximum X coordinate of the grid.')
+    parser.add_argument('--ymin', type=int, required=True, help='Minimum Y coordinate of the grid.')
+    parser.add_argument('--ymax', type=int, required=True, help='Maximum Y coordinate of the grid.')
+    parser.add_argument('--cell-width', type=int, required=False, default=6, help='Width of the cells (pixels).')
+    parser.add_argument('--cell-height', type=int, required=False, default=None, help='Height of the cells (pixels), the whole Y range if not set.')
+    parser.add_argument('--bin-us', type=int, required=False, default=100, help='Width of the time bins (us).')
+    parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
+    parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
+    parser.add_argument('--wavelength', type=float, required=False, default=DEFAULT_WAVELENGTH, help='Wavelength of the laser (m).')
+    parser.add_argument('--max-jump', type=float, required=False, default=None, help='Reject the samples whose phase is further than this (rad) from the Kalman prediction.')
+    parser.add_argument('--frequency', type=float, required=False, default=None, help='Map the amplitude and phase of the displacement at this frequency (Hz) instead of its standard deviation.')
+    parser.add_argument('--workers', type=int, required=False, default=None, help='Number of threads.')
+    parser.add_argument('-o', '--output', required=False, default=None, help='Path to a .npz file to write the cells and their time series to.')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # Phase tables of the columns, or one table for all of them
+    with np.load(args.table) as data:
+        per_column = 'xmin' in data
+    if per_column:
+        table = dict(calibration=FringeCalibration.load(args.table))
+    else:
+        y0, phiroi = load_phase_table(args.table)
+        table = dict(y0=y0, phiroi=phiroi)
+
+    # Displacement of every cell in one pass over the events
+    rois = grid_rois(args.xmin, args.xmax, args.ymin, args.ymax, args.cell_width, args.cell_height)
+    result = compute_displacement_map(args.input_csv, rois, args.bin_us, tmin=args.tmin, tmax=args.tmax,
+                                      wavelength=args.wavelength, max_jump=args.max_jump, workers=args.workers, **table)
+    print(f"Cells: {len(rois)}, time bins: {len(result['t'])}")
+    if args.output is not None:
+        np.savez(args.output, rois=rois, **result)
+
+    # Amplitude of each cell, at the excitation frequency or overall
+    if args.frequency is not None:
+        bank = GoertzelBank([args.frequency], dt_us=args.bin_us)
+        bank.update(result['z'] - result['z'].mean(axis=1, keepdims=True))
+        spectrum = bank.spectrum()[:, 0]
+        amplitude = 2 * np.abs(spectrum) / max(bank.num_samples, 1)
+        maps = [(amplitude / 1e-9, f'Amplitude at {args.frequency:g} Hz (nm)'), (np.angle(spectrum), 'Phase (rad)')]
+    else:
+        maps = [(result['z'].std(axis=1) / 1e-9, 'Standard deviation of the displacement (nm)')]
+
+    # Plot the maps: a profile for a single row of cells, an image otherwise
+    num_rows = len(np.unique(rois[:, 2]))
+    fig, axes = plt.subplots(1, len(maps), figsize=(7 * len(maps), 6), squeeze=False)
+    for axis, (values, title) in zip(axes[0], maps):
+        if num_rows == 1:
+            axis.plot((rois[:, 0] + rois[:, 1]) / 2, values, 'o-')
+            axis.set_xlabel('X')
+            axis.grid(True)
+        else:
+            extent = (args.xmin, args.xmax + 1, args.ymin, args.ymax + 1)
+            im = axis.imshow(values.reshape(num_rows, -1), origin='lower', extent=extent, aspect='auto', cmap='viridis')
+            fig.colorbar(im, ax=axis)
+            axis.set_xlabel('X')
+            axis.set_ylabel('Y')
+        axis.set_title(title)
+    plt.tight_layout()
+    plt.show()
+
+if __name__ == "__main__":
+    main()
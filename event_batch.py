@@ -0,0 +1,307 @@
+"""
+Columnar (structure-of-arrays) container for CD events.
+
+Structured EventCD arrays store every event on 16 bytes (x, y, p, padding and an int64 timestamp), so that
+reading a single field such as events['t'] is a strided access over the whole buffer. An EventBatch keeps
+x, y and p as contiguous uint16/uint16/uint8 arrays and the timestamps as an int64 base plus uint32 offsets,
+i.e. 9 bytes per event. Batches spanning more than MAX_T_SPAN keep their offsets on int64 instead (13 bytes per
+event).
+"""
+
+import os
+import numpy as np
+
+import dat_tools as dat
+
+EVENT_CD_DTYPE = np.dtype(dat.DECODE_DTYPES[12])
+
+# uint32 offsets cover a bit more than 71 minutes of events around t_base
+MAX_T_SPAN = 2**32 - 1
+
+# files read by `query_events` instead of EventsIterator
+QUERY_EXTENSIONS = ('.npy', '.parquet', '.arrow', '.feather', '.ipc')
+# number of EVZ blocks decoded together into one batch
+EVZ_GROUP_BLOCKS = 16
+
+
+class EventBatch(object):
+    """
+    Columnar batch of CD events.
+
+    Column arrays are wrapped without copy whenever they already have the right dtype and are contiguous.
+    The structured EventCD view needed by SDK algorithms is only built when `to_events` is called, and is
+    kept so that subsequent calls are free.
+
+    Attributes:
+        x (numpy array): uint16 x coordinates
+        y (numpy array): uint16 y coordinates
+        p (numpy array): uint8 polarities
+        t_base (int): reference timestamp in us
+        t_offset (numpy array): uint32 (int64 for spans over MAX_T_SPAN) offsets in us to add to `t_base` to
+            get the timestamps
+
+    Args:
+        x (numpy array): x coordinates
+        y (numpy array): y coordinates
+        p (numpy array): polarities
+        t_offset (numpy array): timestamp offsets relative to `t_base`, kept on int64 if given as int64 and
+            converted to uint32 otherwise
+        t_base (int): reference timestamp in us
+
+    Examples:
+        >>> batch = EventBatch.from_events(events)
+        >>> mask = batch.time_mask(tmin, tmax) & (batch.y >= ymin) & (batch.y <= ymax)
+        >>> np.histogram2d(batch.t[mask], batch.y[mask], bins=[time_bins, y_bins])
+    """
+
+    names = ('x', 'y', 'p', 't')
+
+    def __init__(self, x, y, p, t_offset, t_base=0):
+        self.x = np.ascontiguousarray(x, dtype=np.uint16)
+        self.y = np.ascontiguousarray(y, dtype=np.uint16)
+        self.p = np.ascontiguousarray(p, dtype=np.uint8)
+        t_offset = np.asarray(t_offset)
+        self.t_offset = np.ascontiguousarray(t_offset, dtype=np.int64 if t_offset.dtype == np.int64 else np.uint32)
+        self.t_base = int(t_base)
+        assert len(self.x) == len(self.y) == len(self.p) == len(self.t_offset), "columns must have the same length"
+        self._t = None
+        self._events = None
+
+    @classmethod
+    def from_columns(cls, x, y, p, t):
+        """Builds a batch from absolute timestamps, using the first timestamp as base.
+
+        Args:
+            x, y, p (numpy array): event coordinates and polarities.
+            t (numpy array): timestamps in us, expected to be sorted.
+
+        Returns:
+            an EventBatch, with int64 offsets if the time span exceeds MAX_T_SPAN
+        """
+        t = np.asarray(t)
+        if not len(t):
+            return cls(x, y, p, np.empty((0,), dtype=np.uint32))
+        t_base = int(t.min())
+        span = int(t.max()) - t_base
+        t_offset = t.astype(np.int64) - t_base
+        batch = cls(x, y, p, t_offset if span > MAX_T_SPAN else t_offset.astype(np.uint32), t_base=t_base)
+        if t.dtype == np.int64 and t.flags.c_contiguous:
+            batch._t = t
+        return batch
+
+    @classmethod
+    def from_events(cls, events):
+        """Builds a batch from a structured array with fields x, y, p and t (EventCD, CSV rows, ...).
+
+        The source array is kept so that `to_events` does not need to rebuild it.
+        """
+        batch = cls.from_columns(events['x'], events['y'], events['p'], events['t'])
+        if events.dtype == EVENT_CD_DTYPE:
+            batch._events = events
+        return batch
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0,), np.uint16), np.empty((0,), np.uint16), np.empty((0,), np.uint8),
+                   np.empty((0,), np.uint32))
+
+    def __len__(self):
+        return len(self.t_offset)
+
+    @property
+    def size(self):
+        return len(self.t_offset)
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.y.nbytes + self.p.nbytes + self.t_offset.nbytes
+
+    @property
+    def t(self):
+        """int64 timestamps in us, computed on first access."""
+        if self._t is None:
+            self._t = self.t_offset.astype(np.int64)
+            self._t += self.t_base
+        return self._t
+
+    def __getitem__(self, item):
+        if isinstance(item, str):
+            if item not in self.names:
+                raise KeyError(item)
+            return getattr(self, item)
+        return EventBatch(self.x[item], self.y[item], self.p[item], self.t_offset[item], t_base=self.t_base)
+
+    def __repr__(self):
+        wrd = 'EventBatch: {} events\n'.format(len(self))
+        if len(self):
+            wrd += 'Time range: [{}, {}] us\n'.format(self.t_base + int(self.t_offset[0]),
+                                                     self.t_base + int(self.t_offset[-1]))
+        wrd += 'Size: {} bytes\n'.format(self.nbytes)
+        return wrd
+
+    def time_mask(self, tmin=None, tmax=None):
+        """Returns a boolean mask of the events with tmin <= t <= tmax.
+
+        The comparison is done on the offsets, so int64 timestamps are not materialized.
+        """
+        max_offset = np.iinfo(self.t_offset.dtype).max
+        mask = np.ones(len(self), dtype=bool)
+        if tmin is not None:
+            lo = int(tmin) - self.t_base
+            if lo > max_offset:
+                mask[:] = False
+            elif lo > 0:
+                mask &= self.t_offset >= lo
+        if tmax is not None:
+            hi = int(tmax) - self.t_base
+            if hi < 0:
+                mask[:] = False
+            elif hi < max_offset:
+                mask &= self.t_offset <= hi
+        return mask
+
+    def as_dict(self):
+        """Returns the columns as a dictionary, e.g. to build a pandas DataFrame."""
+        return {'x': self.x, 'y': self.y, 'p': self.p, 't': self.t}
+
+    def to_events(self):
+        """Returns the events as a structured EventCD array, as expected by the SDK algorithms.
+
+        The array is only built on first call.
+        """
+        if self._events is None:
+            events = np.empty(len(self), dtype=EVENT_CD_DTYPE)
+            events['x'] = self.x
+            events['y'] = self.y
+            events['p'] = self.p
+            events['t'] = self.t
+            self._events = events
+        return self._events
+
+
+def concatenate(batches):
+    """Concatenates EventBatch objects, rebasing all the offsets on the smallest base (int64 offsets if the
+    concatenated time span exceeds MAX_T_SPAN)."""
+    batches = [b for b in batches if len(b)]
+    if not batches:
+        return EventBatch.empty()
+    if len(batches) == 1:
+        return batches[0]
+    t_base = min(b.t_base for b in batches)
+    span = max(b.t_base + int(b.t_offset.max()) for b in batches) - t_base
+    dtype = np.int64 if span > MAX_T_SPAN else np.uint32
+    t_offset = [(b.t_offset.astype(np.int64) + (b.t_base - t_base)).astype(dtype) for b in batches]
+    return EventBatch(np.concatenate([b.x for b in batches]), np.concatenate([b.y for b in batches]),
+                      np.concatenate([b.p for b in batches]), np.concatenate(t_offset), t_base=t_base)
+
+
+def iter_batches(events_iterator):
+    """Wraps an iterator of structured event slices (e.g. an EventsIterator) to serve EventBatch objects."""
+    for events in events_iterator:
+        yield EventBatch.from_events(events)
+
+
+def iter_file_batches(input_path, delta_t=1000000, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None,
+                      tmax=None, polarity=None):
+    """
+    Streams a recording as non-empty EventBatch slices, in chronological order.
+
+    The ranges (bounds included) are applied by the reader: CSV files are filtered while parsing and only read
+    over the time range when they have a time index, EVZ files only decode the blocks whose statistics
+    intersect the ranges, NPY, Parquet and Arrow IPC files and pixel stores are read by `query_events` as a
+    single batch, and EventsIterator starts at tmin and stops after tmax.
+
+    Args:
+        input_path (str): Path to a CSV, EVZ, NPY, Parquet or Arrow IPC file, to a pixel store directory, or to
+            any file read by EventsIterator (RAW, DAT, HDF5).
+        delta_t (int): Duration of the slices read by EventsIterator in us (CSV files are read by chunks).
+        xmin, xmax, ymin, ymax (int): Pixel ranges.
+        tmin, tmax (int): Time range in us.
+        polarity (int): Keeps only the events of this polarity.
+    """
+    ranges = {k: v for k, v in dict(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, tmin=tmin, tmax=tmax,
+                                    polarity=polarity).items() if v is not None}
+    if input_path.lower().endswith('.csv'):
+        from csv_tools import iter_events_csv
+        for df in iter_events_csv(input_path, **ranges):
+            if len(df):
+                yield EventBatch.from_columns(df['x'].to_numpy(), df['y'].to_numpy(), df['p'].to_numpy(),
+                                              df['t'].to_numpy())
+    elif input_path.lower().endswith('.evz'):
+        import evz_tools as evz
+        from csv_tools import range_mask
+        with open(input_path, 'rb') as f:
+            evz.parse_header(f)
+            index = evz.read_index(f)
+        blocks = evz.select_blocks(index, **{k: v for k, v in ranges.items() if k != 'polarity'})
+        for start in range(0, len(blocks), EVZ_GROUP_BLOCKS):
+            batch = EventBatch.from_events(np.concatenate(evz.read_blocks(input_path,
+                                                                          blocks[start:start + EVZ_GROUP_BLOCKS])))
+            if ranges:
+                batch = batch[range_mask(batch.x, batch.y, batch.p, batch.t, **ranges)]
+            if len(batch):
+                yield batch
+    elif os.path.isdir(input_path) or input_path.lower().endswith(QUERY_EXTENSIONS):
+        from event_query import query_events
+        batch = query_events(input_path, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax), p=polarity)
+        if os.path.isdir(input_path):
+            # pixel stores serve the events pixel by pixel
+            batch = batch[np.argsort(batch.t, kind='stable')]
+        if len(batch):
+            yield batch
+    else:
+        from metavision_core.event_io import EventsIterator
+        from csv_tools import range_mask
+        start_ts = 0 if tmin is None else tmin // delta_t * delta_t
+        max_duration = None if tmax is None else tmax + 1 - start_ts
+        for batch in iter_batches(EventsIterator(input_path=input_path, delta_t=delta_t, start_ts=start_ts,
+                                                 max_duration=max_duration)):
+            if ranges and len(batch):
+                batch = batch[range_mask(batch.x, batch.y, batch.p, batch.t, **ranges)]
+            if len(batch):
+                yield batch
+
+
+def get_file_size(input_path):
+    """Returns the (height, width) of the sensor if the file header gives it, (None, None) otherwise."""
+    if input_path.lower().endswith('.csv'):
+        from csv_tools import parse_header
+        with open(input_path, 'rb') as f:
+            _, size = parse_header(f)
+        return tuple(size)
+    if os.path.isdir(input_path):
+        from pixel_store import PixelStore
+        return PixelStore(input_path).get_size()
+    if input_path.lower().endswith('.evz'):
+        import evz_tools as evz
+        with open(input_path, 'rb') as f:
+            _, size, _ = evz.parse_header(f)
+        return tuple(size)
+    if input_path.lower().endswith(QUERY_EXTENSIONS):
+        return None, None
+    from metavision_core.event_io import EventsIterator
+    return tuple(EventsIterator(input_path=input_path, delta_t=1000).get_size())
+
+
+def load_event_batch(filename, ev_count=-1, ev_start=0):
+    """
+    Loads CD events from a DAT file straight into columns, without building an intermediate EventCD array.
+
+    Args:
+        filename (string): Path to a DAT file.
+        ev_count (int): Number of events to load (all events in the file are loaded if set to the default -1).
+        ev_start (int): Index of the first event.
+
+    Returns:
+        an EventBatch
+    """
+    with open(filename, 'rb') as f:
+        _, ev_type, ev_size, _ = dat.parse_header(f)
+        if ev_type not in (0, 12):
+            raise ValueError("load_event_batch(): unsupported event type {}".format(dat.EV_STRINGS[ev_type]))
+        if ev_start > 0:
+            f.seek(ev_start * ev_size, 1)
+        words = np.fromfile(f, dtype=dat.EV_TYPES[ev_type], count=ev_count)
+    x, y, p, t = dat.decode_columns(words)
+    # DAT timestamps are already stored on 32 bits
+    return EventBatch(x, y, p, t, t_base=0)
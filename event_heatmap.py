@@ -1,54 +1,45 @@
-import pandas as pd
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
 import matplotlib.colors as mcolors
+from pixel_stats import compute_pixel_stats
+from analysis_cache import cached
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Plot the number of events per pixel in a heatmap.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('--xmin', type=int, required=False, default=None, help='Minimum x value to consider.')
     parser.add_argument('--xmax', type=int, required=False, default=None, help='Maximum x value to consider.')
     parser.add_argument('--ymin', type=int, required=False, default=None, help='Minimum y value to consider.')
     parser.add_argument('--ymax', type=int, required=False, default=None, help='Maximum y value to consider.')
     parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time value to consider.')
     parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time value to consider.')
+    parser.add_argument('--height', type=int, required=False, default=None, help='Sensor height, read from the file header if not set (or taken from the events).')
+    parser.add_argument('--width', type=int, required=False, default=None, help='Sensor width, read from the file header if not set (or taken from the events).')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='Recompute the results instead of reusing the cached ones.')
     return parser.parse_args()
 
-def plot_event_counts(input_csv, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
-    
-    print("Initial data read from CSV:")
-    print(df.head())
-    
-    # Apply filtering based on x, y, and t if specified
-    if xmin is not None:
-        df = df[df['x'] >= xmin]
-    if xmax is not None:
-        df = df[df['x'] <= xmax]
-    if ymin is not None:
-        df = df[df['y'] >= ymin]
-    if ymax is not None:
-        df = df[df['y'] <= ymax]
-    if tmin is not None:
-        df = df[df['t'] >= tmin]
-    if tmax is not None:
-        df = df[df['t'] <= tmax]
-    
-    print("Data after filtering:")
-    print(df.head())
-    print(f"Number of events after filtering: {len(df)}")
+def compute_event_counts(input_csv, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None, height=None, width=None):
+    # Count the events of each pixel inside the specified x, y and t ranges, in one streaming pass
+    stats = compute_pixel_stats(input_csv, xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, tmin=tmin, tmax=tmax,
+                                height=height, width=width)
+    counts = stats.maps()['counts']
+
+    print(f"Number of events after filtering: {stats.ev_count}")
+
+    # Keep the rows and columns holding events, for a 2D representation of the event counts
+    ys = np.flatnonzero(counts.any(axis=1))
+    xs = np.flatnonzero(counts.any(axis=0))
+    return {'counts': counts[np.ix_(ys, xs)], 'x': xs, 'y': ys}
+
+def plot_event_counts(input_csv, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None, use_cache=True, height=None, width=None):
+    # Count the events per pixel, or reuse the counts if they were already computed with the same parameters
+    arrays = cached('event_heatmap', input_csv,
+                    lambda: compute_event_counts(input_csv, xmin, xmax, ymin, ymax, tmin, tmax, height, width),
+                    use_cache=use_cache, version=2, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax))
+    event_counts_pivot = pd.DataFrame(arrays['counts'], index=arrays['y'], columns=arrays['x'])
 
-    # Count the number of events per pixel
-    event_counts = df.groupby(['x', 'y']).size().reset_index(name='counts')
-    
-    print("Event counts per pixel:")
-    print(event_counts.head())
-    
-    # Create a pivot table to have a 2D representation of the event counts
-    event_counts_pivot = event_counts.pivot(index='y', columns='x', values='counts').fillna(0).astype(int)
-    
     print("Event counts pivot table:")
     print(event_counts_pivot.head())
 
@@ -65,7 +56,7 @@ def plot_event_counts(input_csv, xmin=None, xmax=None, ymin=None, ymax=None, tmi
 
 def main():
     args = parse_args()
-    plot_event_counts(args.input_csv, args.xmin, args.xmax, args.ymin, args.ymax, args.tmin, args.tmax)
+    plot_event_counts(args.input_csv, args.xmin, args.xmax, args.ymin, args.ymax, args.tmin, args.tmax, args.use_cache, args.height, args.width)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,234 @@
+"""
+Unified x/y/t/polarity queries over event files.
+
+A query is expressed once, e.g. `query_events(path, x=(a, b), y=(c, d), t=(t0, t1), p=1)`, whatever the
+format of the file, and each format applies it as early as it can:
+    -> CSV: the time range seeks through the time index of the file, all ranges are applied while parsing
+    -> DAT: the time range is found by binary search in the memory-mapped records, and the ROI is tested on
+       the packed x/y word before the events are decoded
+    -> NPY: the time range is found by binary search in the memory-mapped array
+    -> EVZ: blocks whose statistics do not intersect the ranges are not decompressed
+    -> Parquet / Arrow IPC: ranges are pushed down to the row group statistics
+    -> pixel store (.pxs directory): only the slices of the pixels of the ROI are read
+    -> RAW / HDF5: the reader seeks to the start of the time range and stops at its end
+All the remaining conditions are evaluated in a single fused mask, and results are narrow typed columns.
+"""
+
+import os
+from bisect import bisect_left, bisect_right
+import numpy as np
+import pandas as pd
+
+import dat_tools as dat
+import evz_tools as evz
+from csv_tools import load_events_csv, range_mask
+from event_batch import EventBatch
+from pixel_store import PixelStore
+
+# slices served by EventsIterator when scanning RAW and HDF5 files
+SCAN_DELTA_T = 100000
+
+
+def _bounds(value):
+    """Normalizes a query value: None (no condition), a single value or a (min, max) tuple, bounds included."""
+    if value is None:
+        return None, None
+    if isinstance(value, (tuple, list)):
+        lo, hi = value
+        return lo, hi
+    return value, value
+
+
+def _ranges(x=None, y=None, t=None, p=None):
+    """Returns the query as keyword arguments for `range_mask`, without the unbounded conditions."""
+    xmin, xmax = _bounds(x)
+    ymin, ymax = _bounds(y)
+    tmin, tmax = _bounds(t)
+    return {k: v for k, v in dict(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, tmin=tmin, tmax=tmax,
+                                  polarity=p).items() if v is not None}
+
+
+def _filter(columns, ranges):
+    if not ranges or not len(columns[3]):
+        return columns
+    mask = range_mask(*columns, **ranges)
+    if mask.all():
+        return columns
+    return [c[mask] for c in columns]
+
+
+def _time_slice(t, ranges):
+    """
+    Returns the (start, stop) indices of [tmin, tmax] in sorted timestamps, by binary search.
+
+    The search reads one timestamp per step: np.searchsorted would first copy a strided memory-mapped column
+    such as records['t'] in full, i.e. read the whole file.
+    """
+    start, stop = 0, len(t)
+    if 'tmin' in ranges:
+        start = bisect_left(t, ranges['tmin'])
+    if 'tmax' in ranges:
+        stop = bisect_right(t, ranges['tmax'])
+    return start, max(start, stop)
+
+
+def _empty_columns():
+    return [np.empty((0,), dtype=np.uint16), np.empty((0,), dtype=np.uint16), np.empty((0,), dtype=np.uint8),
+            np.empty((0,), dtype=np.int64)]
+
+
+_EXTENSIONS = {'.csv': 'csv', '.dat': 'dat', '.npy': 'npy', '.evz': 'evz', '.parquet': 'parquet',
+               '.arrow': 'parquet', '.feather': 'parquet', '.ipc': 'parquet', '.hdf5': 'hdf5', '.h5': 'hdf5'}
+
+
+def _file_kind(path):
+    if os.path.isdir(path):
+        return 'pxs'
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'raw')
+
+
+def _query_csv(path, ranges, workers=None):
+    df = load_events_csv(path, workers=workers, **ranges)
+    return [df[name].to_numpy() for name in ('x', 'y', 'p', 't')]
+
+
+def _query_dat(path, ranges, workers=None):
+    with open(path, 'rb') as f:
+        bod, ev_type, ev_size, _ = dat.parse_header(f)
+        f.seek(0, os.SEEK_END)
+        num_events = (f.tell() - bod) // ev_size
+    if ev_type not in (0, 12):
+        raise ValueError("query_events(): unsupported event type {}".format(dat.EV_STRINGS[ev_type]))
+    if not num_events:
+        return _empty_columns()
+    records = np.memmap(path, dtype=dat.EV_TYPES[ev_type], mode='r', offset=bod, shape=(num_events,))
+    start, stop = _time_slice(records['t'], ranges)
+    records = np.array(records[start:stop])
+    # test the ROI on the packed word, and only decode the matching events
+    xyp = records['_']
+    x = np.bitwise_and(xyp, dat.X_MASK).astype(np.uint16)
+    y = np.right_shift(np.bitwise_and(xyp, dat.Y_MASK), 14).astype(np.uint16)
+    roi = {k: v for k, v in ranges.items() if k in ('xmin', 'xmax', 'ymin', 'ymax')}
+    if roi:
+        mask = range_mask(x, y, None, records['t'], **roi)
+        records, x, y = records[mask], x[mask], y[mask]
+    p = np.right_shift(np.bitwise_and(records['_'], dat.P_MASK), 28).astype(np.uint8)
+    ranges = {k: v for k, v in ranges.items() if k == 'polarity'}
+    return _filter([x, y, p, records['t'].astype(np.int64)], ranges)
+
+
+def _query_npy(path, ranges, workers=None):
+    events = np.load(path, mmap_mode='r')
+    t_name = 'ts' if 'ts' in events.dtype.names else 't'
+    start, stop = _time_slice(events[t_name], ranges)
+    events = np.array(events[start:stop])
+    columns = [events['x'].astype(np.uint16), events['y'].astype(np.uint16), events['p'].astype(np.uint8),
+               events[t_name].astype(np.int64)]
+    return _filter(columns, ranges)
+
+
+def _query_evz(path, ranges, workers=None):
+    with open(path, 'rb') as f:
+        evz.parse_header(f)
+        index = evz.read_index(f)
+    blocks = evz.select_blocks(index, **{k: v for k, v in ranges.items() if k != 'polarity'})
+    if not len(blocks):
+        return _empty_columns()
+    events = np.concatenate(evz.read_blocks(path, blocks, workers=workers))
+    columns = [events['x'].astype(np.uint16), events['y'].astype(np.uint16), events['p'].astype(np.uint8),
+               events['t'].astype(np.int64)]
+    return _filter(columns, ranges)
+
+
+def _query_parquet(path, ranges, workers=None):
+    from parquet_io import read_events
+    df = read_events(path, **ranges)
+    return [df[name].to_numpy() for name in ('x', 'y', 'p', 't')]
+
+
+def _query_pxs(path, ranges, workers=None):
+    store = PixelStore(path)
+    # ranges clipped to the sensor, whose pixels are the only ones with a slice
+    x = np.arange(max(ranges.get('xmin', 0), 0), min(ranges.get('xmax', store.width - 1), store.width - 1) + 1)
+    y = np.arange(max(ranges.get('ymin', 0), 0), min(ranges.get('ymax', store.height - 1), store.height - 1) + 1)
+    if not len(x) or not len(y):
+        return _empty_columns()
+    xx, yy = np.meshgrid(x, y)
+    batch = store.pixels(xx.ravel(), yy.ravel(), tmin=ranges.get('tmin'), tmax=ranges.get('tmax'),
+                         polarity=ranges.get('polarity'))
+    return [batch.x, batch.y, batch.p, batch.t]
+
+
+def _query_scan(path, ranges, workers=None):
+    """RAW and HDF5 files, read through EventsIterator from the start of the time range."""
+    from metavision_core.event_io import EventsIterator
+    start_ts = ranges.get('tmin', 0) // SCAN_DELTA_T * SCAN_DELTA_T
+    max_duration = ranges['tmax'] + 1 - start_ts if 'tmax' in ranges else None
+    chunks = []
+    for evs in EventsIterator(input_path=path, delta_t=SCAN_DELTA_T, start_ts=start_ts, max_duration=max_duration):
+        if len(evs):
+            chunks.append(_filter([evs['x'].astype(np.uint16), evs['y'].astype(np.uint16),
+                                   evs['p'].astype(np.uint8), evs['t'].astype(np.int64)], ranges))
+    if not chunks:
+        return _empty_columns()
+    return [np.concatenate([c[i] for c in chunks]) for i in range(4)]
+
+
+_QUERIES = {
+    'csv': _query_csv,
+    'dat': _query_dat,
+    'npy': _query_npy,
+    'evz': _query_evz,
+    'parquet': _query_parquet,
+    'pxs': _query_pxs,
+    'hdf5': _query_scan,
+    'raw': _query_scan,
+}
+
+
+class EventFile(object):
+    """
+    Event file (CSV, DAT, NPY, EVZ, Parquet, Arrow IPC, HDF5, RAW or pixel store) answering range queries.
+
+    Each condition is None (no condition), a single value, or a (min, max) tuple with bounds included, where
+    either bound can be None.
+
+    Args:
+        path (str): Path to the file, or to the directory of a pixel store.
+
+    Examples:
+        >>> events = EventFile("recording.dat")
+        >>> batch = events.query(x=(100, 200), y=(300, 310), t=(0, 500000), p=1)
+        >>> df = events.query(y=305, as_dataframe=True)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.kind = _file_kind(path)
+
+    def __repr__(self):
+        return 'EventFile: path {} ({})\n'.format(self.path, self.kind)
+
+    def query(self, x=None, y=None, t=None, p=None, as_dataframe=False, workers=None):
+        """
+        Returns the events inside the given ranges.
+
+        Args:
+            x, y (int or tuple): Pixel ranges.
+            t (int or tuple): Time range in us.
+            p (int): Polarity.
+            as_dataframe (bool): Whether to return a pandas DataFrame instead of an EventBatch.
+            workers (int): Number of threads used by the readers that parse or decompress in parallel.
+
+        Returns:
+            an EventBatch, or a pandas DataFrame with columns x (uint16), y (uint16), p (uint8), t (int64)
+        """
+        columns = _QUERIES[self.kind](self.path, _ranges(x, y, t, p), workers=workers)
+        if as_dataframe:
+            return pd.DataFrame(dict(zip(('x', 'y', 'p', 't'), columns)), copy=False)
+        return EventBatch.from_columns(*columns)
+
+
+def query_events(path, x=None, y=None, t=None, p=None, as_dataframe=False, workers=None):
+    """Shortcut for `EventFile(path).query(...)`."""
+    return EventFile(path).query(x=x, y=y, t=t, p=p, as_dataframe=as_dataframe, workers=workers)
@@ -0,0 +1,146 @@
+"""
+Rasterized rendering of event scatter plots.
+
+Instead of one marker per event, events are counted per polarity on a canvas of (time bins x rows) with
+np.bincount, and the canvas is shown with a single imshow. The cost of a plot then depends on the size of the
+canvas, not on the number of events, and the canvas is recomputed at the same resolution for the visible
+range when zooming.
+
+Modes:
+    -> 'blend': colour blended between the OFF and ON colours by the fraction of ON events, opacity growing
+       with the log of the number of events (what a scatter plot with density-scaled points shows)
+    -> 'counts': log of the number of events, with a colormap
+    -> 'polarity': number of ON events minus number of OFF events, with a diverging colormap
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcolors
+
+
+class EventRaster(object):
+    """
+    Rasterized scatter plot of events in a (time, row) plane, drawn on a matplotlib Axes.
+
+    Args:
+        ax (Axes): Axes to draw on.
+        t (numpy array): Timestamps in us (x axis of the plot).
+        y (numpy array): Integer rows (y axis of the plot), e.g. the y coordinates of the events.
+        p (numpy array): Polarities (0 or 1). All the events are counted as ON if None.
+        mode (str): 'blend', 'counts' or 'polarity'.
+        t_bins (int): Number of time bins of the canvas (width of the Axes in pixels if None).
+        max_rows (int): Maximum number of rows of the canvas, rows are merged above it.
+        colors (tuple): Colours of the OFF and ON events in 'blend' mode.
+        cmap (str): Colormap of the 'counts' and 'polarity' modes.
+        rebin (bool): Whether to recompute the canvas for the visible range when the view limits change.
+
+    Examples:
+        >>> fig, ax = plt.subplots()
+        >>> EventRaster(ax, df['t'].values, df['y'].values, df['p'].values)
+        >>> plt.show()
+    """
+
+    def __init__(self, ax, t, y, p=None, mode='blend', t_bins=None, max_rows=2000, colors=("C0", "C1"),
+                 cmap=None, rebin=True):
+        if mode not in ('blend', 'counts', 'polarity'):
+            raise ValueError("EventRaster: unknown mode {}".format(mode))
+        t = np.asarray(t, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+        p = np.ones(len(t), dtype=np.int64) if p is None else np.asarray(p, dtype=np.int64)
+        if len(t) > 1 and (np.diff(t) < 0).any():
+            order = np.argsort(t, kind='stable')
+            t, y, p = t[order], y[order], p[order]
+        self.t, self.y, self.p = t, y, p
+        self.ax = ax
+        self.mode = mode
+        self.t_bins = t_bins or max(100, int(ax.get_window_extent().width))
+        self.max_rows = max_rows
+        self.colors = [np.array(mcolors.to_rgb(c)) for c in colors]
+        self.cmap = cmap or ('bwr' if mode == 'polarity' else 'viridis')
+
+        if len(t):
+            t_range = (int(t[0]), int(t[-1]))
+            y_range = (int(y.min()), int(y.max()))
+        else:
+            t_range, y_range = (0, 1), (0, 1)
+        self._updating = False
+        self.image = None
+        self.draw(t_range, y_range)
+        ax.set_xlim(self.image.get_extent()[:2])
+        ax.set_ylim(self.image.get_extent()[2:])
+        if rebin:
+            ax.callbacks.connect('xlim_changed', self._on_zoom)
+            ax.callbacks.connect('ylim_changed', self._on_zoom)
+
+    def raster(self, t_range, y_range):
+        """
+        Counts the events per polarity on the canvas covering t_range x y_range (bounds included).
+
+        Returns:
+            counts (numpy array): (2, num_rows, t_bins) counts of OFF and ON events
+            extent (list): [left, right, bottom, top] of the canvas in data coordinates
+        """
+        t0, t1 = int(t_range[0]), max(int(t_range[1]), int(t_range[0]))
+        y0, y1 = int(y_range[0]), max(int(y_range[1]), int(y_range[0]))
+        num_rows = min(y1 - y0 + 1, self.max_rows)
+        start = np.searchsorted(self.t, t0, side='left')
+        stop = np.searchsorted(self.t, t1, side='right')
+        t, y, p = self.t[start:stop], self.y[start:stop], self.p[start:stop]
+        keep = (y >= y0) & (y <= y1)
+        if not keep.all():
+            t, y, p = t[keep], y[keep], p[keep]
+        ti = (t - t0) * self.t_bins // (t1 - t0 + 1)
+        yi = (y - y0) * num_rows // (y1 - y0 + 1)
+        key = ((p != 0) * num_rows + yi) * self.t_bins + ti
+        counts = np.bincount(key, minlength=2 * num_rows * self.t_bins).reshape(2, num_rows, self.t_bins)
+        return counts, [t0, t1 + 1, y0 - 0.5, y1 + 0.5]
+
+    def render(self, counts):
+        """Turns (2, rows, bins) counts into the image shown for the current mode."""
+        off, on = counts[0], counts[1]
+        n = off + on
+        if self.mode == 'counts':
+            return np.ma.masked_equal(np.log1p(n), 0)
+        if self.mode == 'polarity':
+            return np.ma.masked_where(n == 0, on - off)
+        frac = (on / np.maximum(n, 1))[..., None]
+        rgba = np.zeros(n.shape + (4,))
+        rgba[..., :3] = np.clip(frac * self.colors[1] + (1 - frac) * self.colors[0], 0, 1)
+        if n.max() > 0:
+            rgba[..., 3] = np.where(n > 0, 0.2 + 0.8 * np.log1p(n) / np.log1p(n.max()), 0)
+        return rgba
+
+    def draw(self, t_range, y_range):
+        counts, extent = self.raster(t_range, y_range)
+        image = self.render(counts)
+        if self.image is None:
+            self.image = self.ax.imshow(image, origin='lower', aspect='auto', interpolation='nearest', extent=extent,
+                                        cmap=None if self.mode == 'blend' else self.cmap)
+        else:
+            self.image.set_data(image)
+            self.image.set_extent(extent)
+        if self.mode == 'polarity':
+            vmax = max(1, int(np.abs(image).max()) if image.count() else 1)
+            self.image.set_clim(-vmax, vmax)
+        elif self.mode == 'counts':
+            self.image.set_clim(0, max(float(image.max()) if image.count() else 1, 1e-9))
+
+    def _on_zoom(self, ax):
+        if self._updating:
+            return
+        self._updating = True
+        try:
+            xlim = sorted(ax.get_xlim())
+            ylim = sorted(ax.get_ylim())
+            self.draw((int(np.floor(xlim[0])), int(np.ceil(xlim[1]))),
+                      (int(np.floor(ylim[0] + 0.5)), int(np.ceil(ylim[1] - 0.5))))
+            # keep the view limits requested by the user
+            ax.set_xlim(xlim)
+            ax.set_ylim(ylim)
+        finally:
+            self._updating = False
+
+
+def render_events(t, y, p=None, ax=None, **kwargs):
+    """Draws a rasterized scatter plot of events on `ax` (current Axes if None). See `EventRaster`."""
+    return EventRaster(plt.gca() if ax is None else ax, t, y, p, **kwargs)
@@ -11,7 +11,7 @@
 Simple Iterator built around the Metavision Reader classes.
 """
 from raw_reader import RawReaderBase
-from py_reader import EventDatReader
+from py_reader import EventDatReader, EventEvzReader
 from h5_io import HDF5EventsReader
 import numpy as np
 
@@ -19,7 +19,7 @@ import numpy as np
 class EventsIterator(object):
     """
     EventsIterator is a small convenience class to iterate through either a camera, a RAW file,
-    an HDF5 event file or a DAT file.
+    an HDF5 event file, a DAT file or an EVZ file.
 
     Note that, as every Python iterator, you can consume an EventsIterator only once.
 
@@ -44,7 +44,7 @@ class EventsIterator(object):
         relative_timestamps (boolean): Whether the timestamp of served events are relative to the current
             reader timestamp, or since the beginning of the recording.
         **kwargs: Arbitrary keyword arguments passed to the underlying RawReaderBase or
-            EventDatReader.
+            EventDatReader or EventEvzReader.
 
     Examples:
         >>> for ev in EventsIterator("beautiful_record.raw", delta_t=1000000, max_duration=1e6*60):
@@ -84,6 +84,8 @@ class EventsIterator(object):
         if isinstance(input_path, type("")):
             if input_path.endswith(".dat"):
                 self.reader = EventDatReader(input_path, **kwargs)
+            elif input_path.endswith(".evz"):
+                self.reader = EventEvzReader(input_path, **kwargs)
             elif input_path.endswith(".hdf5"):
                 self.reader = HDF5EventsReader(input_path)
             else:
@@ -0,0 +1,379 @@
+"""
+Defines tools to handle EVZ files, a compact block-compressed container for CD events, mimicking dat_tools.py.
+In particular :
+    -> defines the EVZ layout and its block index
+    -> defines functions to decode blocks, possibly in parallel
+    -> defines a writer class
+
+An EVZ file is made of :
+    -> a text header of lines starting with '% ' (as in DAT files), giving the geometry and the codec
+    -> independently compressed blocks of events. In each block, timestamps are delta-encoded and x, y, p are
+       bit-packed into a uint32 with the same masks as DAT files. Both arrays are byte-shuffled before
+       compression, which groups the (mostly constant) high-order bytes together.
+    -> an index with one record per block (file offset, event count, first event index, t/x/y min and max)
+    -> a fixed size footer giving the position of the index
+"""
+
+import os
+import sys
+import lzma
+import zlib
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from dat_tools import DECODE_DTYPES, X_MASK, Y_MASK, P_MASK
+
+MAGIC = b'EVZIDX01'
+
+BLOCK_DTYPE = np.dtype([('offset', '<u8'), ('nbytes', '<u4'), ('count', '<u4'), ('first_index', '<u8'),
+                        ('t_min', '<i8'), ('t_max', '<i8'), ('x_min', '<u2'), ('x_max', '<u2'),
+                        ('y_min', '<u2'), ('y_max', '<u2'), ('dt_size', 'u1')])
+
+FOOTER_DTYPE = np.dtype([('index_offset', '<u8'), ('num_blocks', '<u8'), ('magic', 'S8')])
+
+CODECS = {
+    'zlib': (lambda buf, level: zlib.compress(buf, 6 if level is None else level), zlib.decompress),
+    'lzma': (lambda buf, level: lzma.compress(buf, preset=6 if level is None else level), lzma.decompress),
+}
+
+EV_DTYPE = np.dtype(DECODE_DTYPES[12])
+
+
+def _shuffle(arr):
+    """Transposes the bytes of an array so that bytes of the same significance are stored together."""
+    return arr.view(np.uint8).reshape(-1, arr.dtype.itemsize).T.tobytes()
+
+
+def _unshuffle(buf, dtype, count):
+    dtype = np.dtype(dtype)
+    return np.frombuffer(buf, dtype=np.uint8, count=count * dtype.itemsize).reshape(
+        dtype.itemsize, count).T.copy().view(dtype).ravel()
+
+
+def encode_block(events, codec='zlib', level=None):
+    """
+    Encodes a chronologically sorted chunk of events into a compressed block.
+
+    Args :
+        events (numpy array): structured array with fields x, y, p, t
+        codec (string): either 'zlib' or 'lzma'
+        level (int): compression level, None for the codec default
+
+    Returns :
+        payload (bytes) and its index record (numpy structured scalar of BLOCK_DTYPE, without offset
+        and first_index)
+    """
+    t = events['t'].astype(np.int64)
+    dt = np.diff(t, prepend=t[:1])
+    assert dt.min() >= 0, "events must be written in chronological order"
+    dt_max = int(dt.max())
+    for dt_dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if dt_max <= np.iinfo(dt_dtype).max:
+            break
+    x = events['x'].astype(np.uint32)
+    y = events['y'].astype(np.uint32)
+    xyp = x | (y << 14) | ((events['p'] == 1).astype(np.uint32) << 28)
+    payload = CODECS[codec][0](_shuffle(dt.astype(dt_dtype)) + _shuffle(xyp), level)
+
+    record = np.zeros((), dtype=BLOCK_DTYPE)
+    record['nbytes'] = len(payload)
+    record['count'] = len(events)
+    record['t_min'] = t[0]
+    record['t_max'] = t[-1]
+    record['x_min'] = x.min()
+    record['x_max'] = x.max()
+    record['y_min'] = y.min()
+    record['y_max'] = y.max()
+    record['dt_size'] = np.dtype(dt_dtype).itemsize
+    return payload, record
+
+
+def decode_block(payload, record, codec='zlib'):
+    """
+    Decodes a compressed block.
+
+    Args :
+        payload (bytes): block as read from file
+        record (numpy structured scalar): index record of the block
+        codec (string): either 'zlib' or 'lzma'
+
+    Returns :
+        events (numpy array): structured numpy array of dtype DECODE_DTYPES[12]
+    """
+    count = int(record['count'])
+    dt_size = int(record['dt_size'])
+    raw = CODECS[codec][1](payload)
+    dt = _unshuffle(raw, '<u{}'.format(dt_size), count)
+    xyp = _unshuffle(raw[count * dt_size:], '<u4', count)
+
+    events = np.empty(count, dtype=EV_DTYPE)
+    t = events['t']
+    np.cumsum(dt, dtype=np.int64, out=t)
+    t += int(record['t_min'])
+    events['x'] = np.bitwise_and(xyp, X_MASK)
+    events['y'] = np.right_shift(np.bitwise_and(xyp, Y_MASK), 14)
+    events['p'] = np.right_shift(np.bitwise_and(xyp, P_MASK), 28)
+    return events
+
+
+def parse_header(f):
+    """
+    Parses the header of an EVZ file and put the file cursor at the beginning of the first block.
+
+    Args:
+        f (file): File handle to an EVZ file.
+
+    Returns:
+        int position of the file cursor after the header
+        size (height, width) tuple of int or None
+        string codec used to compress the blocks
+    """
+    f.seek(0, os.SEEK_SET)
+    size = [None, None]
+    codec = 'zlib'
+    while True:
+        bod = f.tell()
+        line = f.readline()
+        if sys.version_info > (3, 0):
+            line = line.decode("latin-1")
+        if line[:2] != '% ':
+            break
+        words = line.split()
+        if len(words) > 2:
+            if words[1] == 'Height':
+                size[0] = int(words[2])
+            elif words[1] == 'Width':
+                size[1] = int(words[2])
+            elif words[1] == 'Codec':
+                codec = words[2]
+        if words[1:2] == ['End']:
+            bod = f.tell()
+            break
+    if codec not in CODECS:
+        raise ValueError("unsupported EVZ codec: {}".format(codec))
+    f.seek(bod, os.SEEK_SET)
+    return bod, size, codec
+
+
+def read_index(f):
+    """
+    Reads the block index of an EVZ file.
+
+    Args:
+        f (file): File handle to an EVZ file.
+
+    Returns:
+        numpy structured array of dtype BLOCK_DTYPE, one record per block
+    """
+    f.seek(-FOOTER_DTYPE.itemsize, os.SEEK_END)
+    footer = np.frombuffer(f.read(FOOTER_DTYPE.itemsize), dtype=FOOTER_DTYPE)[0]
+    if footer['magic'] != MAGIC:
+        raise IOError("{} is not a complete EVZ file (missing index)".format(getattr(f, 'name', f)))
+    f.seek(int(footer['index_offset']), os.SEEK_SET)
+    return np.fromfile(f, dtype=BLOCK_DTYPE, count=int(footer['num_blocks']))
+
+
+def select_blocks(index, tmin=None, tmax=None, xmin=None, xmax=None, ymin=None, ymax=None):
+    """Returns the indices of the blocks whose min/max statistics intersect the given ranges (bounds included)."""
+    mask = np.ones(len(index), dtype=bool)
+    if tmin is not None:
+        mask &= index['t_max'] >= tmin
+    if tmax is not None:
+        mask &= index['t_min'] <= tmax
+    if xmin is not None:
+        mask &= index['x_max'] >= xmin
+    if xmax is not None:
+        mask &= index['x_min'] <= xmax
+    if ymin is not None:
+        mask &= index['y_max'] >= ymin
+    if ymax is not None:
+        mask &= index['y_min'] <= ymax
+    return np.flatnonzero(mask)
+
+
+def read_blocks(filename, blocks=None, workers=None):
+    """
+    Reads and decodes blocks of an EVZ file. Blocks are decompressed in parallel threads, zlib and lzma
+    releasing the GIL.
+
+    Args :
+        filename (string): Path to an EVZ file.
+        blocks (list of int): Indices of the blocks to decode (all the blocks if None).
+        workers (int): Number of decoding threads (as many as CPUs if None).
+
+    Returns :
+        list of decoded event arrays, in the order of `blocks`
+    """
+    with open(filename, 'rb') as f:
+        _, _, codec = parse_header(f)
+        index = read_index(f)
+        if blocks is None:
+            blocks = range(len(index))
+        payloads = []
+        for b in blocks:
+            f.seek(int(index[b]['offset']), os.SEEK_SET)
+            payloads.append((f.read(int(index[b]['nbytes'])), index[b]))
+    if len(payloads) <= 1 or workers == 1:
+        return [decode_block(payload, record, codec) for payload, record in payloads]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda args: decode_block(args[0], args[1], codec), payloads))
+
+
+def load_events(filename, tmin=None, tmax=None, workers=None):
+    """
+    Loads events from an EVZ file, only decoding the blocks overlapping [tmin, tmax].
+
+    Args :
+        filename (string): Path to an EVZ file.
+        tmin (int): First timestamp to load (in us, included).
+        tmax (int): Last timestamp to load (in us, included).
+        workers (int): Number of decoding threads (as many as CPUs if None).
+
+    Returns :
+        events (numpy array): structured numpy array of dtype DECODE_DTYPES[12]
+    """
+    with open(filename, 'rb') as f:
+        parse_header(f)
+        index = read_index(f)
+    blocks = select_blocks(index, tmin=tmin, tmax=tmax)
+    if not len(blocks):
+        return np.empty((0,), dtype=EV_DTYPE)
+    events = np.concatenate(read_blocks(filename, blocks, workers=workers))
+    if tmin is not None:
+        events = events[np.searchsorted(events['t'], tmin, side='left'):]
+    if tmax is not None:
+        events = events[:np.searchsorted(events['t'], tmax, side='right')]
+    return events
+
+
+def count_events(filename):
+    """
+    Returns the number of events in an EVZ file.
+
+    Args :
+        filename (string): Path to an EVZ file.
+    """
+    with open(filename, 'rb') as f:
+        index = read_index(f)
+    return int(index['count'].sum())
+
+
+class EvzWriter(object):
+    """Convenience class used to write CD events to an EVZ file.
+
+    Events are buffered until `block_size` of them are available, then encoded as an independent block.
+    The block index is written when the file is closed.
+
+    Args:
+        filename (string): Path to the destination file
+        height (int): Imager height in pixels
+        width (int): Imager width in pixels
+        codec (string): Either 'zlib' or 'lzma'
+        level (int): Compression level, None for the codec default
+        block_size (int): Number of events per block
+
+    Examples:
+        >>> f = EvzWriter("my_file_td.evz", height=720, width=1280)
+        >>> for evs in EventsIterator("my_file.raw"):
+        >>>     f.write(evs)
+        >>> f.close()
+    """
+
+    def __init__(self, filename, height=720, width=1280, codec='zlib', level=None, block_size=2**16):
+        if max(height, width) > 2**14 - 1:
+            raise ValueError('Coordinates value exceed maximum range in'
+                             ' EVZ file format max({:d},{:d}) vs 2^14 - 1'.format(height, width))
+        if codec not in CODECS:
+            raise ValueError("unsupported EVZ codec: {}".format(codec))
+        self._path = filename
+        self.codec = codec
+        self.level = level
+        self.block_size = int(block_size)
+        self.height = height
+        self.width = width
+        self.file = open(filename, 'wb')
+        now = datetime.datetime.utcnow()
+        header = ('% Data file containing EventCD events.\n'
+                  '% Version EVZ 1\n'
+                  '% Date {}-{}-{} {}:{}:{}\n'.format(now.year, now.month, now.day, now.hour, now.minute, now.second) +
+                  '% Height {:d}\n'
+                  '% Width {:d}\n'
+                  '% Codec {}\n'
+                  '% End\n'.format(height, width, codec))
+        self.file.write(header.encode("latin-1"))
+
+        self._pending = []
+        self._pending_count = 0
+        self._records = []
+        self._written = 0
+        self.ev_count = 0
+        self.current_time = 0
+        self._closed = False
+
+    def __repr__(self):
+        """String representation of an `EvzWriter` object.
+
+        Returns:
+            string describing the EvzWriter state and attributes
+        """
+        wrd = ''
+        wrd += 'EvzWriter: path {} \n'.format(self._path)
+        wrd += 'Width {}, Height  {}, Codec {}\n'.format(self.width, self.height, self.codec)
+        wrd += 'events written : {}, last timestamp {}\n'.format(self.ev_count, self.current_time)
+        return wrd
+
+    def write(self, events):
+        """
+        Writes events of fields x,y,p,t into the file.
+
+        Args:
+            events (numpy array): Events to write, in chronological order
+        """
+        if not len(events):
+            return
+        assert events['t'][0] >= self.current_time, "events must be written in chronological order"
+        self._pending.append(events)
+        self._pending_count += len(events)
+        self.ev_count += len(events)
+        self.current_time = events['t'][-1]
+        if self._pending_count >= self.block_size:
+            buffer = np.concatenate(self._pending)
+            n_full = len(buffer) // self.block_size * self.block_size
+            for start in range(0, n_full, self.block_size):
+                self._write_block(buffer[start:start + self.block_size])
+            self._pending = [buffer[n_full:]] if n_full < len(buffer) else []
+            self._pending_count = len(buffer) - n_full
+
+    def _write_block(self, events):
+        payload, record = encode_block(events, self.codec, self.level)
+        record['offset'] = self.file.tell()
+        record['first_index'] = self._written
+        self.file.write(payload)
+        self._written += len(events)
+        self._records.append(record)
+
+    def close(self):
+        if self._closed:
+            return
+        if self._pending_count:
+            self._write_block(np.concatenate(self._pending))
+        self._pending = []
+        self._pending_count = 0
+        index = np.array(self._records, dtype=BLOCK_DTYPE)
+        index_offset = self.file.tell()
+        self.file.write(index.tobytes())
+        footer = np.array([(index_offset, len(index), MAGIC)], dtype=FOOTER_DTYPE)
+        self.file.write(footer.tobytes())
+        self.file.close()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_closed"):
+            self.close()
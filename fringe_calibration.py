@@ -0,0 +1,284 @@
+"""
+Phase tables of the fringe pattern for every column of the sensor, or every block of columns.
+
+The phase table of fringe_displacement.py is computed from a single short time window of a single ROI. Here the
+calibration time range is sampled with many short windows, and for each block of columns:
+    -> the fringe period (in rows) is estimated from the spectrum of the row histograms of the ON events,
+       averaged over the windows (its magnitude does not depend on the position of the fringes)
+    -> a phase table is built in each window from the fringe boundaries, and kept if the spacing of the
+       boundaries agrees with the period
+    -> the tables, which only differ by the motion of the fringes between windows, are shifted onto each other
+       and averaged on the unit circle
+
+The blocks are processed in a process pool, and the tables are saved to a .npz calibration file that
+`load_phase_table` also reads. `FringeCalibration.lookup` gives the phase of events of any column, so that a ROI
+spanning several blocks uses the table of each of them.
+
+Examples:
+    >>> calibration = calibrate_fringes("recording.csv", tmin=1100000, tmax=1200000, ymin=118, ymax=530)
+    >>> calibration.save("calibration.npz")
+    >>> y0, phiroi = load_phase_table("calibration.npz", x=722)
+    >>> result = fringe_displacement(df['t'].values, df['y'].values, df['p'].values, x=df['x'].values,
+    >>>                              calibration=FringeCalibration.load("calibration.npz"))
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from event_query import query_events
+from fringe_displacement import find_fringe_boundaries
+
+# last column of the block of a phase table shared by all the columns
+ALL_COLUMNS = np.iinfo(np.int32).max
+
+
+class FringeCalibration(object):
+    """
+    Phase tables of blocks of columns.
+
+    Args:
+        xmin, xmax (numpy array): First and last column of each block.
+        y0 (numpy array): Row of the first entry of the table of each block.
+        tables (list): Phase table (numpy array in [0, 2pi)) of each block.
+        period (numpy array): Fringe period of each block, in rows.
+        num_windows (numpy array): Number of time windows averaged in each table.
+    """
+
+    def __init__(self, xmin, xmax, y0, tables, period, num_windows):
+        self.xmin = np.asarray(xmin, dtype=np.int64)
+        self.xmax = np.asarray(xmax, dtype=np.int64)
+        self.y0 = np.asarray(y0, dtype=np.int64)
+        self.tables = [np.asarray(table) for table in tables]
+        self.period = np.asarray(period, dtype=np.float64)
+        self.num_windows = np.asarray(num_windows, dtype=np.int64)
+        # tables padded to the same length, for the lookups of events of any column
+        self._lengths = np.array([len(table) for table in self.tables], dtype=np.int64)
+        self._padded = np.full((len(self.tables), max(self._lengths.max(initial=0), 1)), np.nan)
+        for i, table in enumerate(self.tables):
+            self._padded[i, :len(table)] = table
+
+    def __len__(self):
+        return len(self.tables)
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'FringeCalibration: {} blocks of columns\n'.format(len(self))
+        for i in range(len(self)):
+            wrd += 'x {} to {} : rows {} to {}, period {:.1f} rows, {} windows\n'.format(
+                self.xmin[i], self.xmax[i], self.y0[i], self.y0[i] + len(self.tables[i]) - 1, self.period[i],
+                self.num_windows[i])
+        return wrd
+
+    def block(self, x):
+        """Returns the index of the block of column x, -1 if it has no table."""
+        index = np.searchsorted(self.xmax, x)
+        if index < len(self) and self.xmin[index] <= x:
+            return int(index)
+        return -1
+
+    def table(self, x):
+        """Returns the phase table (y0, phiroi) of column x."""
+        index = self.block(x)
+        if index < 0:
+            raise ValueError("FringeCalibration: no table for column {}".format(x))
+        return int(self.y0[index]), self.tables[index]
+
+    def lookup(self, x, y):
+        """
+        Returns the phase of events of any column by fancy indexing into the tables.
+
+        Returns:
+            phase (numpy array): Phases of the events inside a table
+            inside (numpy array): Boolean mask of these events
+        """
+        x = np.asarray(x, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+        if not len(self):
+            return np.empty(0), np.zeros(len(x), dtype=bool)
+        block = np.clip(np.searchsorted(self.xmax, x), 0, len(self) - 1)
+        index = y - self.y0[block]
+        inside = (self.xmin[block] <= x) & (x <= self.xmax[block]) & (index >= 0) & (index < self._lengths[block])
+        return self._padded[block[inside], (y - self.y0[block])[inside]], inside
+
+    def rows(self):
+        """Returns the first and last rows covered by the tables."""
+        if not len(self):
+            return 0, -1
+        return int(self.y0.min()), int((self.y0 + self._lengths).max() - 1)
+
+    def select(self, xmin=None, xmax=None):
+        """Returns the calibration restricted to the blocks holding columns of xmin...xmax."""
+        keep = np.ones(len(self), dtype=bool)
+        if xmin is not None:
+            keep &= self.xmax >= xmin
+        if xmax is not None:
+            keep &= self.xmin <= xmax
+        index = np.flatnonzero(keep)
+        return FringeCalibration(self.xmin[index], self.xmax[index], self.y0[index], [self.tables[i] for i in index],
+                                 self.period[index], self.num_windows[index])
+
+    def save(self, path):
+        """Saves the tables to a .npz file, readable by `load` and by `load_phase_table`."""
+        np.savez(path, xmin=self.xmin, xmax=self.xmax, y0=self.y0, phiroi=self._padded, length=self._lengths,
+                 period=self.period, num_windows=self.num_windows)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads the tables saved by `save`.
+
+        A single phase table saved by `save_phase_table` is loaded as one block holding all the columns.
+        """
+        with np.load(path) as data:
+            if 'xmin' not in data:
+                return cls([0], [ALL_COLUMNS], [int(data['y0'])], [data['phiroi']], [np.nan], [0])
+            tables = [data['phiroi'][i, :data['length'][i]] for i in range(len(data['xmin']))]
+            return cls(data['xmin'], data['xmax'], data['y0'], tables, data['period'], data['num_windows'])
+
+
+def estimate_fringe_period(histograms, min_period=4, max_period=None, oversampling=8):
+    """
+    Estimates the fringe period from row histograms of several time windows.
+
+    The power spectra of the centered histograms are averaged, and the highest peak between the frequencies
+    1 / max_period and 1 / min_period is refined with a zero-padded FFT.
+
+    Args:
+        histograms (numpy array): (windows, rows) number of ON events of each row in each window.
+        min_period, max_period (float): Range of periods searched, in rows (max_period defaults to the number
+            of rows divided by 2).
+
+    Returns:
+        period in rows, NaN if no window has events
+    """
+    histograms = np.atleast_2d(np.asarray(histograms, dtype=np.float64))
+    num_rows = histograms.shape[1]
+    if not histograms.sum() or num_rows < 2:
+        return np.nan
+    centered = histograms - histograms.mean(axis=1, keepdims=True)
+    n_fft = oversampling * num_rows
+    power = (np.abs(np.fft.rfft(centered, n=n_fft, axis=1)) ** 2).mean(axis=0)
+    freqs = np.fft.rfftfreq(n_fft)
+    max_period = max_period or num_rows / 2
+    band = (freqs >= 1 / max_period) & (freqs <= 1 / min_period)
+    if not band.any():
+        return np.nan
+    return 1 / freqs[band][np.argmax(power[band])]
+
+
+def _window_table(ysplit, y0, num_rows):
+    """Phases (NaN outside of the boundaries) of the rows y0...y0 + num_rows - 1 from the fringe boundaries."""
+    rows = np.arange(y0, y0 + num_rows)
+    phase = np.interp(rows, ysplit, 2 * np.pi * np.arange(len(ysplit)))
+    phase[(rows < ysplit[0]) | (rows > ysplit[-1])] = np.nan
+    return phase
+
+
+def calibrate_block(t, y, p, tmin, tmax, window_us=50, num_windows=32, distance=10, prominence=2, min_period=4,
+                    max_period=None, tolerance=0.25, min_coverage=0.5):
+    """
+    Builds the phase table of a block of columns from its events.
+
+    Args:
+        t, y, p (numpy array): Timestamps, rows and polarities of the events of the block.
+        tmin, tmax (int): Calibration time range, sampled by num_windows windows of window_us.
+        distance, prominence: Parameters of `find_fringe_boundaries`.
+        min_period, max_period: Range of fringe periods, see `estimate_fringe_period`.
+        tolerance (float): Maximum relative difference between the median spacing of the boundaries of a window
+            and the period for the window to be used.
+        min_coverage (float): Fraction of the windows used that must cover a row for it to be in the table.
+
+    Returns:
+        y0 (int), phiroi (numpy array), period (float), number of windows used; phiroi is empty if no window
+        could be used
+    """
+    on = np.asarray(p) == 1
+    t = np.asarray(t, dtype=np.int64)[on]
+    y = np.asarray(y, dtype=np.int64)[on]
+    empty = (0, np.empty((0,)), np.nan, 0)
+    if not len(y):
+        return empty
+
+    # window of each event
+    stride = max(window_us, (tmax - tmin) // num_windows)
+    window = (t - tmin) // stride
+    keep = (t >= tmin) & ((t - tmin) % stride < window_us) & (window < num_windows)
+    window, y = window[keep], y[keep]
+    if not len(y):
+        return empty
+    ymin = y.min()
+    num_rows = int(y.max() - ymin + 1)
+
+    # fringe period from the averaged spectra of the row histograms
+    histograms = np.bincount(window * num_rows + (y - ymin), minlength=num_windows * num_rows)
+    period = estimate_fringe_period(histograms.reshape(num_windows, num_rows), min_period, max_period)
+
+    # phase table of each window, shifted onto the running average
+    order = np.argsort(window, kind='stable')
+    bounds = np.searchsorted(window[order], np.arange(num_windows + 1))
+    phasors = np.zeros(num_rows, dtype=np.complex128)
+    coverage = np.zeros(num_rows, dtype=np.int64)
+    used = 0
+    for w in range(num_windows):
+        yw = y[order[bounds[w]:bounds[w + 1]]]
+        ysplit = find_fringe_boundaries(yw, np.ones(len(yw), dtype=np.int64), distance=distance,
+                                        prominence=prominence)
+        if len(ysplit) < 2:
+            continue
+        if np.isfinite(period) and abs(np.median(np.diff(ysplit)) - period) > tolerance * period:
+            continue
+        phase = _window_table(ysplit, ymin, num_rows)
+        valid = np.isfinite(phase)
+        window_phasors = np.exp(1j * phase[valid])
+        shift = np.angle((phasors[valid] * np.conj(window_phasors)).sum()) if used else 0.
+        phasors[valid] += window_phasors * np.exp(1j * shift)
+        coverage[valid] += 1
+        used += 1
+    if not used:
+        return (0, np.empty((0,)), period, 0)
+
+    rows = np.flatnonzero(coverage >= max(1, min_coverage * used))
+    phasors = phasors[rows[0]:rows[-1] + 1]
+    phiroi = np.mod(np.angle(phasors) - np.angle(phasors[0]), 2 * np.pi)
+    return int(ymin + rows[0]), phiroi, period, used
+
+
+def _calibrate_block(args):
+    t, y, p, kwargs = args
+    return calibrate_block(t, y, p, **kwargs)
+
+
+def calibrate_fringes(input_path, tmin, tmax, xmin=None, xmax=None, ymin=None, ymax=None, block_width=1,
+                      window_us=50, num_windows=32, distance=10, prominence=2, min_period=4, max_period=None,
+                      tolerance=0.25, min_coverage=0.5, workers=None):
+    """
+    Builds the phase tables of all the blocks of block_width columns of an event file, in a process pool.
+
+    The events of the calibration time range are read once, and the blocks without a usable window are left out.
+
+    Returns:
+        FringeCalibration
+    """
+    events = query_events(input_path, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax), p=1)
+    x = np.asarray(events.x, dtype=np.int64)
+    if not len(x):
+        return FringeCalibration([], [], [], [], [], [])
+    first = x.min() if xmin is None else xmin
+    block = (x - first) // block_width
+    order = np.argsort(block, kind='stable')
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(block[order]) != 0)))
+    stops = np.append(starts[1:], len(order))
+    kwargs = dict(tmin=tmin, tmax=tmax, window_us=window_us, num_windows=num_windows, distance=distance,
+                  prominence=prominence, min_period=min_period, max_period=max_period, tolerance=tolerance,
+                  min_coverage=min_coverage)
+    jobs = [(np.asarray(events.t)[order[a:b]], np.asarray(events.y)[order[a:b]], np.asarray(events.p)[order[a:b]],
+             kwargs) for a, b in zip(starts, stops)]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        results = list(pool.map(_calibrate_block, jobs))
+
+    columns = first + block[order[starts]] * block_width
+    found = [i for i, result in enumerate(results) if len(result[1])]
+    return FringeCalibration(columns[found], columns[found] + block_width - 1, [results[i][0] for i in found],
+                             [results[i][1] for i in found], [results[i][2] for i in found],
+                             [results[i][3] for i in found])
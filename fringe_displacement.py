@@ -0,0 +1,277 @@
+"""
+Displacement of a surface from the motion of interference fringes seen by a column of pixels.
+
+A calibration table `phiroi` gives the phase of the fringe pattern (in [0, 2pi)) at each row y0 + i of the ROI,
+or a FringeCalibration (see fringe_calibration.py) gives the table of each column. Each ON event is given the
+phase of its row (in the table of its column), the phases of the events of a timestamp (or of a time bin) are
+averaged on the unit circle, and the unwrapped mean phase gives the displacement z = phase / (2pi) * wavelength / 2.
+
+Examples:
+    >>> y0, phiroi = calibrate_phase_table(cal['y'], cal['p'])
+    >>> result = fringe_displacement(df['t'].values, df['y'].values, df['p'].values, y0, phiroi)
+    >>> plt.plot(result['t'], result['z'] / 1e-6)
+"""
+
+import numpy as np
+from scipy.signal import find_peaks
+
+from kalman import KalmanSmoother
+
+DEFAULT_WAVELENGTH = 532e-9
+
+
+def find_fringe_boundaries(y, p, distance=10, prominence=2):
+    """
+    Returns the rows of the fringe boundaries seen during a short time window.
+
+    The rows of the ON events are sorted, and the jumps of their gradient mark the fringe boundaries.
+
+    Args:
+        y (numpy array): Rows of the events of the calibration window.
+        p (numpy array): Polarities of the events.
+        distance, prominence: Parameters of scipy.signal.find_peaks on the gradient of the sorted rows.
+    """
+    yp = np.sort(np.asarray(y)[np.asarray(p) == 1])
+    if len(yp) < 2:
+        return yp
+    peaks, _ = find_peaks(np.gradient(yp), distance=distance, prominence=prominence)
+    return yp[peaks]
+
+
+def calibrate_phase_table(y, p, distance=10, prominence=2):
+    """
+    Builds the phase table of a ROI from the events of a short time window.
+
+    The fringe boundaries (see `find_fringe_boundaries`) are given the phases 0, 2pi, 4pi... The phase of the
+    rows in between is linearly interpolated.
+
+    Args:
+        y (numpy array): Rows of the events of the calibration window.
+        p (numpy array): Polarities of the events.
+        distance, prominence: Parameters of scipy.signal.find_peaks on the gradient of the sorted rows.
+
+    Returns:
+        y0 (int): Row of the first entry of the table
+        phiroi (numpy array): Phase in [0, 2pi) of the rows y0, y0 + 1, ...
+    """
+    ysplit = find_fringe_boundaries(y, p, distance=distance, prominence=prominence)
+    if len(ysplit) < 2:
+        raise ValueError("calibrate_phase_table(): less than two fringe boundaries found")
+    phisplit = 2 * np.pi * np.arange(len(ysplit))
+    yroi = np.arange(ysplit[0], ysplit[-1] + 1)
+    phiroi = np.mod(np.interp(yroi, ysplit, phisplit), 2 * np.pi)
+    return int(ysplit[0]), phiroi
+
+
+def save_phase_table(path, y0, phiroi):
+    """Saves a phase table to a .npz file."""
+    np.savez(path, y0=y0, phiroi=phiroi)
+
+
+def load_phase_table(path, x=None):
+    """
+    Loads a phase table saved by `save_phase_table`, returns (y0, phiroi).
+
+    The file can also be a per-column calibration saved by fringe_calibration.py, in which case the table of the
+    column x is returned.
+    """
+    with np.load(path) as data:
+        if 'xmin' not in data:
+            return int(data['y0']), data['phiroi']
+        xmin, xmax = data['xmin'], data['xmax']
+        if x is None and len(xmin) == 1:
+            x = xmin[0]
+        block = np.flatnonzero((xmin <= (x if x is not None else -1)) & (xmax >= (x if x is not None else -1)))
+        if not len(block):
+            raise ValueError("load_phase_table(): no table for column {} in {}".format(x, path))
+        block = block[0]
+        return int(data['y0'][block]), data['phiroi'][block, :data['length'][block]]
+
+
+def lookup_phase(y, y0, phiroi):
+    """
+    Returns the phase of each row by fancy indexing into the table.
+
+    Returns:
+        phase (numpy array): Phases of the events inside the table
+        inside (numpy array): Boolean mask of these events
+    """
+    index = np.asarray(y, dtype=np.int64) - y0
+    inside = (index >= 0) & (index < len(phiroi))
+    return phiroi[index[inside]], inside
+
+
+def group_times(t, bin_us=None):
+    """
+    Groups timestamps by value (bin_us None) or by time bins of `bin_us`.
+
+    Returns:
+        times (numpy array): Timestamp, or start of the bin, of each group, sorted
+        inverse (numpy array): Group of each timestamp
+    """
+    t = np.asarray(t, dtype=np.int64)
+    keys = t if bin_us is None else t // bin_us
+    if len(keys) > 1 and (keys[:-1] > keys[1:]).any():
+        keys, inverse = np.unique(keys, return_inverse=True)
+    else:
+        # sorted timestamps: a new group starts at each change
+        change = np.concatenate(([True], keys[1:] != keys[:-1])) if len(keys) else np.empty((0,), dtype=bool)
+        inverse = np.cumsum(change) - 1
+        keys = keys[change]
+    return (keys if bin_us is None else keys * bin_us), inverse
+
+
+def circular_mean(phase, inverse, num_groups):
+    """
+    Returns the sums of the unit phasors of each group, with np.bincount.
+
+    Returns:
+        resultant (numpy array): Complex sums; np.angle gives the circular means, and the modulus divided by the
+            counts gives the concentration of the phases
+        counts (numpy array): Number of phases of each group
+    """
+    counts = np.bincount(inverse, minlength=num_groups)
+    real = np.bincount(inverse, weights=np.cos(phase), minlength=num_groups)
+    imag = np.bincount(inverse, weights=np.sin(phase), minlength=num_groups)
+    return real + 1j * imag, counts
+
+
+def _unwrap_correction(dd, discont):
+    """Multiples of 2pi added by np.unwrap to the phase differences dd."""
+    ddmod = np.mod(dd + np.pi, 2 * np.pi) - np.pi
+    np.copyto(ddmod, np.pi, where=(ddmod == -np.pi) & (dd > 0))
+    correction = ddmod - dd
+    np.copyto(correction, 0, where=np.abs(dd) < discont)
+    return correction
+
+
+class PhaseUnwrapper(object):
+    """
+    np.unwrap of phases received by chunks, e.g. the samples of a long recording processed slice by slice.
+
+    The last phase and the accumulated 2pi offset are kept between chunks, and the offsets are accumulated in the
+    same order as np.unwrap, so that the concatenated outputs are identical to np.unwrap of the whole array.
+
+    With max_jump, the unit phasors are also filtered by the random walk Kalman filter of KalmanTracking, and a
+    sample further than max_jump (rad) from the filtered phase of the previous sample (the prediction) is
+    rejected: it is unwrapped relative to the last accepted sample, but the next samples are not unwrapped
+    relative to it, so that an outlier cannot add a spurious 2pi jump to the rest of the track. The filter lags
+    behind fast motions, so max_jump has to allow for the lag. The output is then identical to the one of
+    the same unwrapper run over the whole array.
+
+    The last axis of the chunks is the time, every other axis an independent track.
+
+    Args:
+        discont (float): Maximum difference between two samples that is not unwrapped (pi if None, as np.unwrap).
+        max_jump (float): Rejection threshold in rad (no rejection if None).
+        cov, error_proc, error_measurement: Parameters of the Kalman filter, see KalmanTracking.
+
+    Examples:
+        >>> unwrapper = PhaseUnwrapper()
+        >>> z = np.concatenate([unwrapper.unwrap(chunk) for chunk in np.array_split(phase, 10)])
+        >>> np.array_equal(z, np.unwrap(phase))
+        True
+    """
+
+    def __init__(self, discont=None, max_jump=None, cov=0.5, error_proc=0.0001, error_measurement=0.1):
+        self.discont = np.pi if discont is None else discont
+        self.max_jump = max_jump
+        self._kalman_params = dict(cov=cov, error_proc=error_proc, error_measurement=error_measurement)
+        # last accepted phase and accumulated offset of each track
+        self._last = None
+        self._offset = None
+        # Kalman filter of the phasors and filtered phasor of the last sample
+        self._kalman = None
+        self._prediction = None
+        self.rejected = None
+        self.sample_count = 0
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'PhaseUnwrapper: {} samples\n'.format(self.sample_count)
+        if self.max_jump is not None:
+            wrd += 'rejection of jumps above {} rad\n'.format(self.max_jump)
+        return wrd
+
+    def unwrap(self, phase):
+        """
+        Unwraps the next chunk of (tracks..., n) phases.
+
+        The mask of the rejected samples of the chunk is left in `rejected`.
+        """
+        p = np.asarray(phase, dtype=np.float64)
+        n = p.shape[-1]
+        self.rejected = np.zeros(p.shape, dtype=bool)
+        if not n:
+            return p.copy()
+        if self._last is None:
+            self._last = np.array(p[..., 0])
+            self._offset = np.zeros(p.shape[:-1])
+
+        accepted = np.ones(p.shape, dtype=bool)
+        if self.max_jump is not None:
+            if self._kalman is None:
+                self._kalman = KalmanSmoother(np.iinfo(np.int64).max, **self._kalman_params)
+            phasors = np.exp(1j * p)
+            filtered = self._kalman.forward(phasors)
+            if self._prediction is None:
+                # the first sample has no prediction
+                prediction = np.concatenate((phasors[..., :1], filtered[..., :-1]), axis=-1)
+            else:
+                prediction = np.concatenate((self._prediction[..., None], filtered[..., :-1]), axis=-1)
+            self._prediction = np.array(filtered[..., -1])
+            accepted = np.abs(np.angle(phasors * np.conj(prediction))) <= self.max_jump
+            self.rejected = ~accepted
+
+        # phase of the last accepted sample before each sample (index 0 is the one of the previous chunks)
+        index = np.where(accepted, np.arange(1, n + 1), 0)
+        last = np.maximum.accumulate(index, axis=-1)
+        extended = np.concatenate((self._last[..., None], p), axis=-1)
+        reference = np.take_along_axis(extended, np.concatenate((np.zeros(p.shape[:-1] + (1,), dtype=np.int64),
+                                                                 last[..., :-1]), axis=-1), axis=-1)
+        correction = _unwrap_correction(p - reference, self.discont)
+        # offsets accumulated over the accepted samples, starting from the offset of the previous chunks
+        offset = np.cumsum(np.concatenate((self._offset[..., None], np.where(accepted, correction, 0)), axis=-1),
+                           axis=-1)[..., 1:]
+        self._last = np.take_along_axis(extended, last[..., -1:], axis=-1)[..., 0]
+        self._offset = np.array(offset[..., -1])
+        self.sample_count += n
+        return p + offset + np.where(accepted, 0, correction)
+
+
+def phase_to_displacement(phase, wavelength=DEFAULT_WAVELENGTH):
+    """Unwraps the phase and converts it to a displacement in m, z = phase / (2pi) * wavelength / 2."""
+    return np.unwrap(phase) / (2 * np.pi) * wavelength / 2
+
+
+def fringe_displacement(t, y, p, y0=None, phiroi=None, bin_us=None, wavelength=DEFAULT_WAVELENGTH, x=None,
+                        calibration=None):
+    """
+    Computes the displacement over the whole recording from the ON events of the ROI.
+
+    Args:
+        t, y, p (numpy array): Timestamps, rows and polarities of the events.
+        y0 (int), phiroi (numpy array): Phase table shared by all the columns, see `calibrate_phase_table`.
+        bin_us (int): Width of the time bins averaged together (every timestamp is a sample if None).
+        wavelength (float): Wavelength of the laser in m.
+        x (numpy array): Columns of the events, needed with `calibration`.
+        calibration (FringeCalibration): Phase tables of the columns, used instead of y0 and phiroi.
+
+    Returns:
+        dictionary of arrays with one sample per timestamp or time bin:
+            t: timestamp or start of the bin in us
+            phase: circular mean of the phases, in (-pi, pi]
+            z: displacement in m
+            count: number of events averaged
+            concentration: length of the mean phasor, 1 when all the phases are equal
+    """
+    on = np.asarray(p) == 1
+    if calibration is not None:
+        phase, inside = calibration.lookup(np.asarray(x)[on], np.asarray(y)[on])
+    else:
+        phase, inside = lookup_phase(np.asarray(y)[on], y0, phiroi)
+    times, inverse = group_times(np.asarray(t)[on][inside], bin_us)
+    resultant, counts = circular_mean(phase, inverse, len(times))
+    mean_phase = np.angle(resultant)
+    return {'t': times, 'phase': mean_phase, 'z': phase_to_displacement(mean_phase, wavelength), 'count': counts,
+            'concentration': np.abs(resultant) / np.maximum(counts, 1)}
@@ -1,11 +1,13 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import argparse
+from event_query import query_events
+from analysis_cache import cached
+from heatmap_pyramid import HeatmapPyramid
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Plot a heatmap of Y values as a function of Time.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('--xmin', type=int, required=True, help='Minimum X coordinate of the horizontal lines of pixels.')
     parser.add_argument('--xmax', type=int, required=True, help='Maximum X coordinate of the horizontal lines of pixels.')
     parser.add_argument('--ymin', type=int, required=True, help='Minimum Y coordinate of the horizontal lines of pixels.')
@@ -13,24 +15,13 @@ def parse_args():
     parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
     parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
     parser.add_argument('--polarity', type=int, choices=[0, 1], help='Filter events by polarity: 0 for negative, 1 for positive.')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='Recompute the results instead of reusing the cached ones.')
+    parser.add_argument('--pyramid', required=False, default=None, help='Path to the heatmap pyramid of the recording, read instead of the events (counts all the columns, ignoring xmin and xmax).')
     return parser.parse_args()
 
-def plot_heatmap(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polarity=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
-
-    # Apply time filtering if specified
-    if tmin is not None:
-        df = df[df['t'] >= tmin]
-    if tmax is not None:
-        df = df[df['t'] <= tmax]
-
-    # Apply polarity filtering if specified
-    if polarity is not None:
-        df = df[df['p'] == polarity]
-
-    # Filter the DataFrame based on the specified x and y range
-    df = df[(df['x'] >= xmin) & (df['x'] <= xmax) & (df['y'] >= ymin) & (df['y'] <= ymax)]
+def compute_heatmap(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polarity=None):
+    # Read the events inside the specified x, y, time and polarity ranges
+    df = query_events(input_csv, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax), p=polarity, as_dataframe=True)
 
     # Create bins for time and y values
     time_bins = np.linspace(df['t'].min(), df['t'].max(), num=1000)
@@ -38,6 +29,18 @@ def plot_heatmap(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polari
 
     # Create a 2D histogram
     heatmap, xedges, yedges = np.histogram2d(df['t'], df['y'], bins=[time_bins, y_bins])
+    return {'heatmap': heatmap, 'time_bins': time_bins}
+
+def plot_heatmap(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polarity=None, use_cache=True, pyramid=None):
+    if pyramid is not None:
+        # Read the histogram from the finest level of the pyramid with at most 999 time bins
+        heatmap, time_bins = HeatmapPyramid(pyramid).heatmap('y', tmin, tmax, polarity, lo=ymin, hi=ymax, max_bins=999)
+    else:
+        # Compute the histogram, or reuse it if it was already computed from the same file with the same parameters
+        arrays = cached('heatmap-y', input_csv,
+                        lambda: compute_heatmap(input_csv, xmin, xmax, ymin, ymax, tmin, tmax, polarity),
+                        use_cache=use_cache, version=1, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax), p=polarity, bins=1000)
+        heatmap, time_bins = arrays['heatmap'], arrays['time_bins']
 
     # Apply logarithmic scale to the heatmap
     heatmap = np.log1p(heatmap)  # Use log1p to avoid log(0)
@@ -53,7 +56,7 @@ def plot_heatmap(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polari
 
 def main():
     args = parse_args()
-    plot_heatmap(args.input_csv, args.xmin, args.xmax, args.ymin, args.ymax, args.tmin, args.tmax, args.polarity)
+    plot_heatmap(args.input_csv, args.xmin, args.xmax, args.ymin, args.ymax, args.tmin, args.tmax, args.polarity, args.use_cache, args.pyramid)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,254 @@
+"""
+Multi-resolution time x row and time x column event count heatmaps.
+
+A pyramid holds, for each polarity, the number of events of every sensor row (t x y) and of every sensor
+column (t x x) in time bins of `base_us` microseconds (level 0), then of 2 * base_us (level 1), 4 * base_us
+(level 2), and so on. It is built in one streaming pass over a recording, so that a heatmap of any time range
+is read from the finest level that shows it with few enough time bins, instead of being recomputed from the
+events.
+
+The levels are stored sparse, as the non-zero counts of each time bin, so that their size is bounded by the
+number of events and does not grow with the duration of the recording or the size of the sensor: a level is
+made of the sorted occupied time bins, the start of the counts of each of them (CSR indptr), and the cell
+(2 * row or column + polarity) and value of each count.
+
+A pyramid is a directory holding pyramid.json (geometry and time origin), and for each axis a ('y' or 'x') and
+level k, the raw arrays t<a>_<k>.bins (int64), t<a>_<k>.indptr (int64), t<a>_<k>.cells (uint32) and
+t<a>_<k>.counts (uint32).
+"""
+
+import os
+import json
+import numpy as np
+
+from event_batch import iter_file_batches, get_file_size
+
+PYRAMID_SUFFIX = '.hpyr'
+
+# levels are added until a level has at most this number of time bins
+MIN_LEVEL_BINS = 256
+# occupied time bins of the previous level read at once when building a level
+CHUNK_BINS = 1024
+
+_ARRAYS = (('bins', np.int64), ('indptr', np.int64), ('cells', np.uint32), ('counts', np.uint32))
+
+
+def _map(path, dtype):
+    """Memory-maps a raw array, empty files included."""
+    if not os.path.getsize(path):
+        return np.zeros((0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class _LevelWriter(object):
+    """
+    Streams the sparse counts of a level to its files.
+
+    The counts are given as (bin, cell, count) entries, by chunks whose bins do not decrease from one chunk to the
+    next. The entries of the last bin of a chunk are kept until a later bin shows up, since the next chunk can
+    still add to them.
+    """
+
+    def __init__(self, prefix):
+        self.files = {name: open('{}.{}'.format(prefix, name), 'wb') for name, _ in _ARRAYS}
+        self.num_entries = 0
+        self.pending = (np.empty((0,), np.int64), np.empty((0,), np.int64))
+
+    def add(self, bins, cells, counts):
+        keys = np.concatenate((self.pending[0], np.asarray(bins, dtype=np.int64) << 32 | cells))
+        counts = np.concatenate((self.pending[1], np.asarray(counts, dtype=np.int64)))
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=counts, minlength=len(keys)).astype(np.int64)
+        done = np.searchsorted(keys, keys[-1] >> 32 << 32) if len(keys) else 0
+        self._write(keys[:done], counts[:done])
+        self.pending = (keys[done:], counts[done:])
+
+    def _write(self, keys, counts):
+        if not len(keys):
+            return
+        bins = keys >> 32
+        starts = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+        self.files['bins'].write(bins[starts].tobytes())
+        self.files['indptr'].write((self.num_entries + starts).tobytes())
+        self.files['cells'].write((keys & 0xFFFFFFFF).astype(np.uint32).tobytes())
+        self.files['counts'].write(counts.astype(np.uint32).tobytes())
+        self.num_entries += len(keys)
+
+    def close(self):
+        self._write(*self.pending)
+        self.files['indptr'].write(np.array([self.num_entries], dtype=np.int64).tobytes())
+        for f in self.files.values():
+            f.close()
+
+
+class _Level(object):
+    """Sparse counts of one level of a pyramid, memory-mapped from its files."""
+
+    def __init__(self, prefix, num_bins):
+        for name, dtype in _ARRAYS:
+            setattr(self, name, _map('{}.{}'.format(prefix, name), dtype))
+        self.num_bins = num_bins
+
+    def __len__(self):
+        return self.num_bins
+
+    def entries(self, start, stop):
+        """Returns the (bin, cell, count) entries of the time bins start...stop - 1."""
+        i, j = np.searchsorted(self.bins, (start, stop))
+        indptr = np.asarray(self.indptr[i:j + 1])
+        bins = np.repeat(np.asarray(self.bins[i:j]), np.diff(indptr))
+        return bins, np.asarray(self.cells[indptr[0]:indptr[-1]]), np.asarray(self.counts[indptr[0]:indptr[-1]])
+
+
+def _append_level(prefix, previous):
+    """Writes the level made of the sums of consecutive pairs of time bins of `previous`."""
+    writer = _LevelWriter(prefix)
+    for i in range(0, len(previous.bins), CHUNK_BINS):
+        indptr = np.asarray(previous.indptr[i:i + CHUNK_BINS + 1])
+        bins = np.repeat(np.asarray(previous.bins[i:i + CHUNK_BINS]) // 2, np.diff(indptr))
+        writer.add(bins, previous.cells[indptr[0]:indptr[-1]], previous.counts[indptr[0]:indptr[-1]])
+    writer.close()
+    return _Level(prefix, (len(previous) + 1) // 2)
+
+
+def build_heatmap_pyramid(input_path, output_dir=None, base_us=1000, height=None, width=None):
+    """
+    Builds the heatmap pyramid of a recording in one streaming pass.
+
+    Args:
+        input_path (str): Path to a CSV or EVZ file, or to a file supported by EventsIterator (RAW, DAT, HDF5).
+        output_dir (str): Path of the pyramid directory (input path with a .hpyr extension if None).
+        base_us (int): Duration of the time bins of level 0 in us.
+        height, width (int): Sensor size, read from the file header if None.
+
+    Returns:
+        a HeatmapPyramid opened on the new pyramid
+    """
+    if output_dir is None:
+        output_dir = os.path.splitext(input_path)[0] + PYRAMID_SUFFIX
+    if height is None or width is None:
+        height, width = get_file_size(input_path)
+    if height is None or width is None:
+        raise ValueError("build_heatmap_pyramid(): the sensor size is not in the header of {}, "
+                         "height and width must be given".format(input_path))
+    os.makedirs(output_dir, exist_ok=True)
+
+    writers = {axis: _LevelWriter(os.path.join(output_dir, 't{}_0'.format(axis))) for axis in ('y', 'x')}
+    t0 = None
+    last_bin = -1
+    for batch in iter_file_batches(input_path):
+        if t0 is None:
+            t0 = int(batch.t[0]) // base_us * base_us
+        bins = (batch.t - t0) // base_us
+        if bins[0] < last_bin:
+            raise ValueError("build_heatmap_pyramid(): events of {} are not sorted by time".format(input_path))
+        last_bin = int(bins[-1])
+        ones = np.ones(len(bins), dtype=np.int64)
+        for axis, coords in (('y', batch.y), ('x', batch.x)):
+            writers[axis].add(bins, 2 * coords.astype(np.int64) + batch.p, ones)
+    for writer in writers.values():
+        writer.close()
+
+    num_levels = 1
+    for axis in ('y', 'x'):
+        level = _Level(os.path.join(output_dir, 't{}_0'.format(axis)), last_bin + 1)
+        num_levels = 1
+        while len(level) > MIN_LEVEL_BINS:
+            level = _append_level(os.path.join(output_dir, 't{}_{}'.format(axis, num_levels)), level)
+            num_levels += 1
+        del level
+
+    with open(os.path.join(output_dir, 'pyramid.json'), 'w') as f:
+        json.dump({'height': height, 'width': width, 't0': t0 or 0, 'base_us': base_us, 'num_bins': last_bin + 1,
+                   'num_levels': num_levels}, f, indent=1)
+    return HeatmapPyramid(output_dir)
+
+
+class HeatmapPyramid(object):
+    """
+    Read access to a heatmap pyramid built by `build_heatmap_pyramid`.
+
+    Args:
+        path (str): Path to the pyramid directory.
+
+    Examples:
+        >>> pyramid = HeatmapPyramid("recording.hpyr")
+        >>> counts, time_edges = pyramid.heatmap('y', tmin=2000000, tmax=2500000, lo=300, hi=400)
+        >>> plt.imshow(counts.T, origin='lower', aspect='auto', extent=[time_edges[0], time_edges[-1], 300, 400])
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'pyramid.json')) as f:
+            info = json.load(f)
+        self.height = info['height']
+        self.width = info['width']
+        self.t0 = info['t0']
+        self.base_us = info['base_us']
+        self.levels = {axis: [_Level(os.path.join(path, 't{}_{}'.format(axis, k)), -(-info['num_bins'] // 2**k))
+                              for k in range(info['num_levels'])] for axis in ('y', 'x')}
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'HeatmapPyramid: path {} \n'.format(self.path)
+        wrd += 'Width {}, Height  {}\n'.format(self.width, self.height)
+        wrd += 'levels : {}, bins of {} to {} us\n'.format(len(self.levels['y']), self.base_us,
+                                                         self.bin_us(len(self.levels['y']) - 1))
+        return wrd
+
+    def get_size(self):
+        return self.height, self.width
+
+    def bin_us(self, level):
+        """Returns the duration of the time bins of `level` in us."""
+        return self.base_us * 2**level
+
+    def select_level(self, tmin=None, tmax=None, max_bins=1000):
+        """Returns the finest level showing [tmin, tmax] with at most `max_bins` time bins."""
+        num_bins = len(self.levels['y'][0])
+        tmin = self.t0 if tmin is None else tmin
+        tmax = self.t0 + num_bins * self.base_us - 1 if tmax is None else tmax
+        for level in range(len(self.levels['y'])):
+            if (tmax - tmin) // self.bin_us(level) + 1 <= max_bins:
+                return level
+        return len(self.levels['y']) - 1
+
+    def heatmap(self, axis='y', tmin=None, tmax=None, polarity=None, lo=None, hi=None, max_bins=1000, level=None):
+        """
+        Returns the event counts of the rows (axis 'y') or columns (axis 'x') of the sensor over time.
+
+        The time bins are the ones of the selected level, so the returned range starts at the beginning of the
+        bin holding `tmin` and ends at the end of the bin holding `tmax`.
+
+        Args:
+            axis (str): 'y' for a time x row heatmap, 'x' for a time x column heatmap.
+            tmin, tmax (int): Time range in us.
+            polarity (int): Counts only the events of this polarity (both polarities if None).
+            lo, hi (int): Range of rows or columns, bounds included.
+            max_bins (int): Maximum number of time bins, used to select the level.
+            level (int): Level to read, instead of selecting it from `max_bins`.
+
+        Returns:
+            counts (numpy array): (num_time_bins, hi - lo + 1) array of counts
+            time_edges (numpy array): num_time_bins + 1 edges of the time bins in us
+        """
+        if level is None:
+            level = self.select_level(tmin, tmax, max_bins)
+        counts = self.levels[axis][level]
+        bin_us = self.bin_us(level)
+        start = 0 if tmin is None else max(0, (tmin - self.t0) // bin_us)
+        stop = len(counts) if tmax is None else min(len(counts), (tmax - self.t0) // bin_us + 1)
+        stop = max(start, stop)
+        lo = 0 if lo is None else lo
+        hi = (self.height if axis == 'y' else self.width) - 1 if hi is None else hi
+        # densify the non-zero counts of the range
+        bins, cells, values = counts.entries(start, stop)
+        coords = cells.astype(np.int64) >> 1
+        mask = (coords >= lo) & (coords <= hi)
+        if polarity is not None:
+            mask &= (cells & 1) == polarity
+        num_coords = hi - lo + 1
+        tile = np.bincount((bins[mask] - start) * num_coords + (coords[mask] - lo), weights=values[mask],
+                           minlength=(stop - start) * num_coords).astype(np.int64).reshape(stop - start, num_coords)
+        time_edges = self.t0 + np.arange(start, stop + 1, dtype=np.int64) * bin_us
+        return tile, time_edges
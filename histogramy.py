@@ -1,11 +1,11 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
-import numpy as np
+from event_query import query_events
+from time_binning import bin_events
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Plot a histogram of the number of events over time.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('--xmin', type=int, required=True, help='Minimum X coordinate of the horizontal lines of pixels.')
     parser.add_argument('--xmax', type=int, required=True, help='Maximum X coordinate of the horizontal lines of pixels.')
     parser.add_argument('--ymin', type=int, required=True, help='Minimum Y coordinate of the horizontal lines of pixels.')
@@ -13,31 +13,25 @@ def parse_args():
     parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
     parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
     parser.add_argument('--polarity', type=int, choices=[0, 1], help='Filter events by polarity: 0 for negative, 1 for positive.')
+    parser.add_argument('--bin-us', type=int, required=False, default=None, help='Width of the time bins in us (about 100 bins over the time range if not given).')
     return parser.parse_args()
 
-def plot_event_histogram(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polarity=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
+def plot_event_histogram(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polarity=None, bin_us=None):
+    # Read the events inside the specified x, y, time and polarity ranges
+    events = query_events(input_csv, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax), p=polarity)
+    if not len(events):
+        print("No events found for the given filters.")
+        return
 
-    # Apply time filtering if specified
-    if tmin is not None:
-        df = df[df['t'] >= tmin]
-    if tmax is not None:
-        df = df[df['t'] <= tmax]
-
-    # Apply polarity filtering if specified
-    if polarity is not None:
-        df = df[df['p'] == polarity]
-
-    # Filter the DataFrame based on the specified x and y range
-    df = df[(df['x'] >= xmin) & (df['x'] <= xmax) & (df['y'] >= ymin) & (df['y'] <= ymax)]
-
-    # Create bins for time values
-    time_bins = np.linspace(df['t'].min(), df['t'].max(), num=100)
+    # Count the events in fixed-width time bins
+    t_min, t_max = int(events.t.min()), int(events.t.max())
+    if bin_us is None:
+        bin_us = max(1, (t_max - t_min) // 99 + 1)
+    bins = bin_events(events, bin_us, t0=t_min)
 
     # Create a histogram
     plt.figure(figsize=(10, 8))
-    plt.hist(df['t'], bins=time_bins, color='blue', edgecolor='black', alpha=0.7)
+    plt.bar(bins['t'], bins['count'][0], width=bin_us, align='edge', color='blue', edgecolor='black', alpha=0.7)
     plt.xlabel('Time (t) us')
     plt.ylabel('Number of events')
     plt.title('Histogram of Number of Events over Time')
@@ -46,7 +40,7 @@ def plot_event_histogram(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None
 
 def main():
     args = parse_args()
-    plot_event_histogram(args.input_csv, args.xmin, args.xmax, args.ymin, args.ymax, args.tmin, args.tmax, args.polarity)
+    plot_event_histogram(args.input_csv, args.xmin, args.xmax, args.ymin, args.ymax, args.tmin, args.tmax, args.polarity, args.bin_us)
 
 if __name__ == "__main__":
     main()
@@ -3,6 +3,7 @@
 
 
 from scipy import constants as konst
+from scipy.signal import lfilter
 import numpy as np
 # Implements a linear Kalman filter.
 #import numpy
@@ -53,6 +54,315 @@ class KalmanFilterLinear:
     current_prob_estimate = (np.eye(size)-kalman_gain*self.H)*predicted_prob_estimate
     return current_state_estimate, current_prob_estimate
 
+  def Filter(self,measurement_array,control_array=None,steady_state=True):
+    """ Filters a whole (n, m) array of measurements, or a (tracks, n, m) array of independent tracks
+    starting from the current state, and keeps the last state and covariance.
+    Returns the (tracks, n, states) estimates, see batch_kalman_filter """
+    x0 = np.asarray(self.current_state_estimate).reshape(-1)
+    estimates, P = batch_kalman_filter(measurement_array, np.asarray(self.A), np.asarray(self.H),
+                                       np.asarray(self.Q), np.asarray(self.R), x0, np.asarray(self.current_prob_estimate),
+                                       B=np.asarray(self.B), controls=control_array, steady_state=steady_state)
+    if estimates.ndim == 2:
+      self.current_state_estimate = np.matrix(estimates[-1]).T
+    self.current_prob_estimate = np.matrix(P)
+    return estimates
+
+
+def scalar_kalman_gains(n, cov, error_proc, error_measurement, steady_state=True, tol=1e-12):
+    """
+    Gains and covariances of the scalar random walk filter used by KalmanTracking (A = H = 1).
+
+    They do not depend on the measurements, so they are computed once for all the samples and tracks. With
+    steady_state, the recursion stops once the gain no longer changes (relative change below tol), and the
+    last gain is used for the remaining samples.
+
+    Args:
+        n (int): Number of samples.
+        cov, error_proc, error_measurement: Initial covariance, process and measurement errors, scalars or
+            arrays (one value per track), possibly complex.
+
+    Returns:
+        gains (numpy array): (m, tracks...) gains of the first m <= n samples
+        covs (numpy array): (m, tracks...) covariances after the update of these samples
+    """
+    P = np.asarray(cov) + np.zeros_like(np.asarray(error_proc)) + np.zeros_like(np.asarray(error_measurement))
+    dtype = np.result_type(P, error_proc, error_measurement, float)
+    gains, covs = [], []
+    for k in range(n):
+        P_pred = P + error_proc
+        K = P_pred / (P_pred + error_measurement)
+        P = (1 - K) * P_pred
+        gains.append(K)
+        covs.append(P)
+        if steady_state and k and np.all(np.abs(K - gains[-2]) <= tol * np.abs(K)):
+            break
+    shape = (len(gains),) + np.shape(P)
+    return np.asarray(gains, dtype=dtype).reshape(shape), np.asarray(covs, dtype=dtype).reshape(shape)
+
+
+def kalman_filter(measurements, cov=100, error_proc=0.0001, error_measurement=1, x0=None, steady_state=True,
+                  out=None):
+    """
+    Vectorized version of KalmanTracking over a whole array of measurements.
+
+    The measurements are filtered along the last axis, every other axis being an independent track (e.g. one
+    per ROI or per pixel). Once the gain reaches its steady state, the filter is the first order recursion
+    x[k] = K z[k] + (1 - K) x[k - 1], run by scipy.signal.lfilter.
+
+    Args:
+        measurements (numpy array): (tracks..., n) real or complex measurements.
+        cov, error_proc, error_measurement: see KalmanTracking, scalars or arrays broadcast to the tracks.
+        x0 (numpy array): Initial state of each track (first measurement if None, as KalmanTracking).
+        steady_state (bool): Whether to switch to the steady state gain once reached.
+        out (numpy array): Preallocated output array, of the shape of the measurements.
+
+    Returns:
+        (tracks..., n) array of estimates
+
+    Examples:
+        >>> phase_complex = np.exp(1j * centroid_y)
+        >>> complex_kalman = kalman_filter(phase_complex, cov=0.5, error_proc=0.0001, error_measurement=0.1+0.1j)
+    """
+    z = np.asarray(measurements)
+    n = z.shape[-1]
+    gains, _ = scalar_kalman_gains(n, cov, error_proc, error_measurement, steady_state=steady_state)
+    if out is None:
+        out = np.empty(z.shape, dtype=np.result_type(z, gains))
+    if n:
+        x = z[..., 0] if x0 is None else x0
+        _first_order(gains[:n], gains[-1], z, x, out)
+    return out
+
+
+def _first_order(gains, steady_gain, u, y, out):
+    """
+    Runs out[..., k] = g[k] u[..., k] + (1 - g[k]) out[..., k - 1] along the last axis, starting from y.
+
+    The gains of the first samples are given one by one (transient), then `steady_gain` is used, with
+    scipy.signal.lfilter. Gains are scalars or arrays broadcast to the tracks (the leading axes of u).
+
+    Returns:
+        the last output sample
+    """
+    n = u.shape[-1]
+    tracks = u.shape[:-1]
+    y = np.array(np.broadcast_to(y, tracks), dtype=out.dtype)
+    m = min(len(gains), n)
+    for k in range(m):
+        y += gains[k] * (u[..., k] - y)
+        out[..., k] = y
+    if m == n:
+        return y
+    K = np.broadcast_to(steady_gain, tracks)
+    if not K.size:
+        return y
+    if np.all(K == K.flat[0]):
+        K = K.flat[0]
+        out[..., m:] = lfilter([K], [1, -(1 - K)], u[..., m:], axis=-1, zi=((1 - K) * y)[..., None])[0]
+    else:
+        for index in np.ndindex(tracks):
+            out[index + (slice(m, None),)] = lfilter([K[index]], [1, -(1 - K[index])], u[index + (slice(m, None),)],
+                                                     zi=[(1 - K[index]) * y[index]])[0]
+    return np.array(out[..., -1])
+
+
+class KalmanSmoother(object):
+    """
+    Rauch-Tung-Striebel smoother of the KalmanTracking random walk model, for arrays processed by chunks.
+
+    The forward pass filters the chunks in chronological order, and the backward pass smooths the filtered
+    chunks in reverse order, x_s[k] = x[k] + C[k] (x_s[k + 1] - x[k]) with C[k] = P[k] / (P[k] + error_proc).
+    The filter state and the last smoothed sample are carried between chunks, so that a recording which does
+    not fit in memory can be smoothed with its filtered estimates stored on disk (see `rts_smoother_chunked`).
+    Like the gains, the smoother gains do not depend on the data, and both passes run as scipy.signal.lfilter
+    once the steady state is reached. The last axis of the chunks is the time, every other axis an
+    independent track (e.g. one per ROI).
+
+    Args:
+        n (int): Total number of samples.
+        cov, error_proc, error_measurement: see KalmanTracking, scalars or arrays broadcast to the tracks.
+        steady_state (bool): Whether to switch to the steady state gains once reached.
+
+    Examples:
+        >>> smoother = KalmanSmoother(len(phase_complex), cov=0.5, error_proc=0.0001, error_measurement=0.1+0.1j)
+        >>> filtered = [smoother.forward(chunk) for chunk in np.array_split(phase_complex, 10)]
+        >>> smoothed = np.concatenate([smoother.backward(chunk) for chunk in reversed(filtered)][::-1])
+    """
+
+    def __init__(self, n, cov=100, error_proc=0.0001, error_measurement=1, steady_state=True):
+        self.n = int(n)
+        self.gains, covs = scalar_kalman_gains(self.n, cov, error_proc, error_measurement, steady_state=steady_state)
+        self.smoother_gains = covs / (covs + error_proc)
+        self._x = None
+        self._forward_index = 0
+        self._xs = None
+        self._backward_index = self.n
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'KalmanSmoother: {} samples, steady state after {}\n'.format(self.n, len(self.gains))
+        wrd += 'forward : {}, backward : {}\n'.format(self._forward_index, self.n - self._backward_index)
+        return wrd
+
+    def forward(self, chunk, x0=None, out=None):
+        """
+        Filters the next chunk of measurements.
+
+        Args:
+            chunk (numpy array): (tracks..., k) measurements.
+            x0: Initial state of the tracks, for the first chunk (first measurement if None).
+            out (numpy array): Preallocated output array.
+
+        Returns:
+            (tracks..., k) filtered estimates
+        """
+        z = np.asarray(chunk)
+        k = z.shape[-1]
+        if out is None:
+            out = np.empty(z.shape, dtype=np.result_type(z, self.gains))
+        if not k:
+            return out
+        if self._x is None:
+            self._x = z[..., 0] if x0 is None else x0
+        start = self._forward_index
+        self._x = _first_order(self.gains[start:start + k], self.gains[-1], z, self._x, out)
+        self._forward_index += k
+        return out
+
+    def backward(self, filtered_chunk, out=None):
+        """
+        Smooths the previous chunk of filtered estimates, the chunks being given in reverse order.
+
+        Args:
+            filtered_chunk (numpy array): (tracks..., k) filtered estimates returned by `forward`.
+            out (numpy array): Preallocated output array (can be `filtered_chunk` itself).
+
+        Returns:
+            (tracks..., k) smoothed estimates
+        """
+        x = np.asarray(filtered_chunk)
+        k = x.shape[-1]
+        if out is None:
+            out = np.empty(x.shape, dtype=x.dtype)
+        if not k:
+            return out
+        stop = self._backward_index
+        start = stop - k
+        if self._xs is None:
+            # the last smoothed sample is the last filtered one
+            self._xs = np.array(x[..., -1])
+            out[..., -1] = self._xs
+            stop -= 1
+        # x_s[j] = (1 - C[j]) x[j] + C[j] x_s[j + 1], run backward from stop - 1 to start: first over the
+        # samples in the steady state, then over the first samples, with a gain per sample
+        u = x[..., :stop - start][..., ::-1]
+        steady = len(self.smoother_gains) - 1
+        num_steady = max(0, stop - max(start, steady))
+        transient = 1 - self.smoother_gains[start:max(start, min(stop, steady))][::-1]
+        reversed_out = np.empty(u.shape, dtype=out.dtype)
+        self._xs = _first_order(transient[:0], 1 - self.smoother_gains[-1], u[..., :num_steady], self._xs,
+                                reversed_out[..., :num_steady])
+        self._xs = _first_order(transient, None, u[..., num_steady:], self._xs, reversed_out[..., num_steady:])
+        out[..., :stop - start] = reversed_out[..., ::-1]
+        self._backward_index = start
+        return out
+
+
+def rts_smoother(measurements, cov=100, error_proc=0.0001, error_measurement=1, x0=None, steady_state=True,
+                 out=None):
+    """
+    Forward-backward (RTS) smoothed version of `kalman_filter`, see KalmanSmoother.
+
+    Examples:
+        >>> complex_smooth = rts_smoother(phase_complex, cov=0.5, error_proc=0.0001, error_measurement=0.1+0.1j)
+    """
+    z = np.asarray(measurements)
+    smoother = KalmanSmoother(z.shape[-1], cov=cov, error_proc=error_proc, error_measurement=error_measurement,
+                              steady_state=steady_state)
+    filtered = smoother.forward(z, x0=x0, out=out)
+    return smoother.backward(filtered, out=filtered)
+
+
+def rts_smoother_chunked(measurements, out, chunk_size=2**20, cov=100, error_proc=0.0001, error_measurement=1,
+                         x0=None, steady_state=True):
+    """
+    RTS smoother reading and writing arrays too large for memory, e.g. memory-mapped .npy files.
+
+    The filtered estimates are written to `out` chunk by chunk, then smoothed in place in reverse order.
+
+    Args:
+        measurements (numpy array): (tracks..., n) measurements, e.g. np.load(path, mmap_mode='r').
+        out (numpy array): (tracks..., n) output array, e.g. np.lib.format.open_memmap(path, mode='w+', ...).
+        chunk_size (int): Number of samples per chunk.
+
+    Returns:
+        out
+    """
+    n = measurements.shape[-1]
+    smoother = KalmanSmoother(n, cov=cov, error_proc=error_proc, error_measurement=error_measurement,
+                              steady_state=steady_state)
+    starts = range(0, n, chunk_size)
+    for start in starts:
+        out[..., start:start + chunk_size] = smoother.forward(np.asarray(measurements[..., start:start + chunk_size]),
+                                                              x0=x0)
+    for start in reversed(starts):
+        out[..., start:start + chunk_size] = smoother.backward(np.asarray(out[..., start:start + chunk_size]))
+    return out
+
+
+def batch_kalman_filter(measurements, A, H, Q, R, x0, P0, B=None, controls=None, steady_state=True, tol=1e-12):
+    """
+    Linear Kalman filter of independent tracks sharing the same model, for small state sizes.
+
+    The covariances and gains do not depend on the measurements, so they are computed once per time step for
+    all the tracks (and no more once they reach their steady state), and the states of all the tracks are
+    updated together with np.einsum.
+
+    Args:
+        measurements (numpy array): (n, m) measurements of a track, or (tracks, n, m) measurements.
+        A, H, Q, R (numpy array): (s, s) transition, (m, s) observation, (s, s) process error and
+            (m, m) measurement error matrices.
+        x0 (numpy array): (s,) or (tracks, s) initial states.
+        P0 (numpy array): (s, s) initial covariance.
+        B (numpy array), controls (numpy array): (s, c) control matrix and (n, c) or (tracks, n, c) controls.
+        steady_state (bool): Whether to stop updating the covariance once the gain no longer changes.
+
+    Returns:
+        estimates (numpy array): (n, s) or (tracks, n, s) estimated states
+        P (numpy array): (s, s) covariance after the last sample
+    """
+    z = np.asarray(measurements)
+    single = z.ndim == 2
+    if single:
+        z = z[None]
+    num_tracks, n = z.shape[:2]
+    A, H, Q, R = (np.atleast_2d(np.asarray(M)) for M in (A, H, Q, R))
+    dtype = np.result_type(z, A, H, Q, R, x0, P0, float)
+    x = np.array(np.broadcast_to(x0, (num_tracks, A.shape[0])), dtype=dtype)
+    P = np.array(P0, dtype=dtype).reshape(A.shape)
+    estimates = np.empty((num_tracks, n, A.shape[0]), dtype=dtype)
+    if controls is not None:
+        u = np.asarray(controls)
+        u = np.broadcast_to(u[None] if u.ndim == 2 else u, (num_tracks, n, u.shape[-1]))
+        Bu = np.einsum('sc,tnc->tns', np.atleast_2d(B), u)
+    I = np.eye(A.shape[0])
+    K = None
+    converged = False
+    for k in range(n):
+        x = np.einsum('ij,tj->ti', A, x)
+        if controls is not None:
+            x += Bu[:, k]
+        if not converged:
+            P_pred = A @ P @ A.T + Q
+            S = H @ P_pred @ H.T + R
+            K_new = np.linalg.solve(S.T, (P_pred @ H.T).T).T
+            P = (I - K_new @ H) @ P_pred
+            converged = steady_state and K is not None and np.all(np.abs(K_new - K) <= tol * np.abs(K_new))
+            K = K_new
+        x = x + np.einsum('ij,tj->ti', K, z[:, k] - np.einsum('ij,tj->ti', H, x))
+        estimates[:, k] = x
+    return (estimates[0] if single else estimates), P
+
 
 class KalmanTracking(object):
     """ Class object to handle the tracking of a variable using Kalman filtering
@@ -123,6 +433,35 @@ class KalmanTracking(object):
         self.probabilities.append(probability)
         return prediction
 
+    def filter_array(self,data,save=False,steady_state=True):
+        """Filters a whole array of measurements at once, continuing from the current state.
+        The last axis is the time, every other axis an independent track (KalmanTracking then follows the
+        last sample of the first track). The measurements and predictions are only appended to the lists
+        if save is True."""
+        data = np.asarray(data)
+        if not data.size:
+            return np.array(data)
+        x0 = None
+        if self._Kalman is None:
+            # each track starts from its first measurement
+            self.__initKalmanState(data.flat[0])
+        else:
+            x0 = self._Kalman.GetCurrentState()[0,0]
+        cov = self._Kalman.GetCurrentProbability()[0,0]
+        predictions = kalman_filter(data, cov=cov, error_proc=self.error_proc,
+                                    error_measurement=self.error_measurement, x0=x0, steady_state=steady_state)
+        gains, covs = scalar_kalman_gains(data.shape[-1], cov, self.error_proc, self.error_measurement,
+                                          steady_state=steady_state)
+        self._Kalman.current_state_estimate = np.matrix([predictions.reshape(-1, data.shape[-1])[0, -1]])
+        self._Kalman.current_prob_estimate = np.matrix([covs[-1]])
+        if save:
+            self.measurements.extend(data.reshape(-1, data.shape[-1])[0].tolist())
+            self.predictions.extend(predictions.reshape(-1, data.shape[-1])[0].tolist())
+            probabilities = np.full(data.shape[-1], covs[-1])
+            probabilities[:len(covs)] = covs
+            self.probabilities.extend(probabilities.tolist())
+        return predictions
+
     def __stepKalmanNoSave(self,value):
         if self._Kalman is None:
             return value
@@ -0,0 +1,201 @@
+"""
+Streaming fringe displacement estimation, from a live camera or a recording read by EventsIterator.
+
+LiveDisplacementEstimator consumes event slices as they come, using a precomputed phase table (see
+fringe_displacement.py), or the phase tables of the columns of a FringeCalibration (see fringe_calibration.py).
+The phasor sums of the last timestamp (or time bin) of a slice, which may continue in the next slice, and the
+unwrapping state are kept between slices, so that the samples are the same as the ones of `fringe_displacement`
+over the whole recording. A sample is emitted as soon as a later event, or the end
+time of the slice, shows that it is complete.
+"""
+
+import numpy as np
+
+from fringe_displacement import lookup_phase, group_times, circular_mean, PhaseUnwrapper, DEFAULT_WAVELENGTH
+
+SAMPLE_FIELDS = ('t', 'phase', 'z', 'count')
+
+
+class DisplacementRingBuffer(object):
+    """
+    Fixed-size buffer holding the last displacement samples.
+
+    Args:
+        size (int): Maximum number of samples.
+    """
+
+    def __init__(self, size):
+        self.size = int(size)
+        self._arrays = {'t': np.zeros(self.size, dtype=np.int64), 'phase': np.zeros(self.size),
+                        'z': np.zeros(self.size), 'count': np.zeros(self.size, dtype=np.int64)}
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'DisplacementRingBuffer: {} / {} samples\n'.format(self._count, self.size)
+        return wrd
+
+    def extend(self, samples):
+        """Appends a dictionary of sample arrays, overwriting the oldest samples when full."""
+        n = len(samples['t'])
+        if n > self.size:
+            samples = {name: samples[name][-self.size:] for name in SAMPLE_FIELDS}
+            n = self.size
+        first = min(n, self.size - self._head)
+        for name in SAMPLE_FIELDS:
+            self._arrays[name][self._head:self._head + first] = samples[name][:first]
+            self._arrays[name][:n - first] = samples[name][first:n]
+        self._head = (self._head + n) % self.size
+        self._count = min(self._count + n, self.size)
+
+    def values(self):
+        """Returns the samples in chronological order, as a dictionary of arrays."""
+        start = (self._head - self._count) % self.size
+        index = (start + np.arange(self._count)) % self.size
+        return {name: self._arrays[name][index] for name in SAMPLE_FIELDS}
+
+
+class LiveDisplacementEstimator(object):
+    """
+    Computes the displacement of a surface from event slices, with state carried between slices.
+
+    Args:
+        y0 (int), phiroi (numpy array): Phase table shared by the columns of the ROI, see `calibrate_phase_table`.
+        xmin, xmax (int): Columns of the ROI (all the columns if None).
+        bin_us (int): Width of the time bins averaged together (every timestamp is a sample if None).
+        wavelength (float): Wavelength of the laser in m.
+        buffer_size (int): Number of samples kept in the ring buffer.
+        max_jump (float): Rejection threshold of the phase unwrapping in rad, see PhaseUnwrapper.
+        calibration (FringeCalibration): Phase tables of the columns, used instead of y0 and phiroi so that
+            each event is given the phase of its row in the table of its column.
+
+    Examples:
+        >>> estimator = LiveDisplacementEstimator(*load_phase_table("table.npz"), xmin=720, xmax=725)
+        >>> estimator = LiveDisplacementEstimator(calibration=FringeCalibration.load("cal.npz"), xmin=700, xmax=760)
+        >>> estimator.set_output_callback(lambda samples: print(samples['t'][-1], samples['z'][-1]))
+        >>> mv_iterator = EventsIterator(input_path="", delta_t=1000)
+        >>> for evs in mv_iterator:
+        >>>     estimator.process_events(evs, t_end=mv_iterator.get_current_time())
+    """
+
+    def __init__(self, y0=None, phiroi=None, xmin=None, xmax=None, bin_us=None, wavelength=DEFAULT_WAVELENGTH,
+                 buffer_size=2**16, max_jump=None, calibration=None):
+        if calibration is None and (y0 is None or phiroi is None):
+            raise ValueError("LiveDisplacementEstimator: a calibration or a phase table (y0, phiroi) is required")
+        self.y0 = None if y0 is None else int(y0)
+        self.phiroi = None if phiroi is None else np.asarray(phiroi)
+        self.calibration = calibration
+        self.xmin = xmin
+        self.xmax = xmax
+        self.bin_us = bin_us
+        self.wavelength = wavelength
+        self.buffer = DisplacementRingBuffer(buffer_size)
+        self._callback = None
+        # phasor sum of the last, possibly incomplete, sample
+        self._pending = None
+        self.unwrapper = PhaseUnwrapper(max_jump=max_jump)
+        self.sample_count = 0
+        self.rejected_count = 0
+
+    def __repr__(self):
+        wrd = ''
+        if self.calibration is not None:
+            wrd += 'LiveDisplacementEstimator: {} blocks of columns, rows {} to {}\n'.format(len(self.calibration),
+                                                                                         *self.calibration.rows())
+        else:
+            wrd += 'LiveDisplacementEstimator: rows {} to {}\n'.format(self.y0, self.y0 + len(self.phiroi) - 1)
+        wrd += 'samples : {}\n'.format(self.sample_count)
+        return wrd
+
+    def set_output_callback(self, callback):
+        """Sets a function called with the dictionary of arrays of the new samples, see `SAMPLE_FIELDS`."""
+        self._callback = callback
+
+    def process_events(self, events, t_end=None):
+        """
+        Processes a slice of events, later than the ones already processed.
+
+        Args:
+            events: structured array, EventBatch or dictionary of arrays with fields x, y, p and t
+            t_end (int): Time up to which all the events have been received (e.g. the current time of the
+                EventsIterator), so that the last sample is emitted without waiting for the next slice.
+        """
+        keep = np.asarray(events['p']) == 1
+        x = np.asarray(events['x'])
+        if self.xmin is not None:
+            keep &= x >= self.xmin
+        if self.xmax is not None:
+            keep &= x <= self.xmax
+        if self.calibration is not None:
+            phase, inside = self.calibration.lookup(x[keep], np.asarray(events['y'])[keep])
+        else:
+            phase, inside = lookup_phase(np.asarray(events['y'])[keep], self.y0, self.phiroi)
+        times, inverse = group_times(np.asarray(events['t'])[keep][inside], self.bin_us)
+        resultant, counts = circular_mean(phase, inverse, len(times))
+
+        # the pending sample is either continued by the first group of the slice, or complete
+        if self._pending is not None:
+            pending_t, pending_sum, pending_count = self._pending
+            if len(times) and times[0] == pending_t:
+                resultant[0] += pending_sum
+                counts[0] += pending_count
+            else:
+                times = np.concatenate(([pending_t], times))
+                resultant = np.concatenate(([pending_sum], resultant))
+                counts = np.concatenate(([pending_count], counts))
+            self._pending = None
+        if not len(times):
+            return
+
+        complete = len(times) - 1
+        if t_end is not None and t_end >= times[-1] + (self.bin_us or 1):
+            complete = len(times)
+        if complete < len(times):
+            self._pending = (times[-1], resultant[-1], counts[-1])
+        self._emit(times[:complete], resultant[:complete], counts[:complete])
+
+    def flush(self):
+        """Emits the last sample, at the end of the stream."""
+        if self._pending is not None:
+            pending_t, pending_sum, pending_count = self._pending
+            self._pending = None
+            self._emit(np.array([pending_t]), np.array([pending_sum]), np.array([pending_count]))
+
+    def _emit(self, times, resultant, counts):
+        if not len(times):
+            return
+        phase = np.angle(resultant)
+        unwrapped = self.unwrapper.unwrap(phase)
+        self.rejected_count += int(self.unwrapper.rejected.sum())
+        samples = {'t': times, 'phase': phase, 'z': unwrapped / (2 * np.pi) * self.wavelength / 2, 'count': counts}
+        self.sample_count += len(times)
+        self.buffer.extend(samples)
+        if self._callback is not None:
+            self._callback(samples)
+
+
+def run_live_displacement(input_path, y0=None, phiroi=None, xmin=None, xmax=None, bin_us=None,
+                          wavelength=DEFAULT_WAVELENGTH, callback=None, delta_t=1000, buffer_size=2**16,
+                          calibration=None):
+    """
+    Runs the estimator over a camera ("" or serial number) or a recording until the end of the stream.
+
+    The phases are looked up in the table (y0, phiroi), or in the table of the column of each event of
+    `calibration`.
+
+    Returns:
+        the LiveDisplacementEstimator, whose buffer holds the last samples
+    """
+    from metavision_core.event_io import EventsIterator
+    estimator = LiveDisplacementEstimator(y0, phiroi, xmin=xmin, xmax=xmax, bin_us=bin_us, wavelength=wavelength,
+                                          buffer_size=buffer_size, calibration=calibration)
+    estimator.set_output_callback(callback)
+    mv_iterator = EventsIterator(input_path=input_path, delta_t=delta_t)
+    for evs in mv_iterator:
+        estimator.process_events(evs, t_end=mv_iterator.get_current_time())
+    estimator.flush()
+    return estimator
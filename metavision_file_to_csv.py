@@ -12,6 +12,7 @@ Metavision RAW or DAT to CSV python sample.
 """
 
 from metavision_core.event_io import EventsIterator
+from csv_tools import CSVWriter
 import os
 from tqdm import tqdm
 
@@ -40,11 +41,11 @@ def main():
 
     mv_iterator = EventsIterator(input_path=args.event_file_path, delta_t=args.delta_t, start_ts=args.start_ts,
                                  max_duration=args.max_duration)
+    height, width = mv_iterator.get_size()
 
-    with open(output_file, 'w') as csv_file:
+    with CSVWriter(output_file, height=height, width=width) as csv_writer:
         for evs in tqdm(mv_iterator, total=args.max_duration // args.delta_t):
-            for (x, y, p, t) in evs:
-                csv_file.write("%d,%d,%d,%d\n" % (x, y, p, t))
+            csv_writer.write(evs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+"""
+RAW, DAT or HDF5 to EVZ (block-compressed events) python sample.
+"""
+
+from metavision_core.event_io import EventsIterator
+from evz_tools import EvzWriter
+import os
+from tqdm import tqdm
+
+
+def parse_args():
+    import argparse
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Metavision RAW, DAT or HDF5 to EVZ.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input-event-file', dest='event_file_path', required=True,
+                        help="Path to input event file (RAW, DAT or HDF5)")
+    parser.add_argument('-o', '--output-dir', required=True, help="Path to EVZ output directory")
+    parser.add_argument('-s', '--start-ts', type=int, default=0, help="start time in microsecond")
+    parser.add_argument('-d', '--max-duration', type=int, default=1e6 * 60, help="maximum duration in microsecond")
+    parser.add_argument('--delta-t', type=int, default=1000000, help="Duration of served event slice in us.")
+    parser.add_argument('--codec', choices=['zlib', 'lzma'], default='zlib', help="Compression codec of the blocks.")
+    parser.add_argument('--block-size', type=int, default=2**16, help="Number of events per compressed block.")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if os.path.isfile(args.event_file_path):
+        output_file = os.path.join(args.output_dir, os.path.splitext(os.path.basename(args.event_file_path))[0] + ".evz")
+    else:
+        raise TypeError(f'Fail to access file: {args.event_file_path}')
+
+    mv_iterator = EventsIterator(input_path=args.event_file_path, delta_t=args.delta_t, start_ts=args.start_ts,
+                                 max_duration=args.max_duration)
+    height, width = mv_iterator.get_size()
+
+    with EvzWriter(output_file, height=height, width=width, codec=args.codec, block_size=args.block_size) as writer:
+        for evs in tqdm(mv_iterator, total=args.max_duration // args.delta_t):
+            writer.write(evs)
+
+    print(f"Conversion completed: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+CSV, RAW, DAT or HDF5 to multi-resolution time x row / time x column heatmap pyramid.
+"""
+
+from heatmap_pyramid import build_heatmap_pyramid
+import os
+
+
+def parse_args():
+    import argparse
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Build the heatmap pyramid of a recording.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input-event-file', dest='event_file_path', required=True,
+                        help="Path to input event file (CSV, RAW, DAT or HDF5)")
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help="Path to the pyramid directory (input path with a .hpyr extension by default)")
+    parser.add_argument('--base-us', type=int, default=1000, help="Duration of the finest time bins in us.")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if not os.path.isfile(args.event_file_path):
+        raise TypeError(f'Fail to access file: {args.event_file_path}')
+
+    pyramid = build_heatmap_pyramid(args.event_file_path, output_dir=args.output_dir, base_us=args.base_us)
+    print(f"Heatmap pyramid completed: {pyramid.path} ({len(pyramid.levels['y'])} levels)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Metavision RAW, DAT or HDF5 to Parquet or Arrow IPC python sample.
+"""
+
+from metavision_core.event_io import EventsIterator
+from parquet_io import ParquetEventsWriter
+import os
+from tqdm import tqdm
+
+
+def parse_args():
+    import argparse
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Metavision RAW, DAT or HDF5 to Parquet or Arrow IPC.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input-event-file', dest='event_file_path', required=True,
+                        help="Path to input event file (RAW, DAT or HDF5)")
+    parser.add_argument('-o', '--output-dir', required=True, help="Path to output directory")
+    parser.add_argument('-s', '--start-ts', type=int, default=0, help="start time in microsecond")
+    parser.add_argument('-d', '--max-duration', type=int, default=1e6 * 60, help="maximum duration in microsecond")
+    parser.add_argument('--delta-t', type=int, default=1000000, help="Duration of served event slice in us.")
+    parser.add_argument('--slice-us', type=int, default=100000,
+                        help="Duration of the time slice covered by each row group in us.")
+    parser.add_argument('--format', choices=['parquet', 'arrow'], default='parquet', help="Output file format.")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if os.path.isfile(args.event_file_path):
+        output_file = os.path.join(args.output_dir, os.path.splitext(os.path.basename(args.event_file_path))[0] +
+                                   ('.parquet' if args.format == 'parquet' else '.arrow'))
+    else:
+        raise TypeError(f'Fail to access file: {args.event_file_path}')
+
+    mv_iterator = EventsIterator(input_path=args.event_file_path, delta_t=args.delta_t, start_ts=args.start_ts,
+                                 max_duration=args.max_duration)
+    height, width = mv_iterator.get_size()
+
+    with ParquetEventsWriter(output_file, height=height, width=width, slice_us=args.slice_us) as writer:
+        for evs in tqdm(mv_iterator, total=args.max_duration // args.delta_t):
+            writer.write(evs)
+
+    print(f"Conversion completed: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
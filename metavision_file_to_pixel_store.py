@@ -0,0 +1,33 @@
+"""
+CSV, RAW, DAT or HDF5 to pixel-major event store, for fast per-pixel and per-line queries.
+"""
+
+from pixel_store import build_pixel_store
+import os
+
+
+def parse_args():
+    import argparse
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Build the pixel-major event store of a recording.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-i', '--input-event-file', dest='event_file_path', required=True,
+                        help="Path to input event file (CSV, RAW, DAT or HDF5)")
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help="Path to the store directory (input path with a .pxs extension by default)")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if not os.path.isfile(args.event_file_path):
+        raise TypeError(f'Fail to access file: {args.event_file_path}')
+
+    store = build_pixel_store(args.event_file_path, output_dir=args.output_dir)
+    print(f"Pixel store completed: {store.path} ({len(store)} events)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Live displacement monitoring of a vibrating sample from the motion of interference fringes.
+The phase table of the column of pixels is computed beforehand, e.g. with displacementfringes.py --save-table, or
+the phase tables of all the columns with calibratefringes.py (each event then uses the table of its column), and
+the displacement is plotted while the events are received from the camera or replayed from a recording.
+"""
+
+from metavision_core.event_io import EventsIterator
+from metavision_core.event_io import LiveReplayEventsIterator, is_live_camera
+import matplotlib.pyplot as plt
+
+from fringe_displacement import DEFAULT_WAVELENGTH
+from fringe_calibration import FringeCalibration
+from live_displacement import LiveDisplacementEstimator
+
+
+def parse_args():
+    import argparse
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Live fringe displacement monitoring.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '-i', '--input-event-file', dest='event_file_path', default="",
+        help="Path to input event file (RAW, DAT or HDF5). If not specified, the camera live stream is used. "
+             "If it's a camera serial number, it will try to open that camera instead.")
+    parser.add_argument('-t', '--phase-table', required=True, help="Path to the .npz phase table of the column of pixels, or calibration file of the sensor (see calibratefringes.py).")
+    parser.add_argument('--xmin', type=int, default=None, help="Minimum X coordinate of the column of pixels.")
+    parser.add_argument('--xmax', type=int, default=None, help="Maximum X coordinate of the column of pixels.")
+    parser.add_argument('--bin-us', type=int, default=None,
+                        help="Average the phases over time bins of this width (us) instead of over each timestamp.")
+    parser.add_argument('--wavelength', type=float, default=DEFAULT_WAVELENGTH, help="Wavelength of the laser (m).")
+    parser.add_argument('--max-jump', type=float, default=None,
+                        help="Reject the samples whose phase is further than this (rad) from the Kalman prediction.")
+    parser.add_argument('--delta-t', type=int, default=1000, help="Duration of the event slices (us), the latency of the samples.")
+    parser.add_argument('--buffer-size', type=int, default=2**16, help="Number of samples kept and plotted.")
+    parser.add_argument('--plot-every', type=int, default=50, help="Number of slices between two plot updates.")
+    parser.add_argument(
+        '-f', '--replay_factor', type=float, default=1,
+        help="Replay Factor. If greater than 1.0 we replay with slow-motion, otherwise this is a speed-up over real-time.")
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """ Main """
+    args = parse_args()
+
+    calibration = FringeCalibration.load(args.phase_table).select(args.xmin, args.xmax)
+    if not len(calibration):
+        raise ValueError(f'No phase table for columns {args.xmin} to {args.xmax} in {args.phase_table}')
+    estimator = LiveDisplacementEstimator(xmin=args.xmin, xmax=args.xmax, bin_us=args.bin_us,
+                                          wavelength=args.wavelength, buffer_size=args.buffer_size,
+                                          max_jump=args.max_jump, calibration=calibration)
+
+    # Events iterator on Camera or event file
+    events_iterator = EventsIterator(input_path=args.event_file_path, delta_t=args.delta_t)
+    mv_iterator = events_iterator
+    if args.replay_factor > 0 and not is_live_camera(args.event_file_path):
+        mv_iterator = LiveReplayEventsIterator(events_iterator, replay_factor=args.replay_factor)
+
+    # Plot of the last samples
+    plt.ion()
+    fig, ax = plt.subplots(figsize=(12, 6))
+    line, = ax.plot([], [])
+    ax.set_xlabel('Time (t) us')
+    ax.set_ylabel('Displacement (um)')
+    ax.grid(True)
+
+    # Process events
+    for i, evs in enumerate(mv_iterator):
+        estimator.process_events(evs, t_end=events_iterator.get_current_time())
+
+        if i % args.plot_every == 0 and len(estimator.buffer):
+            samples = estimator.buffer.values()
+            line.set_data(samples['t'], samples['z'] / 1e-6)
+            ax.relim()
+            ax.autoscale_view()
+            fig.canvas.draw_idle()
+            plt.pause(0.001)
+        if not plt.fignum_exists(fig.number):
+            break
+
+    estimator.flush()
+    print(f"Displacement samples: {estimator.sample_count}")
+    if args.max_jump is not None:
+        print(f"Rejected samples: {estimator.rejected_count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,34 @@
-import pandas as pd
 import numpy as np
 import argparse
 import matplotlib.pyplot as plt
 from scipy.signal import find_peaks
+from event_query import query_events
+from pixel_store import PixelStore
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Analyze the oscillation periods of a pixel from event data.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('--x', type=int, required=True, help='X coordinate of the pixel.')
     parser.add_argument('--y', type=int, required=True, help='Y coordinate of the pixel.')
     parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
     parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
+    parser.add_argument('--pixel-store', required=False, default=None, help='Path to the pixel store of the recording, read instead of the CSV file.')
     return parser.parse_args()
 
-def analyze_oscillation_periods(input_csv, x, y, t_min=None, t_max=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
-
-    # Filter the DataFrame for the specified pixel
-    pixel_df = df[(df['x'] == x) & (df['y'] == y)].sort_values(by='t')
-
-    if t_min is not None:
-        pixel_df = pixel_df[pixel_df['t'] >= t_min]
-    if t_max is not None:
-        pixel_df = pixel_df[pixel_df['t'] <= t_max]
-
-    if pixel_df.empty:
+def analyze_oscillation_periods(input_csv, x, y, t_min=None, t_max=None, pixel_store=None):
+    # Read the events of the specified pixel inside the time range, sorted by time
+    if pixel_store is not None:
+        pixel_events = PixelStore(pixel_store).pixel(x, y, tmin=t_min, tmax=t_max)
+        time, polarity = pixel_events.t, pixel_events.p
+    else:
+        pixel_df = query_events(input_csv, x=x, y=y, t=(t_min, t_max), as_dataframe=True)
+        pixel_df = pixel_df.sort_values(by='t')
+        time, polarity = pixel_df['t'].values, pixel_df['p'].values
+
+    if len(time) == 0:
         print(f"No data found for pixel ({x}, {y}) within the specified time range.")
         return
 
-    # Extract time and polarity
-    time = pixel_df['t'].values
-    polarity = pixel_df['p'].values
-
     # Detect polarity changes (extrema)
     changes = np.where(np.diff(polarity) != 0)[0] + 1
 
@@ -57,7 +53,7 @@ def analyze_oscillation_periods(input_csv, x, y, t_min=None, t_max=None):
 
 def main():
     args = parse_args()
-    analyze_oscillation_periods(args.input_csv, args.x, args.y, args.tmin, args.tmax)
+    analyze_oscillation_periods(args.input_csv, args.x, args.y, args.tmin, args.tmax, args.pixel_store)
 
 if __name__ == "__main__":
     main()
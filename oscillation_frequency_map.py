@@ -0,0 +1,64 @@
+import numpy as np
+import matplotlib.pyplot as plt
+import argparse
+from oscillation_map import compute_oscillation_map
+from analysis_cache import cached
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Plot the oscillation frequency, period spread and number of periods of every pixel from the polarity transitions.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
+    parser.add_argument('--xmin', type=int, required=False, default=None, help='Minimum x value to consider.')
+    parser.add_argument('--xmax', type=int, required=False, default=None, help='Maximum x value to consider.')
+    parser.add_argument('--ymin', type=int, required=False, default=None, help='Minimum y value to consider.')
+    parser.add_argument('--ymax', type=int, required=False, default=None, help='Maximum y value to consider.')
+    parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time value to consider.')
+    parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time value to consider.')
+    parser.add_argument('--min-period', type=int, required=False, default=0, help='Ignore periods shorter than this (us).')
+    parser.add_argument('--max-period', type=int, required=False, default=None, help='Ignore periods longer than this (us).')
+    parser.add_argument('--min-count', type=int, required=False, default=3, help='Minimum number of periods to show a pixel.')
+    parser.add_argument('--height', type=int, required=False, default=None, help='Sensor height, read from the file header if not set (or taken from the events).')
+    parser.add_argument('--width', type=int, required=False, default=None, help='Sensor width, read from the file header if not set (or taken from the events).')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='Recompute the results instead of reusing the cached ones.')
+    return parser.parse_args()
+
+def compute_maps(input_csv, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None, min_period=0, max_period=None, height=None, width=None):
+    # Find the polarity transitions of all the pixels in one streaming pass
+    oscillations = compute_oscillation_map(input_csv, xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, tmin=tmin, tmax=tmax,
+                                           min_period=min_period, max_period=max_period, height=height, width=width)
+    print(f"Number of events after filtering: {oscillations.ev_count}")
+    return oscillations.maps()
+
+def plot_oscillation_maps(input_csv, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None, min_period=0, max_period=None, min_count=3, use_cache=True, height=None, width=None):
+    # Compute the maps, or reuse them if they were already computed with the same parameters
+    maps = cached('oscillation_map', input_csv,
+                  lambda: compute_maps(input_csv, xmin, xmax, ymin, ymax, tmin, tmax, min_period, max_period, height, width),
+                  use_cache=use_cache, version=3, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax), period=(min_period, max_period),
+                  size=(height, width))
+
+    # Hide the pixels without enough periods
+    hidden = maps['count'] < min_count
+    print(f"Pixels with at least {min_count} periods: {np.count_nonzero(~hidden)}")
+
+    fig, ax = plt.subplots(1, 3, figsize=(18, 6), sharex=True, sharey=True)
+    for axis, name, label in ((ax[0], 'frequency', 'Median frequency (Hz)'),
+                              (ax[1], 'spread', 'Interquartile range of the periods (us)'),
+                              (ax[2], 'count', 'Number of periods')):
+        image = np.ma.masked_where(hidden, maps[name])
+        im = axis.imshow(image, cmap='viridis', origin='lower', interpolation='nearest')
+        fig.colorbar(im, ax=axis, label=label)
+        axis.set_xlabel('x [px]')
+        axis.set_title(label)
+    ax[0].set_ylabel('y [px]')
+    if xmin is not None or xmax is not None:
+        ax[0].set_xlim((xmin or 0) - 0.5, (xmax if xmax is not None else maps['count'].shape[1] - 1) + 0.5)
+    if ymin is not None or ymax is not None:
+        ax[0].set_ylim((ymin or 0) - 0.5, (ymax if ymax is not None else maps['count'].shape[0] - 1) + 0.5)
+    plt.show()
+
+def main():
+    args = parse_args()
+    plot_oscillation_maps(args.input_csv, args.xmin, args.xmax, args.ymin, args.ymax, args.tmin, args.tmax,
+                          args.min_period, args.max_period, args.min_count, args.use_cache, args.height, args.width)
+
+if __name__ == "__main__":
+    main()
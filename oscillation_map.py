@@ -0,0 +1,237 @@
+"""
+Sensor-wide oscillation period and frequency maps from polarity transitions.
+
+A pixel watching a vibrating surface switches between ON and OFF events at each extremum of the motion. The
+period of the oscillation is measured between consecutive transitions in the same direction (OFF to ON, or ON
+to OFF) of a pixel. Events are streamed by slices: each slice is sorted by (pixel, t) with a stable sort, the
+transitions of all the pixels are found at once, and the polarity and transition times of each pixel are kept
+between slices. The sensor is split in bands of rows processed in parallel. When the size of the sensor is not
+known, the maps grow to the extent of the events.
+
+The periods themselves are not kept: they are counted in a sparse histogram of log-spaced bins per pixel
+(BINS_PER_OCTAVE bins each time the period doubles, about 1% wide), merged after each slice, so that the memory
+depends on the number of distinct (pixel, bin) pairs and not on the duration of the recording. The quantiles
+are interpolated inside the bins.
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from event_batch import iter_file_batches, get_file_size
+
+BINS_PER_OCTAVE = 64
+# number of bins of a pixel, enough for any int64 period
+MAX_BINS = 64 * BINS_PER_OCTAVE
+
+
+def _period_bins(periods):
+    """Returns the histogram bins of periods in us, bin b holding the periods in [edge(b), edge(b + 1))."""
+    return np.floor(np.log2(periods + 1.0) * BINS_PER_OCTAVE).astype(np.int64)
+
+
+def _bin_edges(bins):
+    """Returns the lower edges in us of histogram bins."""
+    return np.exp2(bins / BINS_PER_OCTAVE) - 1
+
+
+def _histogram_quantiles(keys, counts, size, fractions):
+    """
+    Returns the quantiles of the periods of each pixel, interpolated inside the bins of their histogram.
+
+    Args:
+        keys (np.array): Sorted pixel * MAX_BINS + bin keys of the non-empty bins.
+        counts (np.array): Number of periods in each bin.
+        size (int): Number of pixels.
+        fractions (tuple): Quantiles to compute, in [0, 1].
+
+    Returns:
+        (len(fractions), size) array, nan for the pixels without periods
+    """
+    quantiles = np.full((len(fractions), size), np.nan)
+    if not len(keys):
+        return quantiles
+    pixels, bins = keys // MAX_BINS, keys % MAX_BINS
+    cumulative = np.cumsum(counts)
+    before = cumulative - counts
+    first = np.concatenate(([True], pixels[1:] != pixels[:-1]))
+    last = np.concatenate((first[1:], [True]))
+    for i, fraction in enumerate(fractions):
+        # rank of the quantile among the periods of all the pixels, and bin holding it
+        rank = before[first] + fraction * (cumulative[last] - before[first] - 1)
+        index = np.searchsorted(cumulative, rank, side='right')
+        lower = _bin_edges(bins[index])
+        width = _bin_edges(bins[index] + 1) - lower
+        quantiles[i, pixels[first]] = lower + (rank - before[index] + 0.5) / counts[index] * width
+    return quantiles
+
+
+class OscillationMapAccumulator(object):
+    """
+    Accumulates histograms of the polarity transition periods of every pixel over chronologically ordered event
+    slices.
+
+    Maps returned by `maps` (all of shape (height, width), nan where a pixel has no period):
+        count: number of periods
+        median_period: median period in us (up to the width of a histogram bin)
+        spread: interquartile range of the periods in us (up to the width of a histogram bin)
+        frequency: 1e6 / median_period, in Hz
+
+    Args:
+        height (int): Sensor height in pixels (the maps grow to hold the events of rows beyond it).
+        width (int): Sensor width in pixels (the maps grow to hold the events of columns beyond it).
+        min_period, max_period (int): Periods outside of this range (in us) are ignored.
+        tile_rows (int): Number of rows of the bands processed in parallel.
+        workers (int): Number of threads (as many as CPUs if None).
+
+    Examples:
+        >>> oscillations = OscillationMapAccumulator(720, 1280)
+        >>> for evs in EventsIterator("recording.raw"):
+        >>>     oscillations.update(evs)
+        >>> plt.imshow(oscillations.maps()['frequency'])
+    """
+
+    def __init__(self, height=0, width=0, min_period=0, max_period=None, tile_rows=64, workers=None):
+        self.height = int(height)
+        self.width = int(width)
+        self.min_period = min_period
+        self.max_period = max_period
+        self.tile_rows = int(tile_rows)
+        self.workers = workers or os.cpu_count()
+        size = self.height * self.width
+        self.last_p = np.full(size, -1, dtype=np.int8)
+        # time of the last transition of each pixel to polarity 0 (index 2 * pixel) and 1 (index 2 * pixel + 1)
+        self.last_transition = np.full(2 * size, -1, dtype=np.int64)
+        # sparse histograms of the periods: sorted pixel * MAX_BINS + bin keys of the non-empty bins, and counts
+        self._keys = np.empty((0,), dtype=np.int64)
+        self._counts = np.empty((0,), dtype=np.int64)
+        self.ev_count = 0
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'OscillationMapAccumulator: Width {}, Height  {}\n'.format(self.width, self.height)
+        wrd += 'events : {}, periods : {}\n'.format(self.ev_count, int(self._counts.sum()))
+        return wrd
+
+    def _resize(self, height, width):
+        """Grows the maps to (height, width), keeping the state and the histograms of the pixels already seen."""
+        last_p = np.full((height, width), -1, dtype=np.int8)
+        last_p[:self.height, :self.width] = self.last_p.reshape(self.height, self.width)
+        last_transition = np.full((height, width, 2), -1, dtype=np.int64)
+        last_transition[:self.height, :self.width] = self.last_transition.reshape(self.height, self.width, 2)
+        self.last_p, self.last_transition = last_p.ravel(), last_transition.ravel()
+        # the row-major order of the pixels, and so of the keys, is kept
+        pixels, bins = self._keys // MAX_BINS, self._keys % MAX_BINS
+        self._keys = (pixels // self.width * width + pixels % self.width) * MAX_BINS + bins
+        self.height, self.width = height, width
+
+    def _tile_periods(self, keys, t, p):
+        """Finds the transitions of events of a set of pixels, updates their state and returns their periods."""
+        order = np.argsort(keys, kind='stable')
+        keys, t, p = keys[order], t[order], p[order]
+        first = np.concatenate(([True], keys[1:] != keys[:-1]))
+        last = np.concatenate((first[1:], [True]))
+        previous_p = np.empty_like(p)
+        previous_p[1:] = p[:-1]
+        previous_p[first] = self.last_p[keys[first]]
+        self.last_p[keys[last]] = p[last]
+
+        # transitions, grouped by (pixel, direction) and sorted by time inside each group
+        change = (p != previous_p) & (previous_p >= 0)
+        transition_keys = keys[change] * 2 + p[change]
+        order = np.argsort(transition_keys, kind='stable')
+        transition_keys, transition_t = transition_keys[order], t[change][order]
+        first = np.concatenate(([True], transition_keys[1:] != transition_keys[:-1]))
+        last = np.concatenate((first[1:], [True]))
+        previous_t = np.empty_like(transition_t)
+        previous_t[1:] = transition_t[:-1]
+        previous_t[first] = self.last_transition[transition_keys[first]]
+        self.last_transition[transition_keys[last]] = transition_t[last]
+
+        valid = previous_t >= 0
+        return transition_keys[valid] // 2, transition_t[valid] - previous_t[valid]
+
+    def update(self, events):
+        """
+        Adds a slice of events, later than the ones already added.
+
+        Args:
+            events: structured array, EventBatch or dictionary of arrays with fields x, y, p and t
+        """
+        if not len(events['t']):
+            return
+        x = np.asarray(events['x'], dtype=np.int64)
+        y = np.asarray(events['y'], dtype=np.int64)
+        height, width = max(self.height, int(y.max()) + 1), max(self.width, int(x.max()) + 1)
+        if (height, width) != (self.height, self.width):
+            self._resize(height, width)
+        keys = y * self.width + x
+        t = np.asarray(events['t'], dtype=np.int64)
+        p = np.asarray(events['p'], dtype=np.int8)
+        self.ev_count += len(t)
+        num_tiles = (self.height + self.tile_rows - 1) // self.tile_rows
+        if self.workers == 1 or num_tiles == 1:
+            results = [self._tile_periods(keys, t, p)]
+        else:
+            # bands of rows hold disjoint pixels, so their states are updated independently
+            tiles = y // self.tile_rows
+            order = np.argsort(tiles, kind='stable')
+            bounds = np.searchsorted(tiles[order], np.arange(num_tiles + 1))
+            parts = [order[start:stop] for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(lambda part: self._tile_periods(keys[part], t[part], p[part]), parts))
+        pixels = np.concatenate([pixels for pixels, _ in results])
+        periods = np.concatenate([periods for _, periods in results])
+        keep = periods >= self.min_period
+        if self.max_period is not None:
+            keep &= periods <= self.max_period
+        # histogram of the slice, merged with the histograms of the previous slices
+        keys, counts = np.unique(pixels[keep] * MAX_BINS + _period_bins(periods[keep]), return_counts=True)
+        keys, inverse = np.unique(np.concatenate((self._keys, keys)), return_inverse=True)
+        self._counts = np.bincount(inverse, weights=np.concatenate((self._counts, counts)),
+                                   minlength=len(keys)).astype(np.int64)
+        self._keys = keys
+
+    def maps(self):
+        """Returns the dictionary of the (height, width) period and frequency maps."""
+        size = self.height * self.width
+        counts = np.bincount(self._keys // MAX_BINS, weights=self._counts, minlength=size).astype(np.int64)
+        quantiles = _histogram_quantiles(self._keys, self._counts, size, (0.25, 0.5, 0.75))
+        shape = (self.height, self.width)
+        with np.errstate(divide='ignore'):
+            frequency = 1e6 / quantiles[1]
+        return {'count': counts.reshape(shape), 'median_period': quantiles[1].reshape(shape),
+                'spread': (quantiles[2] - quantiles[0]).reshape(shape), 'frequency': frequency.reshape(shape)}
+
+
+def compute_oscillation_map(input_path, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None,
+                            min_period=0, max_period=None, height=None, width=None, delta_t=1000000, workers=None):
+    """
+    Computes the oscillation maps of a recording in one streaming pass.
+
+    The ranges are passed to the reader (see `iter_file_batches`).
+
+    Args:
+        input_path (str): Path to a CSV, EVZ, NPY, Parquet or Arrow IPC file, to a pixel store directory, or to a
+            file supported by EventsIterator (RAW, DAT, HDF5).
+        xmin, xmax, ymin, ymax (int): Pixel ranges, the events outside of them are ignored.
+        tmin, tmax (int): Time range in us.
+        min_period, max_period (int): Periods outside of this range (in us) are ignored.
+        height, width (int): Sensor size, read from the file header if None. Without a header, the maps cover
+            the pixels up to (ymax, xmax), or up to the last row and column holding events.
+        delta_t (int): Duration of the slices read by EventsIterator in us.
+        workers (int): Number of threads (as many as CPUs if None).
+
+    Returns:
+        an OscillationMapAccumulator holding the histograms of the periods
+    """
+    if height is None or width is None:
+        height, width = get_file_size(input_path)
+    if height is None or width is None:
+        height, width = (0 if ymax is None else ymax + 1), (0 if xmax is None else xmax + 1)
+    oscillations = OscillationMapAccumulator(height, width, min_period=min_period, max_period=max_period,
+                                             workers=workers)
+    for batch in iter_file_batches(input_path, delta_t=delta_t, xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
+                                   tmin=tmin, tmax=tmax):
+        oscillations.update(batch)
+    return oscillations
@@ -0,0 +1,203 @@
+"""
+Writes events to Parquet or Arrow IPC files with time-aligned row groups, and reads them back with range filters.
+
+Each row group (Parquet) or record batch (Arrow IPC) holds the events of one time slice of `slice_us`
+microseconds. Parquet stores min/max statistics on every column of every row group, so that a filter such as
+tmin <= t <= tmax or xmin <= x <= xmax skips the row groups which cannot match instead of scanning them.
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCHEMA = pa.schema([('x', pa.uint16()), ('y', pa.uint16()), ('p', pa.uint8()), ('t', pa.int64())])
+
+
+def _file_format(filename):
+    return 'arrow' if filename.lower().endswith(('.arrow', '.feather', '.ipc')) else 'parquet'
+
+
+def _to_table(events):
+    return pa.Table.from_arrays([pa.array(np.asarray(events[name]).astype(SCHEMA.field(name).type.to_pandas_dtype(),
+                                                                          copy=False))
+                                 for name in SCHEMA.names], schema=SCHEMA)
+
+
+class ParquetEventsWriter(object):
+    """Convenience class used to write CD events to a Parquet or an Arrow IPC file.
+
+    Events are buffered and written one time slice at a time, so that every row group (or record batch)
+    covers [k * slice_us, (k + 1) * slice_us). Empty slices are skipped.
+
+    Args:
+        filename (string): Path to the destination file, written as Arrow IPC if the extension is .arrow,
+            .feather or .ipc, as Parquet otherwise
+        height (int): Imager height in pixels, stored in the file metadata
+        width (int): Imager width in pixels, stored in the file metadata
+        slice_us (int): Duration of the time slice of a row group in us
+        compression (string): Parquet compression codec
+
+    Examples:
+        >>> with ParquetEventsWriter("my_file.parquet", height=720, width=1280) as writer:
+        >>>     for evs in EventsIterator("my_file.raw", delta_t=100000):
+        >>>         writer.write(evs)
+    """
+
+    def __init__(self, filename, height=None, width=None, slice_us=100000, compression='zstd'):
+        self._path = filename
+        self.format = _file_format(filename)
+        self.slice_us = int(slice_us)
+        assert self.slice_us > 0, "slice_us must be positive"
+        self.height = height
+        self.width = width
+        metadata = {b'slice_us': str(self.slice_us).encode()}
+        if height is not None and width is not None:
+            metadata[b'geometry'] = '{}x{}'.format(width, height).encode()
+        schema = SCHEMA.with_metadata(metadata)
+        if self.format == 'parquet':
+            self._writer = pq.ParquetWriter(filename, schema, compression=compression, write_statistics=True)
+        else:
+            self._sink = pa.OSFile(filename, 'wb')
+            self._writer = pa.ipc.new_file(self._sink, schema)
+        self._pending = []
+        self._slice = None
+        self.ev_count = 0
+        self.current_time = 0
+        self._closed = False
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'ParquetEventsWriter: path {} ({})\n'.format(self._path, self.format)
+        wrd += 'Width {}, Height  {}, slice {} us\n'.format(self.width, self.height, self.slice_us)
+        wrd += 'events written : {}, last timestamp {}\n'.format(self.ev_count, self.current_time)
+        return wrd
+
+    def write(self, events):
+        """
+        Writes events of fields x,y,p,t into the file.
+
+        Args:
+            events (numpy array): Events to write, in chronological order
+        """
+        if not len(events):
+            return
+        t = events['t']
+        assert t[0] >= self.current_time, "events must be written in chronological order"
+        slices = t // self.slice_us
+        # boundaries between time slices inside this chunk
+        cuts = np.flatnonzero(np.diff(slices)) + 1
+        starts = np.concatenate(([0], cuts))
+        ends = np.concatenate((cuts, [len(events)]))
+        for start, end in zip(starts, ends):
+            k = int(slices[start])
+            if self._slice is not None and k != self._slice:
+                self._flush()
+            self._slice = k
+            self._pending.append(events[start:end])
+        self.ev_count += len(events)
+        self.current_time = t[-1]
+
+    def _flush(self):
+        if not self._pending:
+            return
+        events = self._pending[0] if len(self._pending) == 1 else np.concatenate(self._pending)
+        table = _to_table(events)
+        if self.format == 'parquet':
+            self._writer.write_table(table, row_group_size=len(table))
+        else:
+            for batch in table.to_batches(max_chunksize=len(table)):
+                self._writer.write_batch(batch)
+        self._pending = []
+
+    def close(self):
+        if self._closed:
+            return
+        self._flush()
+        self._writer.close()
+        if self.format == 'arrow':
+            self._sink.close()
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, "_closed"):
+            self.close()
+
+
+def get_size(filename):
+    """Returns the (height, width) stored in the metadata of a file written by ParquetEventsWriter, or (None, None)."""
+    if _file_format(filename) == 'parquet':
+        metadata = pq.read_schema(filename).metadata or {}
+    else:
+        with pa.memory_map(filename) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if b'geometry' not in metadata:
+        return None, None
+    width, height = (int(v) for v in metadata[b'geometry'].decode().split('x'))
+    return height, width
+
+
+def _filters(tmin, tmax, xmin, xmax, ymin, ymax, polarity):
+    filters = []
+    for name, op, value in (('t', '>=', tmin), ('t', '<=', tmax), ('x', '>=', xmin), ('x', '<=', xmax),
+                            ('y', '>=', ymin), ('y', '<=', ymax), ('p', '==', polarity)):
+        if value is not None:
+            filters.append((name, op, int(value)))
+    return filters
+
+
+def read_events(filename, tmin=None, tmax=None, xmin=None, xmax=None, ymin=None, ymax=None, polarity=None,
+                columns=None):
+    """
+    Reads the events of a Parquet or Arrow IPC file matching the given ranges (bounds included).
+
+    For Parquet files the ranges are pushed down to the reader, which skips the row groups whose min/max
+    statistics do not intersect them. Arrow IPC files are memory-mapped and the record batches outside of
+    [tmin, tmax] are skipped by looking at their first and last timestamps.
+
+    Args:
+        filename (string): Path to the file.
+        tmin, tmax (int): Time range in us.
+        xmin, xmax, ymin, ymax (int): Pixel ranges.
+        polarity (int): Keeps only the events of this polarity.
+        columns (list): Columns to load, all of them if None.
+
+    Returns:
+        pandas DataFrame with narrow typed columns x (uint16), y (uint16), p (uint8), t (int64)
+    """
+    filters = _filters(tmin, tmax, xmin, xmax, ymin, ymax, polarity)
+    if _file_format(filename) == 'parquet':
+        table = pq.read_table(filename, columns=columns, filters=filters or None)
+        return table.to_pandas()
+
+    with pa.memory_map(filename) as source:
+        reader = pa.ipc.open_file(source)
+        batches = []
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            t = batch.column('t')
+            if not len(t):
+                continue
+            if (tmin is not None and t[len(t) - 1].as_py() < tmin) or (tmax is not None and t[0].as_py() > tmax):
+                continue
+            if filters:
+                mask = np.ones(len(batch), dtype=bool)
+                for name, op, value in filters:
+                    values = batch.column(name).to_numpy()
+                    if op == '>=':
+                        mask &= values >= value
+                    elif op == '<=':
+                        mask &= values <= value
+                    else:
+                        mask &= values == value
+                batch = batch.filter(pa.array(mask))
+            batches.append(batch)
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+        if columns is not None:
+            table = table.select(columns)
+        return table.to_pandas()
@@ -0,0 +1,134 @@
+"""
+Single-pass per-pixel statistics of a recording.
+
+PixelStatsAccumulator consumes event slices (EventsIterator slices, EventBatch objects, ...) and updates
+sensor-sized maps with np.bincount on the pixel index y * width + x, so that the memory used only depends on
+the size of the sensor, whatever the number of events. When the size of the sensor is not known, the maps grow
+to the extent of the events.
+"""
+
+import numpy as np
+
+from event_batch import iter_file_batches, get_file_size
+
+
+class PixelStatsAccumulator(object):
+    """
+    Accumulates per-pixel event statistics over chronologically ordered event slices.
+
+    Maps returned by `maps` (all of shape (height, width)):
+        counts: number of events
+        on, off: number of events of polarity 1 and 0
+        on_ratio: fraction of ON events (nan where there is no event)
+        on_off_ratio: ON / OFF (nan where there is no OFF event)
+        first_t, last_t: timestamps of the first and last events in us (-1 where there is no event)
+        mean_interval: mean time between consecutive events in us (nan where there are less than 2 events)
+
+    Args:
+        height (int): Sensor height in pixels (the maps grow to hold the events of rows beyond it).
+        width (int): Sensor width in pixels (the maps grow to hold the events of columns beyond it).
+
+    Examples:
+        >>> stats = PixelStatsAccumulator(720, 1280)
+        >>> for evs in EventsIterator("recording.raw"):
+        >>>     stats.update(evs)
+        >>> plt.imshow(stats.maps()['mean_interval'])
+    """
+
+    def __init__(self, height=0, width=0):
+        self.height = int(height)
+        self.width = int(width)
+        size = self.height * self.width
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.on = np.zeros(size, dtype=np.int64)
+        self.first_t = np.full(size, -1, dtype=np.int64)
+        self.last_t = np.full(size, -1, dtype=np.int64)
+        self.ev_count = 0
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'PixelStatsAccumulator: Width {}, Height  {}\n'.format(self.width, self.height)
+        wrd += 'events : {}, active pixels : {}\n'.format(self.ev_count, int(np.count_nonzero(self.counts)))
+        return wrd
+
+    def _resize(self, height, width):
+        """Grows the maps to (height, width), keeping the statistics of the pixels already seen."""
+        for name, fill in (('counts', 0), ('on', 0), ('first_t', -1), ('last_t', -1)):
+            grown = np.full((height, width), fill, dtype=np.int64)
+            grown[:self.height, :self.width] = getattr(self, name).reshape(self.height, self.width)
+            setattr(self, name, grown.ravel())
+        self.height, self.width = height, width
+
+    def update(self, events):
+        """
+        Adds a slice of events, later than the ones already added.
+
+        Args:
+            events: structured array, EventBatch or dictionary of arrays with fields x, y, p and t
+        """
+        if not len(events['t']):
+            return
+        x = np.asarray(events['x'], dtype=np.int64)
+        y = np.asarray(events['y'], dtype=np.int64)
+        height, width = max(self.height, int(y.max()) + 1), max(self.width, int(x.max()) + 1)
+        if (height, width) != (self.height, self.width):
+            self._resize(height, width)
+        size = self.height * self.width
+        keys = y * self.width + x
+        t = np.asarray(events['t'], dtype=np.int64)
+        self.counts += np.bincount(keys, minlength=size)
+        self.on += np.bincount(keys, weights=np.asarray(events['p']) == 1, minlength=size).astype(np.int64)
+
+        # events are sorted by time: the first event of a pixel in the slice is its first occurrence
+        pixels, first = np.unique(keys, return_index=True)
+        new = self.first_t[pixels] < 0
+        self.first_t[pixels[new]] = t[first[new]]
+        pixels, last = np.unique(keys[::-1], return_index=True)
+        self.last_t[pixels] = t[len(t) - 1 - last]
+        self.ev_count += len(t)
+
+    def maps(self):
+        """Returns the dictionary of the (height, width) statistic maps."""
+        shape = (self.height, self.width)
+        counts = self.counts.astype(np.float64)
+        off = self.counts - self.on
+        with np.errstate(divide='ignore', invalid='ignore'):
+            on_ratio = np.where(self.counts > 0, self.on / counts, np.nan)
+            on_off_ratio = np.where(off > 0, self.on / off, np.nan)
+            # with sorted timestamps, the intervals of a pixel sum up to last_t - first_t
+            mean_interval = np.where(self.counts > 1, (self.last_t - self.first_t) / (counts - 1), np.nan)
+        return {'counts': self.counts.reshape(shape), 'on': self.on.reshape(shape), 'off': off.reshape(shape),
+                'on_ratio': on_ratio.reshape(shape), 'on_off_ratio': on_off_ratio.reshape(shape),
+                'first_t': self.first_t.reshape(shape), 'last_t': self.last_t.reshape(shape),
+                'mean_interval': mean_interval.reshape(shape)}
+
+
+def compute_pixel_stats(input_path, xmin=None, xmax=None, ymin=None, ymax=None, tmin=None, tmax=None,
+                        height=None, width=None, delta_t=1000000):
+    """
+    Computes the per-pixel statistics of a recording in one streaming pass.
+
+    The ranges are passed to the reader (see `iter_file_batches`), so that e.g. an indexed CSV file is only
+    read over the time range.
+
+    Args:
+        input_path (str): Path to a CSV, EVZ, NPY, Parquet or Arrow IPC file, to a pixel store directory, or to a
+            file supported by EventsIterator (RAW, DAT, HDF5).
+        xmin, xmax, ymin, ymax (int): Pixel ranges, the events outside of them are not counted.
+        tmin, tmax (int): Time range in us.
+        height, width (int): Sensor size, read from the file header if None. Without a header, the maps cover
+            the pixels up to (ymax, xmax), or up to the last row and column holding events.
+        delta_t (int): Duration of the slices read by EventsIterator in us.
+
+    Returns:
+        a PixelStatsAccumulator holding the statistics
+    """
+    if height is None or width is None:
+        height, width = get_file_size(input_path)
+    if height is None or width is None:
+        height, width = (0 if ymax is None else ymax + 1), (0 if xmax is None else xmax + 1)
+    stats = PixelStatsAccumulator(height, width)
+    for batch in iter_file_batches(input_path, delta_t=delta_t, xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax,
+                                   tmin=tmin, tmax=tmax):
+        stats.update(batch)
+    return stats
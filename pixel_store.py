@@ -0,0 +1,215 @@
+"""
+Pixel-major (CSR) event store for per-pixel, per-row and per-column queries.
+
+Events of a recording are stored sorted by pixel (key y * width + x) and by time inside each pixel, so that
+the events of one pixel are a contiguous slice of the timestamp and polarity arrays:
+
+    t[offsets[key]:offsets[key + 1]]
+
+A store is a directory holding offsets.npy (int64, height * width + 1 values), t.npy (int64), p.npy (uint8)
+and size.npy (height, width). Arrays are memory-mapped when the store is opened, so a query only reads the
+pages holding the matching events, whatever the size of the recording.
+"""
+
+import os
+import numpy as np
+
+from event_batch import EventBatch, iter_file_batches, get_file_size
+
+STORE_SUFFIX = '.pxs'
+
+
+def build_pixel_store(input_path, output_dir=None, height=None, width=None):
+    """
+    Builds the pixel-major store of a recording in two passes over the file.
+
+    The first pass counts the events of each pixel (which gives the offsets), the second one scatters every
+    slice of events to its final position. Since the events are read in chronological order and each slice is
+    sorted by pixel with a stable sort, the events of each pixel stay sorted by time.
+
+    Args:
+        input_path (str): Path to a CSV or EVZ file, or to a file supported by EventsIterator (RAW, DAT, HDF5).
+        output_dir (str): Path of the store directory (input path with a .pxs extension if None).
+        height, width (int): Sensor size, read from the file header if None. When the header does not give it
+            either, the smallest size holding all the events is used.
+
+    Returns:
+        a PixelStore opened on the new store
+    """
+    if output_dir is None:
+        output_dir = os.path.splitext(input_path)[0] + STORE_SUFFIX
+    if height is None or width is None:
+        height, width = get_file_size(input_path)
+
+    # first pass: per-pixel counts, growing the grid when the geometry is unknown
+    counts = np.zeros((height or 0, width or 0), dtype=np.int64)
+    for batch in iter_file_batches(input_path):
+        x, y = batch.x, batch.y
+        h = max(counts.shape[0], int(y.max()) + 1)
+        w = max(counts.shape[1], int(x.max()) + 1)
+        if (h, w) != counts.shape:
+            grown = np.zeros((h, w), dtype=np.int64)
+            grown[:counts.shape[0], :counts.shape[1]] = counts
+            counts = grown
+        counts += np.bincount(y.astype(np.int64) * w + x, minlength=h * w).reshape(h, w)
+    height, width = counts.shape
+
+    offsets = np.zeros(height * width + 1, dtype=np.int64)
+    np.cumsum(counts.ravel(), out=offsets[1:])
+    total = int(offsets[-1])
+
+    os.makedirs(output_dir, exist_ok=True)
+    np.save(os.path.join(output_dir, 'offsets.npy'), offsets)
+    np.save(os.path.join(output_dir, 'size.npy'), np.array([height, width], dtype=np.int64))
+    t_out = np.lib.format.open_memmap(os.path.join(output_dir, 't.npy'), mode='w+', dtype=np.int64,
+                                      shape=(total,))
+    p_out = np.lib.format.open_memmap(os.path.join(output_dir, 'p.npy'), mode='w+', dtype=np.uint8,
+                                      shape=(total,))
+
+    # second pass: scatter each slice after the events already written for its pixels
+    cursor = offsets[:-1].copy()
+    for batch in iter_file_batches(input_path):
+        keys = batch.y.astype(np.int64) * width + batch.x
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        first = np.searchsorted(keys, keys, side='left')
+        positions = cursor[keys] + (np.arange(len(keys)) - first)
+        t_out[positions] = batch.t[order]
+        p_out[positions] = batch.p[order]
+        cursor += np.bincount(keys, minlength=len(cursor))
+    t_out.flush()
+    p_out.flush()
+    del t_out, p_out
+    return PixelStore(output_dir)
+
+
+class PixelStore(object):
+    """
+    Read access to a pixel-major event store built by `build_pixel_store`.
+
+    Queries return EventBatch objects. The events of a pixel are sorted by time, and queries over several
+    pixels return the events pixel by pixel (row-major order of the pixels).
+
+    Args:
+        path (str): Path to the store directory.
+
+    Examples:
+        >>> store = PixelStore("recording.pxs")
+        >>> batch = store.pixel(640, 360, tmin=0, tmax=100000)
+        >>> plt.plot(batch.t, batch.p)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.t = np.load(os.path.join(path, 't.npy'), mmap_mode='r')
+        self.p = np.load(os.path.join(path, 'p.npy'), mmap_mode='r')
+        self.height, self.width = [int(v) for v in np.load(os.path.join(path, 'size.npy'))]
+
+    def __len__(self):
+        return len(self.t)
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'PixelStore: path {} \n'.format(self.path)
+        wrd += 'Width {}, Height  {}\n'.format(self.width, self.height)
+        wrd += 'events : {}\n'.format(len(self))
+        return wrd
+
+    def get_size(self):
+        """Function returning the size of the imager which produced the events.
+
+        Returns:
+            Tuple of int (height, width)
+        """
+        return self.height, self.width
+
+    def counts(self):
+        """Returns the (height, width) image of the number of events of each pixel."""
+        return np.diff(self.offsets).reshape(self.height, self.width)
+
+    def count(self, x, y):
+        """Returns the number of events of pixel (x, y)."""
+        key = y * self.width + x
+        return int(self.offsets[key + 1] - self.offsets[key])
+
+    def pixel(self, x, y, tmin=None, tmax=None, polarity=None):
+        """
+        Returns the events of pixel (x, y) with tmin <= t <= tmax.
+
+        The time range is found by binary search in the pixel slice, so only the matching events are read.
+
+        Args:
+            x, y (int): Pixel coordinates.
+            tmin, tmax (int): Time range in us.
+            polarity (int): Keeps only the events of this polarity.
+
+        Returns:
+            an EventBatch sorted by time, empty for a pixel outside of the sensor
+        """
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return EventBatch.empty()
+        key = y * self.width + x
+        start, stop = int(self.offsets[key]), int(self.offsets[key + 1])
+        t = self.t[start:stop]
+        if tmin is not None:
+            start += int(np.searchsorted(t, tmin, side='left'))
+        if tmax is not None:
+            stop = int(self.offsets[key]) + int(np.searchsorted(t, tmax, side='right'))
+        t = np.array(self.t[start:stop])
+        p = np.array(self.p[start:stop])
+        if polarity is not None:
+            mask = p == polarity
+            t, p = t[mask], p[mask]
+        return EventBatch.from_columns(np.full(len(t), x, dtype=np.uint16), np.full(len(t), y, dtype=np.uint16),
+                                       p, t)
+
+    def pixels(self, x, y, tmin=None, tmax=None, polarity=None):
+        """
+        Returns the events of several pixels, given by arrays of coordinates.
+
+        Pixels outside of the sensor have no events: they are left out before computing their keys, which would
+        otherwise point to the events of other pixels.
+
+        Args:
+            x, y (numpy array): Pixel coordinates.
+            tmin, tmax (int): Time range in us.
+            polarity (int): Keeps only the events of this polarity.
+
+        Returns:
+            an EventBatch, holding the events of each pixel in turn
+        """
+        x = np.asarray(x, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        keys = y[inside] * self.width + x[inside]
+        starts = np.asarray(self.offsets[keys])
+        lengths = np.asarray(self.offsets[keys + 1]) - starts
+        # index of every event of the selected pixels, in one vectorized gather
+        total = int(lengths.sum())
+        index = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(total)
+        t = self.t[index]
+        p = self.p[index]
+        ev_keys = np.repeat(keys, lengths)
+        mask = None
+        if tmin is not None:
+            mask = t >= tmin
+        if tmax is not None:
+            mask = t <= tmax if mask is None else mask & (t <= tmax)
+        if polarity is not None:
+            mask = p == polarity if mask is None else mask & (p == polarity)
+        if mask is not None:
+            t, p, ev_keys = t[mask], p[mask], ev_keys[mask]
+        return EventBatch.from_columns(ev_keys % self.width, ev_keys // self.width, p, t)
+
+    def row(self, y, xmin=0, xmax=None, tmin=None, tmax=None, polarity=None):
+        """Returns the events of the pixels (xmin..xmax, y), bounds included. See `pixels`."""
+        xmax = self.width - 1 if xmax is None else xmax
+        x = np.arange(xmin, xmax + 1)
+        return self.pixels(x, np.full(len(x), y), tmin=tmin, tmax=tmax, polarity=polarity)
+
+    def column(self, x, ymin=0, ymax=None, tmin=None, tmax=None, polarity=None):
+        """Returns the events of the pixels (x, ymin..ymax), bounds included. See `pixels`."""
+        ymax = self.height - 1 if ymax is None else ymax
+        y = np.arange(ymin, ymax + 1)
+        return self.pixels(np.full(len(y), x), y, tmin=tmin, tmax=tmax, polarity=polarity)
@@ -2,11 +2,12 @@ import os
 import shutil
 import time
 import argparse
-import pandas as pd
-import numpy as np
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 from metavision_core.event_io import EventsIterator
+from csv_tools import CSVWriter
+from event_query import query_events
+from event_render import render_events
 
 def parse_args():
     """Parse command line arguments."""
@@ -33,85 +34,24 @@ def convert_raw_to_csv(event_file_path, start_ts=0, max_duration=1e6*60, delta_t
         return output_file
 
     mv_iterator = EventsIterator(input_path=event_file_path, delta_t=delta_t, start_ts=start_ts, max_duration=max_duration)
+    height, width = mv_iterator.get_size()
 
-    with open(output_file, 'w') as csv_file:
+    with CSVWriter(output_file, height=height, width=width) as csv_writer:
         for evs in tqdm(mv_iterator, total=max_duration // delta_t):
-            for (x, y, p, t) in evs:
-                csv_file.write("%d,%d,%d,%d\n" % (x, y, p, t))
+            csv_writer.write(evs)
 
     print(f"Conversion completed: {output_file}")
     return output_file
 
 def plot_lines_polarity_over_time(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polarity=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
+    # Read the events inside the specified x, y, time and polarity ranges
+    df = query_events(input_csv, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax), p=polarity, as_dataframe=True)
 
-    # Apply time filtering if specified
-    if tmin is not None:
-        df = df[df['t'] >= tmin]
-    if tmax is not None:
-        df = df[df['t'] <= tmax]
-
-    # Apply polarity filtering if specified
-    if polarity is not None:
-        df = df[df['p'] == polarity]
-
-    # Filter the DataFrame based on the specified x and y range
-    df = df[(df['x'] >= xmin) & (df['x'] <= xmax) & (df['y'] >= ymin) & (df['y'] <= ymax)]
-
-    # Reset DataFrame index
-    df.reset_index(drop=True, inplace=True)
-
-    # Create bins for time and y values
-    time_bins = np.linspace(df['t'].min(), df['t'].max(), num=500)
-    y_bins = np.arange(ymin, ymax + 1)
-
-    # Create a 2D histogram for density calculation
-    heatmap, xedges, yedges = np.histogram2d(df['t'], df['y'], bins=[time_bins, y_bins])
-
-    # Flatten the heatmap to get a list of densities
-    densities = heatmap.T.flatten()
-    densities = densities / densities.max()  # Normalize densities
-
-    # Ensure the index calculation fits within the density array bounds
-    time_indices = np.digitize(df['t'], bins=time_bins) - 1
-    y_indices = np.digitize(df['y'], bins=y_bins) - 1
-
-    # Clip the indices to ensure they are within bounds
-    time_indices = np.clip(time_indices, 0, heatmap.shape[1] - 1)
-    y_indices = np.clip(y_indices, 0, heatmap.shape[0] - 1)
-
-    # Create a valid density index for each event
-    density_indices = np.ravel_multi_index((y_indices, time_indices), heatmap.shape)
-    density_indices = np.clip(density_indices, 0, densities.size - 1)  # Ensure all indices are within bounds
-
-    # Debugging information
     print(f"Number of events: {len(df)}")
-    print(f"Density array shape: {densities.shape}")
-    print(f"Density indices shape: {density_indices.shape}")
-    print(f"Max density index: {density_indices.max()}")
-    print(f"Min density index: {density_indices.min()}")
-    print(f"Densities size: {densities.size}")
-    print(f"Density indices (first 10): {density_indices[:10]}")
 
-    # Plot the polarities over time with point sizes based on density
+    # Plot the polarities over time, colours blended by polarity and opacity growing with the event density
     plt.figure(figsize=(10, 6))
-    colors = ["C0", "C1"]
-    for y in range(ymax, ymin - 1, -1):
-        line_df = df[df['y'] == y]
-        if len(line_df) == 0:
-            continue
-
-        # Adjust indices to ensure they are within bounds
-        line_indices = line_df.index.to_numpy()
-        valid_indices = density_indices[line_indices]
-
-
-        # Clip valid_indices to avoid out-of-bounds error
-        valid_indices = np.clip(valid_indices, 0, densities.size - 1)
-        point_sizes = np.clip(densities[valid_indices], 0.05, 5)  # Smaller point sizes
-        colors_vec = [colors[p] for p in line_df['p']]
-        plt.scatter(line_df['t'], line_df['y'], s=point_sizes, c=colors_vec)
+    render_events(df['t'].values, df['y'].values, df['p'].values)
 
     plt.xlabel('Time (t)')
     plt.ylabel('Y coordinate')
@@ -1,10 +1,10 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
+from event_query import query_events
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Plot the polarity of multiple vertical lines of pixels over time.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('--ymin', type=int, required=True, help='Minimum Y coordinate of the vertical lines of pixels.')
     parser.add_argument('--ymax', type=int, required=True, help='Maximum Y coordinate of the vertical lines of pixels.')
     parser.add_argument('--xmin', type=int, required=True, help='Minimum X coordinate of the vertical lines of pixels.')
@@ -15,24 +15,14 @@ def parse_args():
     return parser.parse_args()
 
 def plot_lines_polarity_over_time(input_csv, xmin, xmax, ymin, ymax, tmin=None, tmax=None, polarity=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
-
-    # Apply time filtering if specified
-    if tmin is not None:
-        df = df[df['t'] >= tmin]
-    if tmax is not None:
-        df = df[df['t'] <= tmax]
-
-    # Apply polarity filtering if specified
-    if polarity is not None:
-        df = df[df['p'] == polarity]
+    # Read the events inside the specified x, y, time and polarity ranges
+    df = query_events(input_csv, x=(xmin, xmax), y=(ymin, ymax), t=(tmin, tmax), p=polarity, as_dataframe=True)
 
     # Plot the polarities over time, shifting each line's plot to the right
     plt.figure(figsize=(10, 6))
     for idx, x in enumerate(range(xmin, xmax + 1)):
-        line_df = df[(df['x'] == x) & (df['y'] >= ymin) & (df['y'] <= ymax)]
-        plt.scatter(line_df['t'], line_df['p'] + idx * 2, label=f'Line at x={x}', s=10)
+        line_df = df[df['x'] == x]
+        plt.scatter(line_df['t'], line_df['p'].astype(int) + idx * 2, label=f'Line at x={x}', s=10)
 
     plt.xlabel('Time (t)')
     plt.ylabel('Shifted Polarity (p)')
@@ -1,39 +1,33 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
+from event_query import query_events
+from pixel_store import PixelStore
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Plot the polarity of a horizontal line of pixels over time.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('--xmin', type=int, required=True, help='Minimum X coordinate of the horizontal line of pixels.')
     parser.add_argument('--xmax', type=int, required=True, help='Maximum X coordinate of the horizontal line of pixels.')
     parser.add_argument('-y', '--y-coordinate', type=int, required=True, help='Y coordinate of the horizontal line of pixels.')
     parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
     parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
     parser.add_argument('--polarity', type=int, choices=[0, 1], help='Filter events by polarity: 0 for negative, 1 for positive.')
+    parser.add_argument('--pixel-store', required=False, default=None, help='Path to the pixel store of the recording, read instead of the CSV file.')
     return parser.parse_args()
 
-def plot_horizontal_line_polarity_over_time(input_csv, xmin, xmax, y, tmin=None, tmax=None, polarity=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
-
-    # Filter the DataFrame for the specified horizontal line of pixels
-    line_df = df[(df['y'] == y) & (df['x'] >= xmin) & (df['x'] <= xmax)]
-
-    # Apply time filtering if specified
-    if tmin is not None:
-        line_df = line_df[line_df['t'] >= tmin]
-    if tmax is not None:
-        line_df = line_df[line_df['t'] <= tmax]
-
-    # Apply polarity filtering if specified
-    if polarity is not None:
-        line_df = line_df[line_df['p'] == polarity]
+def plot_horizontal_line_polarity_over_time(input_csv, xmin, xmax, y, tmin=None, tmax=None, polarity=None, pixel_store=None):
+    # Read the events of the specified horizontal line of pixels inside the time and polarity ranges
+    if pixel_store is not None:
+        store = PixelStore(pixel_store)
+        line_events = {x: store.pixel(x, y, tmin=tmin, tmax=tmax, polarity=polarity) for x in range(xmin, xmax + 1)}
+    else:
+        line_df = query_events(input_csv, x=(xmin, xmax), y=y, t=(tmin, tmax), p=polarity, as_dataframe=True)
+        line_events = {x: line_df[line_df['x'] == x] for x in range(xmin, xmax + 1)}
 
     # Plot the polarities over time
     plt.figure(figsize=(10, 6))
     for x in range(xmin, xmax + 1):
-        pixel_df = line_df[line_df['x'] == x]
+        pixel_df = line_events[x]
         plt.scatter(pixel_df['t'], pixel_df['p'], label=f'Pixel ({x}, {y})', s=10)
 
     plt.xlabel('Time (t)')
@@ -45,7 +39,7 @@ def plot_horizontal_line_polarity_over_time(input_csv, xmin, xmax, y, tmin=None,
 
 def main():
     args = parse_args()
-    plot_horizontal_line_polarity_over_time(args.input_csv, args.xmin, args.xmax, args.y_coordinate, args.tmin, args.tmax, args.polarity)
+    plot_horizontal_line_polarity_over_time(args.input_csv, args.xmin, args.xmax, args.y_coordinate, args.tmin, args.tmax, args.polarity, args.pixel_store)
 
 if __name__ == "__main__":
     main()
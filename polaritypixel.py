@@ -1,28 +1,24 @@
-import pandas as pd
 import matplotlib.pyplot as plt
 import argparse
+from event_query import query_events
+from pixel_store import PixelStore
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Plot the polarity of a single pixel over time.')
-    parser.add_argument('-i', '--input-csv', required=True, help='Path to input CSV file.')
+    parser.add_argument('-i', '--input-csv', required=True, help='Path to input event file (CSV, DAT, NPY, EVZ, Parquet, HDF5, RAW or pixel store).')
     parser.add_argument('-x', '--x-coordinate', type=int, required=True, help='X coordinate of the pixel.')
     parser.add_argument('-y', '--y-coordinate', type=int, required=True, help='Y coordinate of the pixel.')
     parser.add_argument('--tmin', type=int, required=False, default=None, help='Minimum time threshold.')
     parser.add_argument('--tmax', type=int, required=False, default=None, help='Maximum time threshold.')
+    parser.add_argument('--pixel-store', required=False, default=None, help='Path to the pixel store of the recording, read instead of the CSV file.')
     return parser.parse_args()
 
-def plot_pixel_polarity(input_csv, x, y, tmin=None, tmax=None):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(input_csv, comment='#', names=['x', 'y', 'p', 't'])
-
-    # Filter the DataFrame for the specified pixel
-    pixel_df = df[(df['x'] == x) & (df['y'] == y)]
-
-    # Apply time filtering if specified
-    if tmin is not None:
-        pixel_df = pixel_df[pixel_df['t'] >= tmin]
-    if tmax is not None:
-        pixel_df = pixel_df[pixel_df['t'] <= tmax]
+def plot_pixel_polarity(input_csv, x, y, tmin=None, tmax=None, pixel_store=None):
+    # Read the events of the specified pixel inside the time range
+    if pixel_store is not None:
+        pixel_df = PixelStore(pixel_store).pixel(x, y, tmin=tmin, tmax=tmax)
+    else:
+        pixel_df = query_events(input_csv, x=x, y=y, t=(tmin, tmax), as_dataframe=True)
 
     # Plot the polarity over time
     plt.figure(figsize=(10, 6))
@@ -36,7 +32,7 @@ def plot_pixel_polarity(input_csv, x, y, tmin=None, tmax=None):
 
 def main():
     args = parse_args()
-    plot_pixel_polarity(args.input_csv, args.x_coordinate, args.y_coordinate, args.tmin, args.tmax)
+    plot_pixel_polarity(args.input_csv, args.x_coordinate, args.y_coordinate, args.tmin, args.tmax, args.pixel_store)
 
 if __name__ == "__main__":
     main()
@@ -8,7 +8,7 @@
 # See the License for the specific language governing permissions and limitations under the License.
 
 """
-This class loads events from DAT or NPY files
+This class loads events from DAT, NPY or EVZ files
 """
 
 import os
@@ -16,6 +16,7 @@ import numpy as np
 
 from . import dat_tools as dat
 from . import npy_tools as npy_format
+from . import evz_tools as evz
 
 
 class EventBaseReader(object):
@@ -431,3 +432,261 @@ class EventDatReader(EventBaseReader):
         assert isinstance(self._ev_size, int)
         self._dtype = self._binary_format.EV_TYPES[self.ev_type]
         self._decode_dtype = self._binary_format.DECODE_DTYPES[self.ev_type]
+
+
+class EventEvzReader(object):
+    """
+    EventEvzReader class to read EVZ block-compressed files.
+
+    It exposes the same cursor based interface as EventDatReader. Seeking uses the block index, so that
+    only the block containing the sought time or event is decoded. The last decoded blocks are cached.
+
+    Attributes:
+        path (string): Path to the file being read
+        current_time (int): Indicating the position of the cursor in the file in us
+        duration_s (int): Indicating the total duration of the file in seconds
+
+    Args:
+        event_file (str): file containing events
+        cache_size (int): Number of decoded blocks kept in memory
+    """
+
+    def __init__(self, event_file, cache_size=4):
+        self.path = event_file
+        self._extension = self.path.split('.')[-1]
+        assert self._extension == "evz", 'input file path = {}'.format(self.path)
+        self._binary_format = evz
+        self._file = open(self.path, "rb")
+        self._start, self._size, self._codec = self._binary_format.parse_header(self._file)
+        self._index = self._binary_format.read_index(self._file)
+        self._decode_dtype = self._binary_format.EV_DTYPE
+        self._block_starts = self._index['first_index'].astype(np.int64)
+        self._ev_count = int(self._index['count'].sum())
+        self._cache = {}
+        self._cache_size = cache_size
+        self._pos = 0
+        self.current_time = 0
+        if self._ev_count == 0:
+            print("WARNING: The event file is empty!!!")
+            self.done = True
+            self.duration_s = 0
+            self.first_ev_t = self.last_ev_t = 0
+        else:
+            self.done = False
+            self.first_ev_t = int(self._index['t_min'][0])
+            self.last_ev_t = int(self._index['t_max'][-1])
+            self.duration_s = (self.last_ev_t - self.first_ev_t) * 1e-6
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def __repr__(self):
+        """String representation of an `EventEvzReader` object.
+
+        Returns:
+            string describing the EventEvzReader state and attributes
+        """
+        wrd = 'EvzReader: {}\n'.format(self.path)
+        wrd += '-----------\n'
+        wrd += 'Codec: {}\n'.format(self._codec)
+        wrd += 'Block Count: {}\n'.format(len(self._index))
+        wrd += 'Event Count: {}\n'.format(self._ev_count)
+        wrd += 'Duration: {} s \n'.format(self.duration_s)
+        wrd += '-----------\n'
+        return wrd
+
+    def reset(self):
+        """Resets at beginning of file."""
+        self._pos = 0
+        self.done = False if self._ev_count else True
+        self.current_time = 0
+
+    def event_count(self):
+        """Getter on event_count.
+
+        Returns:
+            An int indicating the total number of events in the file
+        """
+        return self._ev_count
+
+    def current_event_index(self):
+        """Returns the number of event already loaded"""
+        return self._pos
+
+    def get_size(self):
+        """Function returning the size of the imager which produced the events.
+
+        Returns:
+            Tuple of int (height, width) which might be (None, None)"""
+        return self._size
+
+    def is_done(self):
+        """Returns True if the end of the file has been reached."""
+        return self.done
+
+    def _block(self, b):
+        """Returns the decoded events of block b."""
+        if b not in self._cache:
+            if len(self._cache) >= self._cache_size:
+                self._cache.pop(next(iter(self._cache)))
+            record = self._index[b]
+            self._file.seek(int(record['offset']))
+            payload = self._file.read(int(record['nbytes']))
+            self._cache[b] = self._binary_format.decode_block(payload, record, self._codec)
+        return self._cache[b]
+
+    def _read(self, start, stop):
+        """Returns the events of global indices [start, stop)."""
+        if stop <= start:
+            return np.empty((0,), dtype=self._decode_dtype)
+        first = np.searchsorted(self._block_starts, start, side='right') - 1
+        last = np.searchsorted(self._block_starts, stop - 1, side='right') - 1
+        chunks = []
+        for b in range(first, last + 1):
+            offset = self._block_starts[b]
+            chunks.append(self._block(b)[max(start - offset, 0):stop - offset])
+        return chunks[0].copy() if len(chunks) == 1 else np.concatenate(chunks)
+
+    def _index_of_time(self, ts):
+        """Returns the global index of the first event whose timestamp is superior or equal to ts."""
+        b = np.searchsorted(self._index['t_max'], ts, side='left')
+        if b >= len(self._index):
+            return self._ev_count
+        return int(self._block_starts[b]) + int(np.searchsorted(self._block(b)['t'], ts, side='left'))
+
+    def load_n_events(self, n_events):
+        """
+        Loads batch of n events.
+
+        Args:
+            n_events (int): Number of events that will be loaded
+
+        Returns:
+            events (numpy array): structured numpy array containing the events.
+        """
+        assert n_events > 0, "The number of events to slice is lower than 0!!!"
+        stop = min(self._pos + int(n_events), self._ev_count)
+        events = self._read(self._pos, stop)
+        self._pos = stop
+        self.done = self._pos >= self._ev_count
+        if events.size:
+            self.current_time = events["t"][-1]
+        return events
+
+    def load_delta_t(self, delta_t):
+        """
+        Loads events corresponding to a slice of time, starting from the reader's `current_time`.
+
+        Args:
+            delta_t (int): slice duration (in us).
+
+        Returns:
+            events (numpy array): structured numpy array containing the events.
+
+        Note that current time will be incremented by `delta_t`.
+        If an event is timestamped at exactly current_time it will not be loaded.
+        """
+        delta_t = int(delta_t)
+        if delta_t < 1:
+            raise ValueError("load_delta_t(): Delta_t must be at least 1 micro-second: {}".format(delta_t))
+
+        if self.done or self._pos >= self._ev_count:
+            self.done = True
+            return np.empty((0,), dtype=self._decode_dtype)
+
+        expected_time = self.current_time + delta_t
+        stop = max(self._index_of_time(expected_time), self._pos)
+        events = self._read(self._pos, stop)
+        self._pos = stop
+        self.done = self._pos >= self._ev_count
+        if self.done and self.last_ev_t < expected_time:
+            self.current_time = self.last_ev_t
+        else:
+            self.current_time = expected_time
+        return events
+
+    def load_mixed(self, n_events, delta_t):
+        """
+        Loads batch of n events or delta_t microseconds, whichever comes first.
+
+        Args:
+            n_events (int): Maximum number of events that will be loaded.
+            delta_t (int): Maximum allowed slice duration (in us).
+
+        Returns:
+            events (numpy array): structured numpy array containing the events.
+
+        Note that current time will be incremented to reach the timestamp of the first event not loaded yet.
+        However if the maximal time slice duration is reached, current time will be increased by delta_t instead.
+        """
+        previous_time = self.current_time
+        start = self._pos
+        events = self.load_n_events(n_events)
+        if not events.size:
+            return events
+
+        # let's check is the delta_t condition already met
+        if self.current_time - previous_time >= delta_t:
+            self.current_time = previous_time + delta_t
+            # then we only need a subset of the events.
+            index = np.searchsorted(events['t'], previous_time + delta_t)
+            events = events[:index]
+            self._pos = start + index
+            self.done = self._pos >= self._ev_count
+
+        return events
+
+    def seek_event(self, n_events):
+        """
+        Seeks in the file by `n_events` events
+
+        Args:
+            n_events (int): seek in the file the nth events
+        """
+        assert n_events > 0, f"Impossible to seek {n_events}th event!!!"
+        self._pos = min(int(n_events), self._ev_count)
+        self.current_time = self._read(self._pos - 1, self._pos)["t"][0]
+        self.done = self._pos >= self._ev_count
+
+    def seek_time(self, expected_time):
+        """Goes to the time expected_time inside the file.
+        Only the block containing expected_time is decoded, its position being given by the block index.
+
+        Args:
+            expected_time (int): Expected time
+        """
+        assert expected_time >= 0, "The seeked time should be at least above than or equal to 0!!!"
+        if self._ev_count > 0:
+            expected_time = int(expected_time)
+            if expected_time > self.last_ev_t:
+                self._pos = self._ev_count
+                self.done = True
+                self.current_time = self.last_ev_t
+                return
+            elif expected_time <= self.first_ev_t:
+                self._pos = 0
+                self.done = False
+                self.current_time = expected_time
+                return
+            self._pos = self._index_of_time(expected_time)
+            self.current_time = expected_time
+            self.done = self._pos >= self._ev_count
+
+    def get_last_ev_timestamp(self):
+        """
+        Returns the timestamp of the last event in us
+        """
+        return self.last_ev_t
+
+    def get_first_ev_timestamp(self):
+        """
+        Returns the timestamp of the first event in us
+        """
+        return self.first_ev_t
+
+    def __del__(self):
+        if hasattr(self, "_file"):
+            self._file.close()
@@ -0,0 +1,400 @@
+"""
+Spectra of displacement and polarity signals.
+
+Uniformly sampled signals (time step dt_us in us, frequencies in Hz):
+    -> rfft_spectrum: one-sided spectrum of a whole signal, optionally limited to a band
+    -> WelchPSD: power spectral density averaged over overlapping windowed segments, updated slice by slice
+       so that a long recording is processed in bounded memory
+    -> zoom_spectrum: spectrum of a narrow band evaluated with a zoom FFT (chirp z-transform), instead of
+       zero-padding the signal to reach the same resolution
+    -> GoertzelBank: DFT at a few frequencies, updated slice by slice
+    -> UniformResampler: linear interpolation of irregular samples (e.g. displacement samples) onto a uniform
+       grid, slice by slice
+
+Irregularly sampled signals (times t in us, e.g. centroid phases, cumulative polarity or polarity transitions of
+a pixel), without resampling them:
+    -> nudft: DFT at arbitrary frequencies
+    -> lomb_scargle: Lomb-Scargle periodogram
+    -> dominant_frequency: frequency of the highest peak, refined by zooming around it
+
+Signals can hold several channels: the last axis is the time, every other axis an independent channel.
+"""
+
+import numpy as np
+from scipy import signal as sps
+
+
+def _band_mask(freqs, band):
+    if band is None:
+        return slice(None)
+    fmin, fmax = band
+    return (freqs >= (fmin if fmin is not None else -np.inf)) & (freqs <= (fmax if fmax is not None else np.inf))
+
+
+def rfft_spectrum(x, dt_us=1, n_fft=None, band=None):
+    """
+    One-sided spectrum of a real signal.
+
+    Args:
+        x (numpy array): (channels..., n) samples.
+        dt_us (float): Time step in us.
+        n_fft (int): FFT size (the signal is zero-padded if larger than n).
+        band (tuple): (fmin, fmax) in Hz, the bins outside of it are not returned.
+
+    Returns:
+        freqs (numpy array): Frequencies in Hz
+        spectrum (numpy array): (channels..., num_freqs) complex spectrum
+    """
+    x = np.asarray(x)
+    n_fft = n_fft or x.shape[-1]
+    freqs = np.fft.rfftfreq(n_fft, d=dt_us * 1e-6)
+    spectrum = np.fft.rfft(x, n=n_fft, axis=-1)
+    mask = _band_mask(freqs, band)
+    return freqs[mask], spectrum[..., mask]
+
+
+def zoom_spectrum(x, fmin, fmax, num=1000, dt_us=1):
+    """
+    Spectrum of a real signal on `num` frequencies from fmin to fmax (bounds included), with a zoom FFT.
+
+    The frequency resolution is (fmax - fmin) / (num - 1), whatever the length of the signal.
+
+    Returns:
+        freqs (numpy array): Frequencies in Hz
+        spectrum (numpy array): (channels..., num) complex spectrum, as np.fft.fft would give at these frequencies
+    """
+    fs = 1e6 / dt_us
+    freqs = np.linspace(fmin, fmax, num)
+    spectrum = sps.zoom_fft(np.asarray(x), [fmin, fmax], m=num, fs=fs, endpoint=True, axis=-1)
+    return freqs, spectrum
+
+
+class WelchPSD(object):
+    """
+    Streaming Welch power spectral density.
+
+    Slices of samples are cut in segments of `nperseg` samples overlapping by `overlap`. The samples left after
+    the last complete segment are kept for the next slice, and only the sum of the periodograms is stored, so
+    the memory used does not depend on the length of the recording. With the default parameters the result is
+    the one of scipy.signal.welch(x, fs, window, nperseg, noverlap) over the concatenated slices.
+
+    Args:
+        nperseg (int): Number of samples per segment (the frequency resolution is 1 / (nperseg * dt)).
+        dt_us (float): Time step in us.
+        overlap (float): Fraction of overlap of consecutive segments.
+        window (str): Window, see scipy.signal.get_window.
+        detrend (bool): Whether to subtract the mean of each segment.
+        band (tuple): (fmin, fmax) in Hz, only the bins inside of it are accumulated.
+        max_segments (int): Maximum number of segments transformed at once.
+
+    Examples:
+        >>> welch = WelchPSD(2**14, dt_us=1, band=(0, 2000))
+        >>> for z in displacement_slices:
+        >>>     welch.update(z)
+        >>> freqs, psd = welch.psd()
+    """
+
+    def __init__(self, nperseg, dt_us=1, overlap=0.5, window='hann', detrend=True, band=None, max_segments=64):
+        self.nperseg = int(nperseg)
+        self.dt_us = dt_us
+        self.step = self.nperseg - int(self.nperseg * overlap)
+        self.window = sps.get_window(window, self.nperseg)
+        self.detrend = detrend
+        self.max_segments = max_segments
+        freqs = np.fft.rfftfreq(self.nperseg, d=dt_us * 1e-6)
+        self._mask = _band_mask(freqs, band)
+        self.freqs = freqs[self._mask]
+        # one-sided density scaling, the DC (and Nyquist) bins are not doubled
+        scale = np.full(len(freqs), 2 * dt_us * 1e-6 / (self.window ** 2).sum())
+        scale[0] /= 2
+        if self.nperseg % 2 == 0:
+            scale[-1] /= 2
+        self._scale = scale[self._mask]
+        self._buffer = None
+        self._sum = None
+        self.num_segments = 0
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'WelchPSD: segments of {} samples, step {}\n'.format(self.nperseg, self.step)
+        wrd += 'segments : {}, frequencies : {}\n'.format(self.num_segments, len(self.freqs))
+        return wrd
+
+    def update(self, samples):
+        """Adds the next (channels..., n) samples."""
+        x = np.asarray(samples, dtype=np.float64)
+        if self._buffer is not None:
+            x = np.concatenate((self._buffer, x), axis=-1)
+        num = (x.shape[-1] - self.nperseg) // self.step + 1 if x.shape[-1] >= self.nperseg else 0
+        if self._sum is None:
+            self._sum = np.zeros(x.shape[:-1] + (len(self.freqs),))
+        if num:
+            segments = np.lib.stride_tricks.sliding_window_view(x, self.nperseg, axis=-1)[..., ::self.step, :][..., :num, :]
+            for start in range(0, num, self.max_segments):
+                chunk = segments[..., start:start + self.max_segments, :]
+                if self.detrend:
+                    chunk = chunk - chunk.mean(axis=-1, keepdims=True)
+                spectrum = np.fft.rfft(chunk * self.window, axis=-1)[..., self._mask]
+                self._sum += (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=-2)
+            self.num_segments += num
+        self._buffer = np.array(x[..., num * self.step:])
+
+    def psd(self):
+        """
+        Returns:
+            freqs (numpy array): Frequencies in Hz
+            psd (numpy array): (channels..., num_freqs) power spectral density, in units**2 / Hz
+        """
+        if not self.num_segments:
+            raise ValueError("WelchPSD: less than {} samples received".format(self.nperseg))
+        return self.freqs, self._sum / self.num_segments * self._scale
+
+
+class GoertzelBank(object):
+    """
+    DFT of a real signal at a few arbitrary frequencies, updated slice by slice with the Goertzel recursion.
+
+    `spectrum` gives the same values as np.fft.fft over all the samples received, evaluated at the requested
+    frequencies (which do not have to be multiples of the frequency resolution).
+
+    Args:
+        freqs (numpy array): Frequencies in Hz.
+        dt_us (float): Time step in us.
+
+    Examples:
+        >>> bank = GoertzelBank([990, 1000, 1010], dt_us=1)
+        >>> for z in displacement_slices:
+        >>>     bank.update(z)
+        >>> amplitudes = 2 * np.abs(bank.spectrum()) / bank.num_samples
+    """
+
+    def __init__(self, freqs, dt_us=1):
+        self.freqs = np.atleast_1d(np.asarray(freqs, dtype=np.float64))
+        self.dt_us = dt_us
+        self._omega = 2 * np.pi * self.freqs * dt_us * 1e-6
+        self._coeff = 2 * np.cos(self._omega)
+        # last two values of the recursion, s[n - 1] and s[n - 2], per frequency
+        self._state = None
+        self.num_samples = 0
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'GoertzelBank: {} frequencies\n'.format(len(self.freqs))
+        wrd += 'samples : {}\n'.format(self.num_samples)
+        return wrd
+
+    def update(self, samples):
+        """Adds the next (channels..., n) samples."""
+        x = np.asarray(samples, dtype=np.float64)
+        if not x.shape[-1]:
+            return
+        if self._state is None:
+            self._state = np.zeros((len(self.freqs), 2) + x.shape[:-1])
+        for i, c in enumerate(self._coeff):
+            s1, s2 = self._state[i]
+            # s[n] = x[n] + c s[n - 1] - s[n - 2], initial conditions of lfilter from s[-1] and s[-2]
+            zi = np.stack((c * s1 - s2, -s1), axis=-1)
+            s, _ = sps.lfilter([1.], [1., -c, 1.], x, axis=-1, zi=zi)
+            if s.shape[-1] > 1:
+                self._state[i] = s[..., -1], s[..., -2]
+            else:
+                self._state[i] = s[..., -1], s1
+        self.num_samples += x.shape[-1]
+
+    def spectrum(self):
+        """Returns the (channels..., num_freqs) complex DFT of the samples received at the frequencies."""
+        if self._state is None:
+            raise ValueError("GoertzelBank: no sample received")
+        omega = self._omega.reshape((-1,) + (1,) * (self._state.ndim - 2))
+        s1, s2 = self._state[:, 0], self._state[:, 1]
+        y = s1 - np.exp(-1j * omega) * s2
+        return np.moveaxis(y * np.exp(-1j * omega * (self.num_samples - 1)), 0, -1)
+
+
+class UniformResampler(object):
+    """
+    Linear interpolation of irregular (t, value) samples onto the grid t0 + k * dt_us, slice by slice.
+
+    The last sample of a slice is kept, so that the grid points between two slices are interpolated too.
+
+    Args:
+        dt_us (float): Time step of the grid in us.
+        t0 (float): First grid point (time of the first sample if None).
+    """
+
+    def __init__(self, dt_us=1, t0=None):
+        self.dt_us = dt_us
+        self.t0 = t0
+        self._last = None
+        self._next = 0
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'UniformResampler: step {} us, next grid point {}\n'.format(self.dt_us, self._next)
+        return wrd
+
+    def update(self, t, values):
+        """
+        Adds the next samples, sorted by time.
+
+        Returns:
+            grid (numpy array): New grid points in us
+            resampled (numpy array): Values interpolated at these points
+        """
+        t = np.asarray(t, dtype=np.float64)
+        values = np.asarray(values)
+        if self._last is not None:
+            t = np.concatenate(([self._last[0]], t))
+            values = np.concatenate(([self._last[1]], values))
+        if not len(t):
+            return np.empty((0,)), np.empty((0,), dtype=values.dtype)
+        if self.t0 is None:
+            self.t0 = t[0]
+        stop = int(np.floor((t[-1] - self.t0) / self.dt_us)) + 1
+        grid = self.t0 + np.arange(self._next, max(stop, self._next)) * self.dt_us
+        self._next = max(stop, self._next)
+        self._last = (t[-1], values[-1])
+        if np.iscomplexobj(values):
+            return grid, np.interp(grid, t, values.real) + 1j * np.interp(grid, t, values.imag)
+        return grid, np.interp(grid, t, values)
+
+
+MAX_BLOCK_ELEMENTS = 2**22
+
+
+def _frequency_blocks(num_freqs, num_samples, max_elements=MAX_BLOCK_ELEMENTS):
+    """Yields slices of frequencies whose (frequencies, samples) arrays have at most max_elements elements."""
+    size = max(1, max_elements // max(1, num_samples))
+    for start in range(0, num_freqs, size):
+        yield slice(start, start + size)
+
+
+def _center(t, y):
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # times in s relative to the middle of the recording, to keep the phases small
+    ts = (t - (t[0] + t[-1]) / 2) * 1e-6 if len(t) else t
+    return ts, y - y.mean(axis=-1, keepdims=True)
+
+
+def nudft(t, y, freqs, center=False, max_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Non-uniform DFT, sum over the samples of y * exp(-2j pi f t), at arbitrary frequencies.
+
+    The frequencies are processed by blocks, so that at most max_elements complex exponentials are computed at
+    once, and all the signals are transformed by one matrix product per block.
+
+    Args:
+        t (numpy array): (n,) times in us, shared by the signals.
+        y (numpy array): (signals..., n) values.
+        freqs (numpy array): Frequencies in Hz.
+        center (bool): Whether to subtract the mean of each signal, and to take the times relative to the middle
+            of the recording (which only changes the phase of the result).
+
+    Returns:
+        (signals..., num_freqs) complex spectrum
+    """
+    freqs = np.atleast_1d(np.asarray(freqs, dtype=np.float64))
+    if center:
+        ts, y = _center(t, y)
+    else:
+        ts, y = np.asarray(t, dtype=np.float64) * 1e-6, np.asarray(y, dtype=np.float64)
+    spectrum = np.empty(y.shape[:-1] + (len(freqs),), dtype=np.complex128)
+    for block in _frequency_blocks(len(freqs), len(ts), max_elements):
+        phase = np.outer(-2 * np.pi * freqs[block], ts)
+        spectrum[..., block] = y @ np.cos(phase).T + 1j * (y @ np.sin(phase).T)
+    return spectrum
+
+
+def lomb_scargle(t, y, freqs, normalize=False, max_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Lomb-Scargle periodogram of irregularly sampled signals.
+
+    Scargle's form, with the time offset tau that makes the sine and cosine terms orthogonal at each frequency.
+    The signals are centered and the times taken relative to the middle of the recording. The frequencies are
+    processed by blocks of at most max_elements (frequencies, samples) elements, and all the signals share the
+    sums over the samples of each block.
+
+    Args:
+        t (numpy array): (n,) times in us, shared by the signals.
+        y (numpy array): (signals..., n) values.
+        freqs (numpy array): Frequencies in Hz (not angular frequencies, unlike scipy.signal.lombscargle).
+        normalize (bool): Whether to divide by the variance of the signals (the result is then in [0, 1]).
+
+    Returns:
+        (signals..., num_freqs) periodogram
+
+    Examples:
+        >>> power = lomb_scargle(events.t, cum, np.linspace(1, 2000, 4000))
+    """
+    freqs = np.atleast_1d(np.asarray(freqs, dtype=np.float64))
+    ts, y = _center(t, y)
+    power = np.empty(y.shape[:-1] + (len(freqs),))
+    for block in _frequency_blocks(len(freqs), len(ts), max_elements):
+        phase = np.outer(2 * np.pi * freqs[block], ts)
+        cos, sin = np.cos(phase), np.sin(phase)
+        cc = (cos * cos).sum(axis=1)
+        ss = len(ts) - cc
+        cs = (cos * sin).sum(axis=1)
+        # 2 w tau = atan2(sum sin 2wt, sum cos 2wt)
+        two_wtau = np.arctan2(2 * cs, cc - ss)
+        c, s = np.cos(two_wtau / 2), np.sin(two_wtau / 2)
+        yc, ys = y @ cos.T, y @ sin.T
+        cos_tau = c * c * cc + 2 * c * s * cs + s * s * ss
+        sin_tau = c * c * ss - 2 * c * s * cs + s * s * cc
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p_cos = (c * yc + s * ys) ** 2 / cos_tau
+            p_sin = np.where(sin_tau > 1e-12 * len(ts), (c * ys - s * yc) ** 2 / sin_tau, 0.)
+        power[..., block] = 0.5 * (p_cos + p_sin)
+    if normalize:
+        power *= 2 / (y * y).sum(axis=-1, keepdims=True)
+    return power
+
+
+def dominant_frequency(t, y, fmin=None, fmax=None, oversampling=5, zoom_points=64, zoom_steps=3,
+                       max_elements=MAX_BLOCK_ELEMENTS):
+    """
+    Frequency of the highest Lomb-Scargle peak of irregularly sampled signals.
+
+    The periodogram is first computed on a grid of step 1 / (oversampling * duration), then evaluated again on
+    zoom_points frequencies around the peak of each signal, zoom_steps times, each time over the two neighbouring
+    steps of the previous grid.
+
+    Args:
+        t (numpy array): (n,) times in us, shared by the signals.
+        y (numpy array): (signals..., n) values.
+        fmin, fmax (float): Frequency range in Hz (1 / duration and half the mean sampling rate if None).
+
+    Returns:
+        freq (numpy array): (signals...) frequencies in Hz
+        power (numpy array): (signals...) periodogram at these frequencies
+
+    Examples:
+        >>> freq, _ = dominant_frequency(result['t'], result['z'], fmin=10, fmax=2000)
+    """
+    t = np.asarray(t, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    duration = (t[-1] - t[0]) * 1e-6
+    if duration <= 0:
+        raise ValueError("dominant_frequency: the samples span no time")
+    fmin = 1 / duration if fmin is None else fmin
+    fmax = 0.5 * (len(t) - 1) / duration if fmax is None else fmax
+    step = 1 / (oversampling * duration)
+    freqs = np.arange(fmin, fmax + step / 2, step)
+    power = lomb_scargle(t, y, freqs, max_elements=max_elements)
+    peak = np.argmax(power, axis=-1)
+    freq, best = freqs[peak], np.take_along_axis(power, peak[..., None], axis=-1)[..., 0]
+
+    # every signal has its own grid around its peak, evaluated one signal at a time
+    flat_y = y.reshape(-1, y.shape[-1])
+    flat_freq, flat_best = freq.reshape(-1).copy(), best.reshape(-1).copy()
+    for i in range(len(flat_y)):
+        width = step
+        for _ in range(zoom_steps):
+            grid = np.linspace(max(fmin, flat_freq[i] - width), min(fmax, flat_freq[i] + width), zoom_points)
+            zoom = lomb_scargle(t, flat_y[i], grid, max_elements=max_elements)
+            k = np.argmax(zoom)
+            if zoom[k] >= flat_best[i]:
+                flat_freq[i], flat_best[i] = grid[k], zoom[k]
+            width = grid[1] - grid[0]
+    return flat_freq.reshape(freq.shape), flat_best.reshape(best.shape)
@@ -0,0 +1,26 @@
+import numpy as np
+
+from analysis_cache import AnalysisCache
+
+
+def test_new_version_misses_the_cache(tmp_path):
+    source = tmp_path / 'events.csv'
+    source.write_bytes(b'x,y,p,t\n1,2,1,10\n')
+    cache = AnalysisCache(cache_dir=str(tmp_path / 'cache'))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'counts': np.arange(len(calls))}
+
+    first = cache.cached('counts', str(source), compute, version=1, t=(0, 10))
+    assert len(calls) == 1
+    np.testing.assert_array_equal(cache.cached('counts', str(source), compute, version=1, t=(0, 10))['counts'],
+                                  first['counts'])
+    assert len(calls) == 1
+    bumped = cache.cached('counts', str(source), compute, version=2, t=(0, 10))
+    assert len(calls) == 2
+    np.testing.assert_array_equal(bumped['counts'], [0, 1])
+    # the entry of the previous version is still there for the code computing it
+    cache.cached('counts', str(source), compute, version=1, t=(0, 10))
+    assert len(calls) == 2
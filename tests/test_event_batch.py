@@ -0,0 +1,35 @@
+import numpy as np
+
+from event_batch import EVENT_CD_DTYPE, iter_file_batches, get_file_size, concatenate
+from evz_tools import EvzWriter
+
+
+def _events(n=50000, seed=0):
+    rng = np.random.default_rng(seed)
+    events = np.zeros(n, dtype=EVENT_CD_DTYPE)
+    events['x'] = rng.integers(0, 640, n)
+    events['y'] = rng.integers(0, 480, n)
+    events['p'] = rng.integers(0, 2, n)
+    events['t'] = np.sort(rng.integers(0, 2000000, n))
+    return events
+
+
+def test_evz_round_trip(tmp_path):
+    events = _events()
+    path = str(tmp_path / 'events.evz')
+    with EvzWriter(path, height=480, width=640, block_size=1000) as writer:
+        writer.write(events)
+
+    assert get_file_size(path) == (480, 640)
+    batch = concatenate(list(iter_file_batches(path)))
+    for name in ('x', 'y', 'p', 't'):
+        np.testing.assert_array_equal(batch[name], events[name])
+
+    ranges = dict(xmin=100, xmax=200, ymin=50, ymax=400, tmin=500000, tmax=900000, polarity=1)
+    batches = list(iter_file_batches(path, **ranges))
+    batch = concatenate(batches)
+    mask = ((events['x'] >= 100) & (events['x'] <= 200) & (events['y'] >= 50) & (events['y'] <= 400) &
+            (events['t'] >= 500000) & (events['t'] <= 900000) & (events['p'] == 1))
+    for name in ('x', 'y', 'p', 't'):
+        np.testing.assert_array_equal(batch[name], events[name][mask])
+    assert all(np.all(np.diff(b.t) >= 0) for b in batches)
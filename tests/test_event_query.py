@@ -0,0 +1,24 @@
+import numpy as np
+
+import csv_tools
+from event_query import query_events
+from pixel_store import build_pixel_store
+
+
+def test_pixel_store_query_ranges_past_the_edge(tmp_path):
+    rng = np.random.default_rng(2)
+    n = 20000
+    events = {'x': rng.integers(0, 64, n), 'y': rng.integers(0, 48, n), 'p': rng.integers(0, 2, n),
+              't': np.sort(rng.integers(0, 1000000, n))}
+    path = tmp_path / 'events.csv'
+    path.write_bytes(b'%geometry:64,48\n' + bytes(csv_tools.format_events(events)))
+    store = str(tmp_path / 'events.pxs')
+    build_pixel_store(str(path), store)
+
+    for x, y in (((60, 70), 10), ((60, 70), 47), (5, (40, 60)), ((-5, 3), (-2, 1))):
+        batch = query_events(store, x=x, y=y)
+        expected = query_events(str(path), x=x, y=y)
+        np.testing.assert_array_equal(np.sort(batch.t), np.sort(expected.t))
+        assert len(batch) == len(expected)
+    assert len(query_events(store, x=(64, 80))) == 0
+    assert len(query_events(store, y=(-3, -1))) == 0
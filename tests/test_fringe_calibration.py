@@ -0,0 +1,25 @@
+import numpy as np
+
+from fringe_calibration import FringeCalibration
+from fringe_displacement import fringe_displacement
+
+
+def _calibration():
+    tables = [np.linspace(0, 6, 20), np.linspace(1, 5, 10)]
+    return FringeCalibration([10, 20], [14, 24], [100, 105], tables, [20., 10.], [4, 4])
+
+
+def test_lookup():
+    phase, inside = _calibration().lookup([5, 12, 12, 22, 22], [100, 100, 120, 104, 110])
+    np.testing.assert_array_equal(inside, [False, True, False, False, True])
+    np.testing.assert_allclose(phase, [0, np.linspace(1, 5, 10)[5]])
+
+
+def test_empty_calibration():
+    calibration = _calibration().select(30, 40)
+    assert len(calibration) == 0
+    phase, inside = calibration.lookup([12, 22], [100, 110])
+    assert len(phase) == 0 and not inside.any()
+    result = fringe_displacement(np.array([1, 2]), np.array([100, 110]), np.array([1, 1]), x=np.array([12, 22]),
+                                 calibration=calibration)
+    assert len(result['t']) == 0
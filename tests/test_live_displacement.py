@@ -0,0 +1,10 @@
+import numpy as np
+import pytest
+
+from live_displacement import LiveDisplacementEstimator
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'y0': 10}, {'phiroi': np.zeros(5)}])
+def test_phase_table_or_calibration_required(kwargs):
+    with pytest.raises(ValueError):
+        LiveDisplacementEstimator(xmin=0, xmax=5, **kwargs)
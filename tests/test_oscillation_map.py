@@ -0,0 +1,30 @@
+import numpy as np
+
+from oscillation_map import OscillationMapAccumulator
+
+
+def _slice(periods, start, stop, rng):
+    """Events of pixels switching polarity every half period, for the half periods [start, stop)."""
+    height, width = periods.shape
+    k = np.arange(start, stop)
+    y, x, k = [a.ravel() for a in np.meshgrid(np.arange(height), np.arange(width), k, indexing='ij')]
+    t = k * periods[y, x] // 2 + rng.integers(0, 3, len(k))
+    order = np.argsort(t, kind='stable')
+    return {'x': x[order], 'y': y[order], 'p': k[order] % 2, 't': t[order]}
+
+
+def test_median_period_and_bounded_state():
+    rng = np.random.default_rng(0)
+    periods = 100 + 10 * np.arange(12)[None, :] + np.arange(8)[:, None]
+    oscillations = OscillationMapAccumulator(workers=2, tile_rows=4)
+    oscillations.update(_slice(periods, 0, 40, rng))
+    num_bins = len(oscillations._keys)
+    for start in range(40, 400, 40):
+        oscillations.update(_slice(periods, start, start + 40, rng))
+    maps = oscillations.maps()
+    assert maps['count'].shape == periods.shape
+    # 400 events per pixel: 399 transitions, the first one of each direction starts the periods
+    assert np.all(maps['count'] == 397)
+    np.testing.assert_allclose(maps['median_period'], periods, rtol=0.02)
+    # the periods are counted in histograms, the state does not grow with the number of slices
+    assert len(oscillations._keys) <= 2 * num_bins
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+import csv_tools
+from pixel_store import build_pixel_store
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(1)
+    n = 20000
+    events = {'x': rng.integers(0, 64, n), 'y': rng.integers(0, 48, n), 'p': rng.integers(0, 2, n),
+              't': np.sort(rng.integers(0, 1000000, n))}
+    path = tmp_path / 'events.csv'
+    path.write_bytes(b'%geometry:64,48\n' + bytes(csv_tools.format_events(events)))
+    return build_pixel_store(str(path), str(tmp_path / 'events.pxs')), events
+
+
+def _expected(events, mask):
+    return np.sort(events['t'][mask])
+
+
+def test_row_past_the_edge(store):
+    store, events = store
+    batch = store.row(10, xmin=60, xmax=70)
+    assert np.all(batch.y == 10) and np.all(batch.x >= 60)
+    mask = (events['y'] == 10) & (events['x'] >= 60)
+    np.testing.assert_array_equal(np.sort(batch.t), _expected(events, mask))
+    # last row: the keys of the pixels past the edge would be past the end of the offsets
+    batch = store.row(47, xmin=60, xmax=70)
+    np.testing.assert_array_equal(np.sort(batch.t), _expected(events, (events['y'] == 47) & (events['x'] >= 60)))
+
+
+def test_column_past_the_edge(store):
+    store, events = store
+    batch = store.column(63, ymin=40, ymax=60)
+    assert np.all(batch.x == 63)
+    mask = (events['x'] == 63) & (events['y'] >= 40)
+    np.testing.assert_array_equal(np.sort(batch.t), _expected(events, mask))
+    assert len(store.column(-1)) == 0
+    assert len(store.pixel(64, 0)) == 0
+    assert len(store.pixels([-1, 64, 3], [0, 0, 48])) == 0
@@ -0,0 +1,225 @@
+"""
+Streaming fixed-width time binning of events.
+
+The bin of an event is (t - t0) // bin_us, and the number of OFF and ON events of every (ROI, bin) pair of a
+slice is counted with a single np.bincount. Only the last, possibly incomplete, bin is kept between slices:
+completed bins are either returned by `TimeBinner.pop` as soon as they are available, or collected until
+`TimeBinner.result`.
+
+Reducers:
+    -> 'count': number of events
+    -> 'on', 'off': number of events of polarity 1 and 0
+    -> 'signed': number of ON events minus number of OFF events
+"""
+
+import numpy as np
+
+from event_batch import iter_file_batches
+
+REDUCERS = ('count', 'on', 'off', 'signed')
+
+# ROIs are looked up in a label image unless it would have more pixels than this
+MAX_LABEL_PIXELS = 2**24
+
+
+class TimeBinner(object):
+    """
+    Bins chronologically ordered event slices in fixed-width time bins, for one or several ROIs.
+
+    Args:
+        bin_us (int): Width of the time bins in us.
+        rois (list): (xmin, xmax, ymin, ymax) ROIs, bounds included, each giving one channel of the time series.
+            All the events go to a single channel if None.
+        reducers (tuple): Values computed for each bin, among 'count', 'on', 'off' and 'signed'.
+        t0 (int): Start of the first bin in us (timestamp of the first event if None). Earlier events are ignored.
+
+    Examples:
+        >>> binner = TimeBinner(10, rois=[(100, 110, 200, 300), (400, 410, 200, 300)], reducers=('signed',))
+        >>> for evs in EventsIterator("recording.raw"):
+        >>>     binner.update(evs)
+        >>> series = binner.result()
+        >>> plt.plot(series['t'], series['signed'].T)
+    """
+
+    def __init__(self, bin_us, rois=None, reducers=('count',), t0=None):
+        for reducer in reducers:
+            if reducer not in REDUCERS:
+                raise ValueError("TimeBinner: unknown reducer {}, expected one of {}".format(reducer, REDUCERS))
+        self.bin_us = int(bin_us)
+        self.rois = None if rois is None else np.asarray(rois, dtype=np.int64).reshape(-1, 4)
+        self.reducers = tuple(reducers)
+        self.t0 = None if t0 is None else int(t0)
+        self.num_channels = 1 if self.rois is None else len(self.rois)
+        self._labels = self._label_image()
+        # bins before _base have been completed, bin _base is in _pending
+        self._base = 0
+        self._pending = np.zeros((self.num_channels, 0, 2), dtype=np.int64)
+        self._completed = []
+        self._completed_start = 0
+        self.ev_count = 0
+
+    def __repr__(self):
+        wrd = ''
+        wrd += 'TimeBinner: bins of {} us, {} channels\n'.format(self.bin_us, self.num_channels)
+        wrd += 'events : {}, bins : {}\n'.format(self.ev_count, self._base + self._pending.shape[1])
+        return wrd
+
+    def _label_image(self):
+        """Returns (label image, xmin, ymin) mapping pixels to ROI indices, or None if the ROIs overlap."""
+        if self.rois is None:
+            return None
+        x0, y0 = self.rois[:, 0].min(), self.rois[:, 2].min()
+        width = self.rois[:, 1].max() - x0 + 1
+        height = self.rois[:, 3].max() - y0 + 1
+        if width * height > MAX_LABEL_PIXELS:
+            return None
+        labels = np.full((height, width), -1, dtype=np.int64)
+        for i, (xmin, xmax, ymin, ymax) in enumerate(self.rois):
+            area = labels[ymin - y0:ymax - y0 + 1, xmin - x0:xmax - x0 + 1]
+            if (area >= 0).any():
+                return None
+            area[:] = i
+        return labels, x0, y0
+
+    def _channels(self, events, keep):
+        """Returns the (channel, event index) pairs of the events in `keep` falling inside the ROIs."""
+        index = np.flatnonzero(keep)
+        if self.rois is None:
+            return np.zeros(len(index), dtype=np.int64), index
+        x = np.asarray(events['x'], dtype=np.int64)[index]
+        y = np.asarray(events['y'], dtype=np.int64)[index]
+        if self._labels is not None:
+            labels, x0, y0 = self._labels
+            lx, ly = x - x0, y - y0
+            inside = (lx >= 0) & (lx < labels.shape[1]) & (ly >= 0) & (ly < labels.shape[0])
+            channel = np.full(len(index), -1, dtype=np.int64)
+            channel[inside] = labels[ly[inside], lx[inside]]
+            inside = channel >= 0
+            return channel[inside], index[inside]
+        # overlapping ROIs: an event is counted once per ROI holding it
+        channels, indices = [], []
+        for i, (xmin, xmax, ymin, ymax) in enumerate(self.rois):
+            inside = np.flatnonzero((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))
+            channels.append(np.full(len(inside), i, dtype=np.int64))
+            indices.append(index[inside])
+        return np.concatenate(channels), np.concatenate(indices)
+
+    def update(self, events):
+        """
+        Adds a slice of events, later than the ones already added.
+
+        Args:
+            events: structured array, EventBatch or dictionary of arrays with fields t and p (and x, y with ROIs)
+        """
+        t = np.asarray(events['t'], dtype=np.int64)
+        if not len(t):
+            return
+        if self.t0 is None:
+            self.t0 = int(t[0])
+        bins = (t - self.t0) // self.bin_us
+        if (bins[:-1] > bins[1:]).any():
+            raise ValueError("TimeBinner: events are not sorted by time")
+        keep = bins >= 0
+        if not keep[-1]:
+            return
+        if bins[np.argmax(keep)] < self._base:
+            raise ValueError("TimeBinner: events are earlier than the ones already added")
+        channel, index = self._channels(events, keep)
+        num_bins = int(bins[-1]) - self._base + 1
+        key = (channel * num_bins + (bins[index] - self._base)) * 2 + (np.asarray(events['p'])[index] == 1)
+        counts = np.bincount(key, minlength=self.num_channels * num_bins * 2).reshape(self.num_channels,
+                                                                                     num_bins, 2)
+        counts[:, :self._pending.shape[1]] += self._pending
+        if num_bins > 1:
+            self._completed.append(counts[:, :-1])
+        self._pending = counts[:, -1:].copy()
+        self._base = int(bins[-1])
+        self.ev_count += len(index)
+
+    def _reduce(self, counts, start):
+        series = {'t': self.t0 + (start + np.arange(counts.shape[1], dtype=np.int64)) * self.bin_us}
+        for reducer in self.reducers:
+            if reducer == 'count':
+                series[reducer] = counts[..., 0] + counts[..., 1]
+            elif reducer == 'on':
+                series[reducer] = counts[..., 1]
+            elif reducer == 'off':
+                series[reducer] = counts[..., 0]
+            else:
+                series[reducer] = counts[..., 1] - counts[..., 0]
+        return series
+
+    def pop(self):
+        """
+        Returns the bins completed since the last call, and forgets them.
+
+        Returns:
+            dictionary holding 't', the start of the bins in us, and a (num_channels, num_bins) array per reducer
+        """
+        if self._completed:
+            counts = np.concatenate(self._completed, axis=1)
+        else:
+            counts = np.zeros((self.num_channels, 0, 2), dtype=np.int64)
+        series = self._reduce(counts, self._completed_start)
+        self._completed = []
+        self._completed_start = self._base
+        return series
+
+    def result(self):
+        """
+        Returns the bins not returned by `pop` yet, including the last one, see `pop`.
+
+        The last bin is then complete, so later events can not be added any more.
+        """
+        num_pending = self._pending.shape[1]
+        self._completed.append(self._pending)
+        self._pending = np.zeros((self.num_channels, 0, 2), dtype=np.int64)
+        self._base += num_pending
+        return self.pop()
+
+
+def bin_events(events, bin_us, rois=None, reducers=('count',), t0=None):
+    """
+    Bins events held in memory, in any order (e.g. the result of a query on a pixel store).
+
+    Args:
+        events: structured array, EventBatch or dictionary of arrays with fields t and p (and x, y with ROIs)
+        bin_us, rois, reducers, t0: see `TimeBinner`.
+
+    Returns:
+        dictionary of the binned time series, see `TimeBinner.pop`
+    """
+    t = np.asarray(events['t'])
+    if len(t) > 1 and (t[:-1] > t[1:]).any():
+        order = np.argsort(t, kind='stable')
+        events = {name: np.asarray(events[name])[order] for name in ('x', 'y', 'p', 't')}
+    binner = TimeBinner(bin_us, rois=rois, reducers=reducers, t0=t0)
+    binner.update(events)
+    return binner.result()
+
+
+def bin_file(input_path, bin_us, rois=None, reducers=('count',), tmin=None, tmax=None, t0=None, callback=None,
+             delta_t=1000000):
+    """
+    Bins the events of a recording in one streaming pass.
+
+    Args:
+        input_path (str): Path to a CSV or EVZ file, or to a file supported by EventsIterator (RAW, DAT, HDF5).
+        bin_us (int): Width of the time bins in us.
+        rois (list): (xmin, xmax, ymin, ymax) ROIs, see `TimeBinner`.
+        reducers (tuple): Values computed for each bin, see `TimeBinner`.
+        tmin, tmax (int): Time range in us.
+        t0 (int): Start of the first bin in us (tmin, or timestamp of the first event if None).
+        callback (function): Called with the bins completed by each slice (see `TimeBinner.pop`), so that the
+            time series is not held in memory. The remaining bins are still returned at the end.
+        delta_t (int): Duration of the slices read by EventsIterator in us.
+
+    Returns:
+        dictionary of the binned time series, see `TimeBinner.pop`
+    """
+    binner = TimeBinner(bin_us, rois=rois, reducers=reducers, t0=tmin if t0 is None else t0)
+    for batch in iter_file_batches(input_path, delta_t=delta_t, tmin=tmin, tmax=tmax):
+        binner.update(batch)
+        if callback is not None:
+            callback(binner.pop())
+    return binner.result()